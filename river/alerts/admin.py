@@ -1,8 +1,15 @@
 from django.contrib import admin
-from .models import Alert
+from .models import Alert, AlertRule
 
 @admin.register(Alert)
 class AlertAdmin(admin.ModelAdmin):
     list_display = ['device', 'parameter', 'message', 'created_at', 'is_resolved']
     list_filter = ['parameter', 'is_resolved']
     search_fields = ['message', 'device__name']
+
+
+@admin.register(AlertRule)
+class AlertRuleAdmin(admin.ModelAdmin):
+    list_display = ['parameter', 'condition', 'device', 'min_value', 'max_value', 'hysteresis', 'is_active']
+    list_filter = ['parameter', 'condition', 'is_active']
+    list_select_related = ['device']
@@ -5,5 +5,5 @@ class AlertsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'alerts'
 
-def ready(self):
-    import alerts.signals
+    def ready(self):
+        import alerts.signals
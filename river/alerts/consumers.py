@@ -0,0 +1,19 @@
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from .delivery import ALERTS_GROUP
+
+
+# --- WebSocket Consumer: alert feed ---
+class AlertConsumer(AsyncWebsocketConsumer):
+    """Pushes {"type": "alerts", "items": [...]} frames as alerts are created."""
+
+    async def connect(self):
+        await self.channel_layer.group_add(ALERTS_GROUP, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(ALERTS_GROUP, self.channel_name)
+
+    async def send_alerts(self, event):
+        # Already serialized once by the delivery worker
+        await self.send(text_data=event["text"])
@@ -0,0 +1,269 @@
+import json
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.mail import send_mail
+from django.utils.module_loading import import_string
+
+
+ALERTS_GROUP = 'alerts'
+
+
+def alert_payload(alert):
+    """Same keys as AlertSerializer, plus the condition that fired."""
+    return {
+        'id': alert.pk,
+        'device': alert.device_id,
+        'parameter': alert.parameter,
+        'condition': alert.condition,
+        'message': alert.message,
+        'created_at': alert.created_at.isoformat() if alert.created_at else None,
+        'is_resolved': alert.is_resolved,
+    }
+
+
+# === Sinks ===
+# A sink delivers one batch of alert payloads and raises on failure; the
+# dispatcher retries it. Sinks with `rate_limited` only get each device's
+# first ALERT_RATE_LIMIT alerts per ALERT_RATE_WINDOW seconds.
+
+class Sink:
+    name = None
+    rate_limited = False
+
+    def deliver(self, alerts):
+        raise NotImplementedError
+
+
+class ChannelsSink(Sink):
+    """Pushes each batch as one {"type": "alerts", "items": [...]} frame to the `alerts` group."""
+    name = 'websocket'
+
+    def deliver(self, alerts):
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        async_to_sync(channel_layer.group_send)(ALERTS_GROUP, {
+            'type': 'send.alerts',
+            'text': json.dumps({'type': 'alerts', 'items': alerts}),
+        })
+
+
+class EmailSink(Sink):
+    """One digest email per batch through the configured EMAIL_BACKEND."""
+    name = 'email'
+    rate_limited = True
+
+    def __init__(self, recipients=()):
+        self.recipients = list(recipients)
+
+    def deliver(self, alerts):
+        if not self.recipients:
+            return
+        subject = f"[River] {len(alerts)} new alert{'s' if len(alerts) != 1 else ''}"
+        body = '\n'.join(f"{a['created_at']}  device {a['device']}  {a['message']}" for a in alerts)
+        send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, self.recipients)
+
+
+class WebhookSink(Sink):
+    """POSTs {"alerts": [...]} as JSON to `url`."""
+    name = 'webhook'
+    rate_limited = True
+
+    def __init__(self, url, timeout=5.0, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+
+    def deliver(self, alerts):
+        request = urllib.request.Request(
+            self.url, data=json.dumps({'alerts': alerts}).encode(), headers=self.headers, method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class LocalSink(Sink):
+    """Keeps delivered batches in memory; a stand-in for email/webhook in development and tests."""
+    name = 'local'
+
+    def __init__(self, rate_limited=False, max_batches=1000):
+        self.rate_limited = rate_limited
+        self.batches = deque(maxlen=max_batches)
+
+    def deliver(self, alerts):
+        self.batches.append(list(alerts))
+
+
+def build_sinks(config):
+    """Instantiate sinks from ALERT_SINKS entries: {'class': dotted path, **kwargs}."""
+    sinks = []
+    for entry in config:
+        options = dict(entry)
+        sinks.append(import_string(options.pop('class'))(**options))
+    return sinks
+
+
+# === Dispatcher ===
+class AlertDispatcher:
+    """
+    Delivers newly created alerts off the ingest thread.
+
+    publish() only enqueues (dropping when the queue is full), so it never
+    blocks the caller. A worker thread collects up to `batch_size` alerts
+    or waits `flush_interval` seconds, then hands the batch to every sink.
+    A failing sink gets the batch again after `backoff * 2**attempt`
+    seconds, up to `max_retries` times, without holding up the other sinks.
+    """
+
+    def __init__(self, sinks, batch_size=100, flush_interval=2.0, max_queue=10000,
+                 max_retries=5, backoff=1.0, rate_limit=5, rate_window=3600.0):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._retries = []          # [(due, attempt, sink, alerts)]
+        self._recent = {}           # device pk -> deque of delivery times to rate-limited sinks
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.counters = {'published': 0, 'dropped': 0, 'delivered': 0, 'suppressed': 0, 'retried': 0, 'failed': 0}
+
+    def _incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    # --- Producer side ---
+    def publish(self, alerts):
+        for alert in alerts:
+            try:
+                self.queue.put_nowait(alert_payload(alert))
+                self._incr('published')
+            except queue.Full:
+                self._incr('dropped')
+
+    # --- Worker lifecycle ---
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='alert-delivery', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while not (self._stop.is_set() and self.queue.empty() and not batch):
+            try:
+                batch.append(self.queue.get(timeout=max(0.0, min(deadline - time.monotonic(), 0.5))))
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline or self._stop.is_set():
+                if batch:
+                    self._dispatch(batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+            self._run_retries()
+
+    # --- Delivery ---
+    def _throttle(self, alerts):
+        """Alerts still within their device's rate limit; the rest are counted and dropped."""
+        now = time.monotonic()
+        allowed = []
+        for alert in alerts:
+            recent = self._recent.setdefault(alert['device'], deque())
+            while recent and recent[0] <= now - self.rate_window:
+                recent.popleft()
+            if len(recent) < self.rate_limit:
+                recent.append(now)
+                allowed.append(alert)
+        self._incr('suppressed', len(alerts) - len(allowed))
+        return allowed
+
+    def _dispatch(self, batch):
+        limited = self._throttle(batch) if any(sink.rate_limited for sink in self.sinks) else batch
+        for sink in self.sinks:
+            alerts = limited if sink.rate_limited else batch
+            if alerts:
+                self._deliver(sink, alerts, attempt=0)
+
+    def _deliver(self, sink, alerts, attempt):
+        try:
+            sink.deliver(alerts)
+            self._incr('delivered', len(alerts))
+        except Exception as e:
+            if attempt >= self.max_retries:
+                print(f"[Alerts] ❌ Giving up on {len(alerts)} alerts for {sink.name} sink: {e}")
+                self._incr('failed', len(alerts))
+                return
+            delay = self.backoff * 2 ** attempt
+            print(f"[Alerts] ⚠️ {sink.name} sink failed ({e}), retrying in {delay:.1f}s")
+            self._retries.append((time.monotonic() + delay, attempt + 1, sink, alerts))
+            self._incr('retried', len(alerts))
+
+    def _run_retries(self):
+        if not self._retries:
+            return
+        now = time.monotonic()
+        due, pending = [], []
+        for entry in self._retries:
+            (due if entry[0] <= now or self._stop.is_set() else pending).append(entry)
+        self._retries = pending
+        for _, attempt, sink, alerts in due:
+            self._deliver(sink, alerts, attempt)
+
+    def metrics(self):
+        with self._lock:
+            data = dict(self.counters)
+        data['queue_depth'] = self.queue.qsize()
+        data['queue_capacity'] = self.queue.maxsize
+        data['pending_retries'] = len(self._retries)
+        data['sinks'] = [sink.name for sink in self.sinks]
+        return data
+
+
+# --- Process-wide dispatcher ---
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return the process-wide dispatcher, creating and starting it from settings on first use."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                dispatcher = AlertDispatcher(
+                    build_sinks(getattr(settings, 'ALERT_SINKS', [{'class': 'alerts.delivery.ChannelsSink'}])),
+                    batch_size=getattr(settings, 'ALERT_DELIVERY_BATCH_SIZE', 100),
+                    flush_interval=getattr(settings, 'ALERT_DELIVERY_FLUSH_INTERVAL', 2.0),
+                    max_queue=getattr(settings, 'ALERT_DELIVERY_QUEUE_SIZE', 10000),
+                    max_retries=getattr(settings, 'ALERT_DELIVERY_MAX_RETRIES', 5),
+                    backoff=getattr(settings, 'ALERT_DELIVERY_BACKOFF', 1.0),
+                    rate_limit=getattr(settings, 'ALERT_RATE_LIMIT', 5),
+                    rate_window=getattr(settings, 'ALERT_RATE_WINDOW', 3600.0),
+                )
+                dispatcher.start()
+                _dispatcher = dispatcher
+    return _dispatcher
@@ -0,0 +1,259 @@
+import threading
+import time
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .delivery import get_dispatcher
+from .models import Alert, AlertRule, AlertRuleState
+from .operators import OPERATORS
+
+
+# How each condition reads in an alert message
+CONDITION_LABELS = {
+    'range': 'out of range',
+    'rolling_mean': 'rolling mean out of range',
+    'rolling_median': 'rolling median out of range',
+    'rate_of_change': 'rate of change out of range',
+    'sustained': 'out of range for too long',
+    'ewma': 'deviates from its moving average',
+}
+
+
+# Bumped whenever an AlertRule is saved or deleted, so the engines of other
+# processes (the ingest worker) reload their rules too
+RULES_VERSION_KEY = 'alerts:rules:version'
+
+
+# === Batch alert evaluation ===
+class AlertEngine:
+    """
+    Evaluates whole batches of SensorReadings against the active AlertRules.
+
+    Each rule group (parameter, condition) is turned into one signal array
+    over the batch -- the raw values for ``range``, the output of a
+    streaming operator otherwise -- and checked with one array comparison;
+    only the rows that fire or clear an alert are walked in order. Which
+    (device, parameter, condition) triples are currently in alert is kept
+    in memory, seeded from the unresolved alerts, so a signal that stays out
+    of range raises one alert rather than one per message.
+
+    Streaming operator state lives in memory and is checkpointed to
+    AlertRuleState every ALERT_STATE_CHECKPOINT_INTERVAL seconds, so
+    evaluation never reads SensorReading history.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rules = None      # (parameter, condition) -> (fleet rule or None, {device pk: rule})
+        self._rules_version = None
+        self._rules_loaded_at = 0.0
+        self._active = None     # (parameter, condition) -> {device pk} currently in alert
+        self._operators = {}    # (rule pk, device pk) -> Operator
+        self._saved = None      # (rule pk, device pk) -> checkpointed state not loaded yet
+        self._dirty = set()
+        self._last_checkpoint = time.monotonic()
+
+    # --- Rules and state ---
+    def invalidate_rules(self):
+        with self._lock:
+            self._rules = None
+
+    def _load(self):
+        with self._lock:
+            # Rules changed by another process: its signal bumped the version. Bulk
+            # updates send no signal, so the rules are reloaded every ALERT_RULES_TTL too
+            version = cache.get(RULES_VERSION_KEY)
+            ttl = getattr(settings, 'ALERT_RULES_TTL', 60.0)
+            if version != self._rules_version or time.monotonic() - self._rules_loaded_at > ttl:
+                self._rules = None
+            if self._rules is None:
+                self._rules_version = version
+                self._rules_loaded_at = time.monotonic()
+                rules = {}
+                for rule in AlertRule.objects.filter(is_active=True):
+                    key = (rule.parameter, rule.condition)
+                    fleet, per_device = rules.setdefault(key, (None, {}))
+                    if rule.device_id is None:
+                        rules[key] = (rule, per_device)
+                    else:
+                        per_device[rule.device_id] = rule
+                self._rules = rules
+            if self._active is None:
+                active = {}
+                unresolved = Alert.objects.filter(is_resolved=False).values_list('device_id', 'parameter', 'condition')
+                for device_id, parameter, condition in unresolved:
+                    active.setdefault((parameter, condition), set()).add(device_id)
+                self._active = active
+            if self._saved is None:
+                self._saved = {
+                    (rule_id, device_id): state
+                    for rule_id, device_id, state in AlertRuleState.objects.values_list('rule_id', 'device_id', 'state')
+                }
+            # A copy of the active sets: commit() changes them from other
+            # threads (on_commit of concurrent flushes) while evaluate() runs
+            return self._rules, {key: frozenset(devices) for key, devices in self._active.items()}
+
+    @staticmethod
+    def _bounds(device_ids, fleet, per_device):
+        """Per-row (low, high, hysteresis) arrays: the device's rule where it has one, else the fleet rule."""
+        def column(rule, attr, missing):
+            value = getattr(rule, attr) if rule is not None else None
+            return missing if value is None else value
+
+        n = len(device_ids)
+        low = np.full(n, column(fleet, 'min_value', -np.inf))
+        high = np.full(n, column(fleet, 'max_value', np.inf))
+        band = np.full(n, column(fleet, 'hysteresis', 0.0))
+        for device_id, rule in per_device.items():
+            mask = device_ids == device_id
+            if mask.any():
+                low[mask] = column(rule, 'min_value', -np.inf)
+                high[mask] = column(rule, 'max_value', np.inf)
+                band[mask] = column(rule, 'hysteresis', 0.0)
+        return low, high, band
+
+    # --- Streaming operators ---
+    def _operator(self, rule, device_id):
+        key = (rule.pk, device_id)
+        operator = self._operators.get(key)
+        if operator is None or operator.condition != rule.condition:
+            cls = OPERATORS[rule.condition]
+            saved = self._saved.pop(key, None)
+            operator = cls.load(rule, saved) if saved else cls(rule)
+            self._operators[key] = operator
+        operator.rule = rule  # pick up edited windows/bounds
+        return operator
+
+    def _stream(self, fleet, per_device, readings, device_ids, values):
+        """Feed each reading to its device's operator, in order; NaN where there is no signal yet."""
+        signals = np.full(len(values), np.nan)
+        with self._lock:
+            for i in np.flatnonzero(~np.isnan(values)):
+                device_id = int(device_ids[i])
+                rule = per_device.get(device_id, fleet)
+                if rule is None:
+                    continue
+                signal = self._operator(rule, device_id).update(readings[i].timestamp.timestamp(), float(values[i]))
+                self._dirty.add((rule.pk, device_id))
+                if signal is not None:
+                    signals[i] = signal
+        return signals
+
+    # --- Evaluation ---
+    def evaluate(self, readings):
+        """
+        Return (alerts, transitions) for a batch without writing to the database.
+
+        `transitions` is [((parameter, condition), device pk, in_alert)] to
+        hand to commit() once the alerts are stored. Streaming operators do
+        advance here.
+        """
+        if not readings:
+            return [], []
+
+        rules, active = self._load()
+        device_ids = np.fromiter((r.device_id for r in readings), dtype=np.int64, count=len(readings))
+        alerts, transitions = [], []
+
+        for key, (fleet, per_device) in rules.items():
+            parameter, condition = key
+            values = np.array([getattr(r, parameter, None) for r in readings], dtype=np.float64)
+            if condition != 'range':
+                values = self._stream(fleet, per_device, readings, device_ids, values)
+            low, high, band = self._bounds(device_ids, fleet, per_device)
+
+            # NaN (no value or no signal yet) compares False on both sides
+            out = (values < low) | (values > high)
+            clear = (values >= low + band) & (values <= high - band)
+
+            in_alert = set(active.get(key, ()))
+            if in_alert:
+                candidates = out | (clear & np.isin(device_ids, list(in_alert)))
+            else:
+                candidates = out
+            for i in np.flatnonzero(candidates):
+                device_id = int(device_ids[i])
+                if out[i] and device_id not in in_alert:
+                    in_alert.add(device_id)
+                    transitions.append((key, device_id, True))
+                    alerts.append(Alert(
+                        device_id=device_id,
+                        reading=readings[i],
+                        parameter=parameter,
+                        condition=condition,
+                        message=f"{parameter.capitalize()} {CONDITION_LABELS[condition]}: {values[i]:g}",
+                    ))
+                elif clear[i] and device_id in in_alert:
+                    in_alert.discard(device_id)
+                    transitions.append((key, device_id, False))
+
+        return alerts, transitions
+
+    def commit(self, transitions):
+        with self._lock:
+            if self._active is None:
+                return
+            for key, device_id, in_alert in transitions:
+                devices = self._active.setdefault(key, set())
+                if in_alert:
+                    devices.add(device_id)
+                else:
+                    devices.discard(device_id)
+
+    def process(self, readings):
+        """Evaluate a stored batch and bulk-insert its alerts in the caller's transaction."""
+        alerts, transitions = self.evaluate(readings)
+        if alerts:
+            Alert.objects.bulk_create(alerts)
+            if getattr(settings, 'ALERT_DELIVERY', True):
+                transaction.on_commit(lambda: get_dispatcher().publish(alerts))
+        if transitions:
+            # Only remember the new state if the readings and alerts are kept
+            transaction.on_commit(lambda: self.commit(transitions))
+        if time.monotonic() - self._last_checkpoint >= getattr(settings, 'ALERT_STATE_CHECKPOINT_INTERVAL', 60):
+            transaction.on_commit(self.checkpoint)
+        return alerts
+
+    # --- Checkpoints ---
+    def checkpoint(self):
+        """Upsert the state of every operator that changed since the last checkpoint."""
+        with self._lock:
+            self._last_checkpoint = time.monotonic()
+            rule_ids = {rule.pk for fleet, per_device in (self._rules or {}).values()
+                        for rule in (fleet, *per_device.values()) if rule is not None}
+            states = [
+                AlertRuleState(rule_id=rule_id, device_id=device_id, state=self._operators[rule_id, device_id].dump())
+                for rule_id, device_id in self._dirty
+                if rule_id in rule_ids and (rule_id, device_id) in self._operators
+            ]
+            self._dirty.clear()
+
+        if states:
+            AlertRuleState.objects.bulk_create(
+                states, update_conflicts=True, unique_fields=['rule', 'device'], update_fields=['state', 'updated_at']
+            )
+        return len(states)
+
+
+# --- Process-wide engine ---
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AlertEngine()
+    return _engine
+
+
+def rules_changed():
+    """An AlertRule was saved or deleted: every process's engine reloads its rules."""
+    cache.set(RULES_VERSION_KEY, uuid.uuid4().hex, None)
+    get_engine().invalidate_rules()
@@ -0,0 +1,18 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0001_initial'),
+        ('device', '0002_wide_sensor_readings'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='alert',
+            name='reading',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='device.sensorreading'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# The thresholds alerts.utils.check_for_alerts used to hard-code
+DEFAULT_RULES = [
+    ('temperature', 0, 40),
+    ('pH', 6.5, 8.5),
+    ('turbidity', 0, 500),
+    ('dissolved_oxygen', 5, 14),
+]
+
+
+def seed_rules(apps, schema_editor):
+    AlertRule = apps.get_model('alerts', 'AlertRule')
+    AlertRule.objects.bulk_create([
+        AlertRule(parameter=parameter, min_value=min_value, max_value=max_value)
+        for parameter, min_value, max_value in DEFAULT_RULES
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0002_alter_alert_reading'),
+        ('device', '0004_sensorreading_ts_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('parameter', models.CharField(max_length=50)),
+                ('min_value', models.FloatField(blank=True, null=True)),
+                ('max_value', models.FloatField(blank=True, null=True)),
+                ('hysteresis', models.FloatField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('device', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='alert_rules', to='device.device')),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(fields=('device', 'parameter'), name='unique_device_alert_rule'),
+                    models.UniqueConstraint(condition=models.Q(('device__isnull', True)), fields=('parameter',), name='unique_fleet_alert_rule'),
+                ],
+            },
+        ),
+        migrations.RunPython(seed_rules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0003_alertrule'),
+        ('device', '0004_sensorreading_ts_id_index'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='alertrule',
+            name='unique_device_alert_rule',
+        ),
+        migrations.RemoveConstraint(
+            model_name='alertrule',
+            name='unique_fleet_alert_rule',
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='condition',
+            field=models.CharField(default='range', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='alertrule',
+            name='condition',
+            field=models.CharField(choices=[('range', 'Value'), ('rolling_mean', 'Rolling mean over window'), ('rolling_median', 'Rolling median over window'), ('rate_of_change', 'Change per hour over window'), ('sustained', 'Value out of range for window_seconds'), ('ewma', 'Standard deviations from EWMA')], default='range', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='alertrule',
+            name='window',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alertrule',
+            name='window_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alertrule',
+            name='alpha',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='alertrule',
+            constraint=models.UniqueConstraint(fields=('device', 'parameter', 'condition'), name='unique_device_alert_rule'),
+        ),
+        migrations.AddConstraint(
+            model_name='alertrule',
+            constraint=models.UniqueConstraint(condition=models.Q(('device__isnull', True)), fields=('parameter', 'condition'), name='unique_fleet_alert_rule'),
+        ),
+        migrations.CreateModel(
+            name='AlertRuleState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='device.device')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='states', to='alerts.alertrule')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('rule', 'device'), name='unique_alert_rule_state')],
+            },
+        ),
+    ]
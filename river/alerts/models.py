@@ -2,11 +2,90 @@ from django.db import models
 
 class Alert(models.Model):
     device = models.ForeignKey('device.Device', on_delete=models.CASCADE)
-    reading = models.ForeignKey('device.SensorReading', on_delete=models.CASCADE)
+    # No DB-level constraint: readings live in a partitioned table whose
+    # primary key is (id, timestamp), and expired partitions are dropped.
+    reading = models.ForeignKey(
+        'device.SensorReading', on_delete=models.SET_NULL, null=True, blank=True, db_constraint=False
+    )
     parameter = models.CharField(max_length=50)  # e.g., "temperature"
+    condition = models.CharField(max_length=20, default='range')  # AlertRule.condition that fired
     message = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     is_resolved = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Unresolved list, newest first (also the cursor pagination order)
+            models.Index(
+                fields=['-created_at', '-id'], condition=models.Q(is_resolved=False), name='alert_unresolved_created_idx'
+            ),
+            # Per-device unresolved counts and the engine's dedup seed
+            models.Index(
+                fields=['device', 'parameter'], condition=models.Q(is_resolved=False), name='alert_unresolved_device_idx'
+            ),
+            # A device's alert history
+            models.Index(fields=['device', '-created_at'], name='alert_device_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.parameter} alert on {self.device.name}"
+
+
+class AlertRule(models.Model):
+    """
+    Alert condition for one parameter. A rule without a device applies to
+    the whole fleet; a device's own rule for the same parameter and
+    condition replaces it.
+
+    The condition turns the readings into a signal (see alerts/operators.py)
+    and an alert fires when that signal leaves [min_value, max_value]. The
+    next one for that device, parameter and condition can only fire after
+    the signal has come back at least `hysteresis` inside the range.
+    """
+    CONDITION_CHOICES = [
+        ('range', 'Value'),
+        ('rolling_mean', 'Rolling mean over window'),
+        ('rolling_median', 'Rolling median over window'),
+        ('rate_of_change', 'Change per hour over window'),
+        ('sustained', 'Value out of range for window_seconds'),
+        ('ewma', 'Standard deviations from EWMA'),
+    ]
+
+    device = models.ForeignKey(
+        'device.Device', on_delete=models.CASCADE, null=True, blank=True, related_name='alert_rules'
+    )
+    parameter = models.CharField(max_length=50)  # SensorReading field, e.g. "temperature"
+    condition = models.CharField(max_length=20, choices=CONDITION_CHOICES, default='range')
+    min_value = models.FloatField(null=True, blank=True)
+    max_value = models.FloatField(null=True, blank=True)
+    hysteresis = models.FloatField(default=0)
+    window = models.PositiveIntegerField(null=True, blank=True)  # readings
+    window_seconds = models.FloatField(null=True, blank=True)
+    alpha = models.FloatField(null=True, blank=True)  # EWMA smoothing factor
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'parameter', 'condition'], name='unique_device_alert_rule'),
+            models.UniqueConstraint(
+                fields=['parameter', 'condition'], condition=models.Q(device__isnull=True), name='unique_fleet_alert_rule'
+            ),
+        ]
+
+    def __str__(self):
+        scope = self.device.name if self.device else "all devices"
+        return f"{self.parameter} {self.condition} [{self.min_value}, {self.max_value}] on {scope}"
+
+
+class AlertRuleState(models.Model):
+    """Checkpoint of a streaming rule's per-device operator state."""
+    rule = models.ForeignKey(AlertRule, on_delete=models.CASCADE, related_name='states')
+    device = models.ForeignKey('device.Device', on_delete=models.CASCADE)
+    state = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['rule', 'device'], name='unique_alert_rule_state'),
+        ]
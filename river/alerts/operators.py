@@ -0,0 +1,276 @@
+import math
+from collections import Counter, deque
+from heapq import heapify, heappop, heappush
+
+from django.conf import settings
+
+
+# === Streaming alert operators ===
+# Each operator turns one device's stream of (timestamp, value) pairs for a
+# rule into a derived signal that the engine checks against the rule's
+# [min_value, max_value] with hysteresis, exactly like a raw value. update()
+# returns None while there is not enough history to say anything. State is
+# bounded by the rule's window (and ALERT_WINDOW_MAX_SAMPLES), never by how
+# long the device has been reporting, and round-trips through dump()/load()
+# for AlertRuleState checkpoints.
+
+def _max_samples():
+    return getattr(settings, 'ALERT_WINDOW_MAX_SAMPLES', 1000)
+
+
+class Operator:
+    condition = None
+
+    def __init__(self, rule):
+        self.rule = rule
+
+    def update(self, timestamp, value):
+        raise NotImplementedError
+
+    def dump(self):
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, rule, data):
+        raise NotImplementedError
+
+
+class WindowOperator(Operator):
+    """Keeps the (timestamp, value) pairs of the last `window` readings and/or `window_seconds`."""
+
+    def __init__(self, rule, samples=()):
+        super().__init__(rule)
+        self.samples = deque()
+        for timestamp, value in samples:
+            self._push(timestamp, value)
+        self._evict(self.samples[-1][0] if self.samples else 0.0)
+
+    def _push(self, timestamp, value):
+        self.samples.append((timestamp, value))
+
+    def _pop(self):
+        return self.samples.popleft()
+
+    def _evict(self, now):
+        limit = self.rule.window or _max_samples()
+        limit = min(limit, _max_samples())
+        while len(self.samples) > limit:
+            self._pop()
+        if self.rule.window_seconds:
+            while self.samples and self.samples[0][0] < now - self.rule.window_seconds:
+                self._pop()
+
+    def update(self, timestamp, value):
+        self._push(timestamp, value)
+        self._evict(timestamp)
+        return self.signal()
+
+    def signal(self):
+        raise NotImplementedError
+
+    def dump(self):
+        return {'samples': list(self.samples)}
+
+    @classmethod
+    def load(cls, rule, data):
+        return cls(rule, data.get('samples', ()))
+
+
+class RollingMean(WindowOperator):
+    condition = 'rolling_mean'
+
+    def __init__(self, rule, samples=()):
+        self.total = 0.0
+        super().__init__(rule, samples)
+
+    def _push(self, timestamp, value):
+        super()._push(timestamp, value)
+        self.total += value
+
+    def _pop(self):
+        timestamp, value = super()._pop()
+        self.total -= value
+        return timestamp, value
+
+    def signal(self):
+        return self.total / len(self.samples)
+
+
+class RollingMedian(WindowOperator):
+    """
+    Median of the window from two heaps: the lower half as a max-heap (values
+    negated) and the upper half as a min-heap. A value that leaves the window
+    is only marked in `delayed` and dropped once it reaches the top of its
+    heap, so both update() and eviction cost O(log window). The heaps are
+    rebuilt from the window when marked entries make them twice its size.
+    """
+    condition = 'rolling_median'
+
+    def __init__(self, rule, samples=()):
+        self._reset()
+        super().__init__(rule, samples)
+
+    def _reset(self):
+        self.low, self.high = [], []        # max-heap (negated), min-heap
+        self.low_size = self.high_size = 0  # live entries in each
+        self.delayed = Counter()            # value -> entries to drop when they surface
+
+    def _push(self, timestamp, value):
+        super()._push(timestamp, value)
+        if not self.low or value <= -self.low[0]:
+            heappush(self.low, -value)
+            self.low_size += 1
+        else:
+            heappush(self.high, value)
+            self.high_size += 1
+        self._balance()
+
+    def _pop(self):
+        timestamp, value = super()._pop()
+        self.delayed[value] += 1
+        if value <= -self.low[0]:
+            self.low_size -= 1
+            if value == -self.low[0]:
+                self._prune(self.low, -1)
+        else:
+            self.high_size -= 1
+            if value == self.high[0]:
+                self._prune(self.high, 1)
+        self._balance()
+        if len(self.low) + len(self.high) > 2 * len(self.samples) + 16:
+            self._rebuild()
+        return timestamp, value
+
+    def _prune(self, heap, sign):
+        while heap and self.delayed[sign * heap[0]]:
+            value = sign * heappop(heap)
+            self.delayed[value] -= 1
+            if not self.delayed[value]:
+                del self.delayed[value]
+
+    def _balance(self):
+        # Keep low_size == high_size or high_size + 1
+        if self.low_size > self.high_size + 1:
+            heappush(self.high, -heappop(self.low))
+            self.low_size -= 1
+            self.high_size += 1
+            self._prune(self.low, -1)
+        elif self.low_size < self.high_size:
+            heappush(self.low, -heappop(self.high))
+            self.high_size -= 1
+            self.low_size += 1
+            self._prune(self.high, 1)
+
+    def _rebuild(self):
+        ordered = sorted(value for _, value in self.samples)
+        middle = (len(ordered) + 1) // 2
+        self.low = [-value for value in ordered[:middle]]
+        self.high = ordered[middle:]
+        heapify(self.low)
+        heapify(self.high)
+        self.low_size, self.high_size = len(self.low), len(self.high)
+        self.delayed = Counter()
+
+    def signal(self):
+        if self.low_size > self.high_size:
+            return -self.low[0]
+        return (-self.low[0] + self.high[0]) / 2
+
+
+class RateOfChange(WindowOperator):
+    """Change per hour between the oldest and newest reading in the window."""
+    condition = 'rate_of_change'
+
+    def _evict(self, now):
+        super()._evict(now)
+        # Without a window, compare against the previous reading only
+        if not (self.rule.window or self.rule.window_seconds):
+            while len(self.samples) > 2:
+                self._pop()
+
+    def signal(self):
+        if len(self.samples) < 2:
+            return None
+        (first_ts, first), (last_ts, last) = self.samples[0], self.samples[-1]
+        if last_ts <= first_ts:
+            return None
+        return (last - first) / (last_ts - first_ts) * 3600
+
+
+class Sustained(Operator):
+    """
+    The raw value, but only once it has been outside [min_value, max_value]
+    for `window_seconds`; None while a breach is still younger than that.
+    """
+    condition = 'sustained'
+
+    def __init__(self, rule, since=None):
+        super().__init__(rule)
+        self.since = since  # timestamp the current breach started
+
+    def update(self, timestamp, value):
+        low = self.rule.min_value if self.rule.min_value is not None else -math.inf
+        high = self.rule.max_value if self.rule.max_value is not None else math.inf
+        if low <= value <= high:
+            self.since = None
+            return value
+        if self.since is None:
+            self.since = timestamp
+        if timestamp - self.since >= (self.rule.window_seconds or 0):
+            return value
+        return None
+
+    def dump(self):
+        return {'since': self.since}
+
+    @classmethod
+    def load(cls, rule, data):
+        return cls(rule, data.get('since'))
+
+
+class EWMA(Operator):
+    """
+    Deviation of each value from the exponentially weighted moving average,
+    in exponentially weighted standard deviations (a z-score), so a rule of
+    [-3, 3] flags anything outside a 3-sigma band. `alpha` is the smoothing
+    factor; no signal until `window` readings (default 1/alpha) were seen.
+    """
+    condition = 'ewma'
+
+    def __init__(self, rule, mean=0.0, variance=0.0, count=0):
+        super().__init__(rule)
+        self.mean = mean
+        self.variance = variance
+        self.count = count
+
+    def update(self, timestamp, value):
+        alpha = self.rule.alpha or 0.1
+        warmup = self.rule.window or math.ceil(1 / alpha)
+
+        if self.count == 0:
+            self.mean, self.variance, self.count = value, 0.0, 1
+            return None
+
+        deviation = value - self.mean
+        signal = None
+        if self.count >= warmup and self.variance > 0:
+            signal = deviation / math.sqrt(self.variance)
+
+        increment = alpha * deviation
+        self.mean += increment
+        self.variance = (1 - alpha) * (self.variance + deviation * increment)
+        self.count += 1
+        return signal
+
+    def dump(self):
+        return {'mean': self.mean, 'variance': self.variance, 'count': self.count}
+
+    @classmethod
+    def load(cls, rule, data):
+        return cls(rule, data.get('mean', 0.0), data.get('variance', 0.0), data.get('count', 0))
+
+
+OPERATORS = {
+    operator.condition: operator
+    for operator in (RollingMean, RollingMedian, RateOfChange, Sustained, EWMA)
+}
@@ -0,0 +1,8 @@
+from device.pagination import TimestampKeysetPagination
+
+
+class AlertCursorPagination(TimestampKeysetPagination):
+    """Keyset pagination on (created_at, id), newest first."""
+    timestamp_field = 'created_at'
+    page_size = 50
+    max_page_size = 500
@@ -0,0 +1,7 @@
+from django.urls import re_path
+from .consumers import AlertConsumer
+
+websocket_urlpatterns = [
+    # WebSocket push of newly created alerts
+    re_path(r'^ws/alerts/$', AlertConsumer.as_asgi()),
+]
@@ -2,6 +2,8 @@ from rest_framework import serializers
 from .models import Alert
 
 class AlertSerializer(serializers.ModelSerializer):
+    device_name = serializers.CharField(source='device.name', read_only=True)
+
     class Meta:
         model = Alert
-        fields = ['id', 'device', 'parameter', 'message', 'created_at', 'is_resolved']
+        fields = ['id', 'device', 'device_name', 'parameter', 'condition', 'message', 'created_at', 'is_resolved']
@@ -1,16 +1,26 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from device.models import SensorReading
+from .engine import rules_changed
+from .models import AlertRule
 from .utils import check_for_alerts
 from rest_framework.authtoken.models import Token
 from django.db.models.signals import post_save
 
 
+# Batched ingest uses bulk_create (no post_save) and evaluates alerts itself;
+# this catches readings saved one at a time elsewhere.
 @receiver(post_save, sender=SensorReading)
 def handle_sensor_reading(sender, instance, created, **kwargs):
     if created:
         check_for_alerts(instance)
 
+
+@receiver(post_save, sender=AlertRule)
+@receiver(post_delete, sender=AlertRule)
+def reload_alert_rules(sender, **kwargs):
+    rules_changed()
+
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
\ No newline at end of file
@@ -1,3 +1,255 @@
-from django.test import TestCase
+import json
+import random
+import statistics
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.core import mail
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from alerts.delivery import (
+    ALERTS_GROUP, AlertDispatcher, ChannelsSink, EmailSink, LocalSink, Sink, WebhookSink, alert_payload, build_sinks,
+)
+from alerts.engine import RULES_VERSION_KEY, AlertEngine
+from alerts.models import Alert, AlertRule
+from device.models import Device
+from alerts.operators import RollingMedian
+
+
+def make_alert(pk, device=1):
+    return SimpleNamespace(
+        pk=pk, device_id=device, parameter='pH', condition='above', message=f'alert {pk}',
+        created_at=timezone.now(), is_resolved=False,
+    )
+
+
+class FlakySink(Sink):
+    name = 'flaky'
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.batches = []
+
+    def deliver(self, alerts):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('unreachable')
+        self.batches.append(list(alerts))
+
+
+# --- Delivery ---
+class AlertDispatcherTests(SimpleTestCase):
+    def test_worker_delivers_published_alerts_to_local_sink(self):
+        sink = LocalSink()
+        dispatcher = AlertDispatcher([sink], flush_interval=0.05)
+        dispatcher.start()
+        dispatcher.publish([make_alert(1), make_alert(2), make_alert(3)])
+        dispatcher.stop()
+
+        self.assertEqual([alert['id'] for batch in sink.batches for alert in batch], [1, 2, 3])
+        self.assertEqual(dispatcher.metrics()['delivered'], 3)
+
+    def test_rate_limited_sinks_only_get_each_devices_first_alerts(self):
+        limited, unlimited = LocalSink(rate_limited=True), LocalSink()
+        dispatcher = AlertDispatcher([limited, unlimited], rate_limit=2)
+
+        dispatcher._dispatch([alert_payload(make_alert(pk)) for pk in range(5)])
+
+        self.assertEqual(len(limited.batches[0]), 2)
+        self.assertEqual(len(unlimited.batches[0]), 5)
+        self.assertEqual(dispatcher.counters['suppressed'], 3)
+
+    def test_failing_sink_is_retried_then_given_up(self):
+        recovering, broken = FlakySink(failures=1), FlakySink(failures=10)
+        dispatcher = AlertDispatcher([recovering, broken], max_retries=2, backoff=0)
+
+        dispatcher._dispatch([{'id': 1, 'device': 1}])
+        for _ in range(3):
+            dispatcher._run_retries()
+
+        self.assertEqual(recovering.batches, [[{'id': 1, 'device': 1}]])
+        self.assertEqual(broken.batches, [])
+        self.assertEqual(dispatcher.counters['failed'], 1)
+        self.assertEqual(dispatcher.metrics()['pending_retries'], 0)
+
+    def test_publish_drops_instead_of_blocking_when_full(self):
+        dispatcher = AlertDispatcher([LocalSink()], max_queue=2)
+        dispatcher.publish([make_alert(pk) for pk in range(3)])
+
+        self.assertEqual(dispatcher.metrics()['queue_depth'], 2)
+        self.assertEqual(dispatcher.counters['dropped'], 1)
+
+
+class AlertSinkTests(SimpleTestCase):
+    alerts = [alert_payload(make_alert(1)), alert_payload(make_alert(2, device=2))]
+
+    def test_websocket_sink_pushes_one_frame_to_the_alerts_group(self):
+        channel_layer = get_channel_layer()
+
+        async def push():
+            channel = await channel_layer.new_channel()
+            await channel_layer.group_add(ALERTS_GROUP, channel)
+            await sync_to_async(ChannelsSink().deliver)(self.alerts)
+            return await channel_layer.receive(channel)
+
+        event = async_to_sync(push)()
+        self.assertEqual(event['type'], 'send.alerts')
+        self.assertEqual([item['id'] for item in json.loads(event['text'])['items']], [1, 2])
+
+    def test_email_sink_sends_one_digest_per_batch(self):
+        EmailSink(recipients=['ops@example.com']).deliver(self.alerts)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, '[River] 2 new alerts')
+        self.assertIn('alert 2', mail.outbox[0].body)
+
+    def test_webhook_sink_posts_the_batch_as_json(self):
+        with mock.patch('urllib.request.urlopen') as urlopen:
+            WebhookSink('https://hooks.example.com/river', headers={'X-Token': 'secret'}).deliver(self.alerts)
+
+        request = urlopen.call_args.args[0]
+        self.assertEqual((request.full_url, request.get_method()), ('https://hooks.example.com/river', 'POST'))
+        self.assertEqual(request.get_header('X-token'), 'secret')
+        self.assertEqual(json.loads(request.data)['alerts'], self.alerts)
+
+    def test_local_sink_keeps_the_newest_batches(self):
+        sink = LocalSink(max_batches=2)
+        for pk in range(3):
+            sink.deliver([{'id': pk}])
+        self.assertEqual(list(sink.batches), [[{'id': 1}], [{'id': 2}]])
+
+    def test_sinks_are_built_from_settings_entries(self):
+        sinks = build_sinks([{'class': 'alerts.delivery.LocalSink', 'rate_limited': True}])
+        self.assertIsInstance(sinks[0], LocalSink)
+        self.assertTrue(sinks[0].rate_limited)
+
+
+# --- Engine ---
+class AlertEngineTests(TestCase):
+    def test_evaluation_works_on_a_copy_of_the_active_sets(self):
+        engine = AlertEngine()
+        _, active = engine._load()
+        engine.commit([(('pH', 'above'), 1, True)])
+
+        self.assertEqual(active, {})
+        self.assertEqual(engine._load()[1], {('pH', 'above'): frozenset({1})})
+
+    def test_rule_changed_by_another_process_is_picked_up(self):
+        rule = AlertRule.objects.get(parameter='pH', condition='range', device=None)   # seeded by migrations
+        rule.max_value = 8.0
+        rule.save()
+        engine = AlertEngine()
+        engine._load()
+        # Saved elsewhere: this process's engine gets no signal, only the cached version
+        AlertRule.objects.filter(pk=rule.pk).update(max_value=9.0)
+        cache.set(RULES_VERSION_KEY, 'changed elsewhere', None)
+
+        fleet, _ = engine._load()[0][('pH', 'range')]
+        self.assertEqual(fleet.max_value, 9.0)
+
+    def test_rules_changed_without_a_signal_expire(self):
+        rule = AlertRule.objects.get(parameter='pH', condition='range', device=None)   # seeded by migrations
+        rule.max_value = 8.0
+        rule.save()
+        engine = AlertEngine()
+        engine._load()
+        AlertRule.objects.filter(pk=rule.pk).update(max_value=9.0)
+
+        self.assertEqual(engine._load()[0][('pH', 'range')][0].max_value, 8.0)
+        with self.settings(ALERT_RULES_TTL=-1):
+            self.assertEqual(engine._load()[0][('pH', 'range')][0].max_value, 9.0)
+
+
+# --- Operators ---
+class RollingMedianTests(SimpleTestCase):
+    def test_matches_the_median_of_the_window(self):
+        rng = random.Random(7)
+        for window in (1, 2, 5, 50):
+            rule = SimpleNamespace(window=window, window_seconds=None)
+            operator = RollingMedian(rule)
+            values = [float(rng.randint(0, 20)) for _ in range(500)]   # plenty of ties
+            for i, value in enumerate(values):
+                self.assertEqual(operator.update(float(i), value), statistics.median(values[max(0, i + 1 - window):i + 1]))
+            self.assertLessEqual(len(operator.low) + len(operator.high), 2 * window + 16)
+
+    def test_time_window_and_checkpoint_round_trip(self):
+        rule = SimpleNamespace(window=None, window_seconds=10)
+        operator = RollingMedian(rule)
+        for t, value in enumerate([5.0, 1.0, 9.0, 3.0]):
+            operator.update(float(t), value)
+        self.assertEqual(operator.update(12.0, 7.0), 7.0)   # only t >= 2 is left: 9, 3, 7
+        self.assertEqual(RollingMedian.load(rule, operator.dump()).signal(), 7.0)
+
+
+# --- API ---
+class BulkResolveTests(TestCase):
+    def setUp(self):
+        device = Device.objects.create(name='dev1')
+        self.alerts = [
+            Alert.objects.create(device=device, parameter='pH', message=f'alert {i}') for i in range(3)
+        ]
+
+    def resolve(self, body):
+        return self.client.post(reverse('bulk-resolve-alerts'), body, content_type='application/json')
+
+    def test_resolves_by_id(self):
+        response = self.resolve({'ids': [self.alerts[0].pk, self.alerts[2].pk]})
+
+        self.assertEqual(response.json()['resolved'], 2)
+        self.assertEqual(list(Alert.objects.filter(is_resolved=False)), [self.alerts[1]])
+
+    def test_booleans_are_not_ids(self):
+        response = self.resolve({'ids': [True]})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Alert.objects.filter(is_resolved=True).exists())
+
+    def test_resolves_by_filter(self):
+        other = Alert.objects.create(device=Device.objects.create(name='dev2'), parameter='pH', message='other')
+
+        response = self.resolve({'device': 'dev1', 'parameter': 'pH'})
+
+        self.assertEqual(response.json()['resolved'], 3)
+        self.assertEqual(list(Alert.objects.filter(is_resolved=False)), [other])
+
+    def test_refuses_to_resolve_everything_by_accident(self):
+        self.assertEqual(self.resolve({}).status_code, 400)
+        self.assertEqual(self.resolve({'all': True}).json()['resolved'], 3)
+
+
+class AlertQueryTests(TestCase):
+    def setUp(self):
+        self.devices = [Device.objects.create(name=name) for name in ('dev1', 'dev2')]
+        for i in range(5):
+            Alert.objects.create(device=self.devices[i % 2], parameter='pH', message=f'alert {i}')
+
+    def test_unresolved_alerts_are_paged_newest_first(self):
+        first = self.client.get(reverse('unresolved-alerts'), {'page_size': 3}).json()
+        second = self.client.get(first['next']).json()
+
+        ids = [alert['id'] for page in (first, second) for alert in page['results']]
+        self.assertEqual(ids, sorted(Alert.objects.values_list('pk', flat=True), reverse=True))
+        self.assertEqual(first['results'][0]['device_name'], 'dev1')
+        self.assertIsNone(second['next'])
+
+    def test_summary_counts_unresolved_alerts_per_device(self):
+        Alert.objects.filter(pk=Alert.objects.filter(device=self.devices[1]).first().pk).update(is_resolved=True)
+
+        with self.assertNumQueries(1):
+            summary = self.client.get(reverse('alert-summary')).json()
+
+        self.assertEqual(summary['total'], 4)
+        self.assertEqual([(d['device_name'], d['unresolved']) for d in summary['devices']], [('dev1', 3), ('dev2', 1)])
+
+    def test_single_resolve_is_one_update(self):
+        alert = Alert.objects.first()
+        with self.assertNumQueries(1):
+            response = self.client.patch(reverse('resolve-alert', args=[alert.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.patch(reverse('resolve-alert', args=[0])).status_code, 404)
@@ -1,10 +1,17 @@
 from django.urls import path
-from .views import UnresolvedAlertListAPIView,  MarkAlertResolvedAPIView
+from .views import (
+    BulkResolveAlertsAPIView,
+    MarkAlertResolvedAPIView,
+    UnresolvedAlertListAPIView,
+    UnresolvedAlertSummaryAPIView,
+)
 
 urlpatterns = [
     path('unresolved/', UnresolvedAlertListAPIView.as_view(), name='unresolved-alerts'),
+    path('summary/', UnresolvedAlertSummaryAPIView.as_view(), name='alert-summary'),
+    path('resolve/', BulkResolveAlertsAPIView.as_view(), name='bulk-resolve-alerts'),
  path('<int:pk>/resolve/', MarkAlertResolvedAPIView.as_view(), name='resolve-alert'),
 ]
 
 # This code defines the URL routing for the alerts app, specifically for listing unresolved alerts.
-# The `UnresolvedAlertListAPIView` view handles the retrieval of unresolved alerts.
\ No newline at end of file
+# The `UnresolvedAlertListAPIView` view handles the retrieval of unresolved alerts.
@@ -1,19 +1,6 @@
-from .models import Alert
+from .engine import get_engine
 
-def check_for_alerts(sensor_reading):
-    thresholds = {
-        "temperature": (0, 40),
-        "pH": (6.5, 8.5),
-        "turbidity": (0, 500),
-        "dissolved_oxygen": (5, 14),
-    }
 
-    for param, (min_val, max_val) in thresholds.items():
-        value = getattr(sensor_reading, param, None)
-        if value is not None and (value < min_val or value > max_val):
-            Alert.objects.create(
-                device=sensor_reading.device,
-                reading=sensor_reading,
-                parameter=param,
-                message=f"{param.capitalize()} out of range: {value}",
-            )
+def check_for_alerts(sensor_reading):
+    # Single readings go through the same rule engine as ingest batches
+    return get_engine().process([sensor_reading])
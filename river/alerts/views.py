@@ -1,28 +1,102 @@
 from rest_framework import generics
+from django.db.models import Count, Max
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import Alert
+from .pagination import AlertCursorPagination
 from .serializers import AlertSerializer
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from device.views import parse_moment
 
 
-
+BULK_RESOLVE_FILTERS = ('device', 'parameter', 'condition')
 
 
 class UnresolvedAlertListAPIView(generics.ListAPIView):
-    queryset = Alert.objects.filter(is_resolved=False).order_by('-created_at')
+    queryset = Alert.objects.filter(is_resolved=False).select_related('device').order_by('-created_at', '-id')
     serializer_class = AlertSerializer
+    pagination_class = AlertCursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['device', 'parameter']  # Enables filtering via URL query params
 
 
+class UnresolvedAlertSummaryAPIView(APIView):
+    """Unresolved alert counts per device, from the partial unresolved index."""
+
+    def get(self, request):
+        rows = (
+            Alert.objects.filter(is_resolved=False)
+            .values('device_id', 'device__name')
+            .annotate(unresolved=Count('id'), latest=Max('created_at'))
+            .order_by('-unresolved')
+        )
+        devices = [
+            {
+                'device': row['device_id'],
+                'device_name': row['device__name'],
+                'unresolved': row['unresolved'],
+                'latest': row['latest'],
+            }
+            for row in rows
+        ]
+        return Response({
+            'total': sum(device['unresolved'] for device in devices),
+            'devices': devices,
+        })
+
+
 class MarkAlertResolvedAPIView(APIView):
     def patch(self, request, pk):
-        try:
-            alert = Alert.objects.get(pk=pk)
-            alert.is_resolved = True
-            alert.save()
+        # Single UPDATE, no fetch
+        if Alert.objects.filter(pk=pk).update(is_resolved=True):
             return Response({'status': 'resolved'}, status=status.HTTP_200_OK)
-        except Alert.DoesNotExist:
-            return Response({'error': 'Alert not found'}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        return Response({'error': 'Alert not found'}, status=status.HTTP_404_NOT_FOUND)
+
+
+class BulkResolveAlertsAPIView(APIView):
+    """
+    Resolve many alerts with one UPDATE.
+
+    POST {"ids": [1, 2, 3]} and/or a filter such as
+    {"device": 4, "parameter": "pH", "before": "2025-07-01T00:00:00Z"};
+    {"all": true} resolves every open alert.
+    """
+
+    def post(self, request):
+        data = request.data
+        queryset = Alert.objects.filter(is_resolved=False)
+        criteria = False
+
+        ids = data.get('ids')
+        if ids is not None:
+            if not isinstance(ids, list) or not all(type(pk) is int for pk in ids):  # bools are ints too
+                return Response({'error': 'ids must be a list of integers'}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(pk__in=ids)
+            criteria = True
+
+        for key in BULK_RESOLVE_FILTERS:
+            value = data.get(key)
+            if value in (None, ''):
+                continue
+            if key == 'device' and not str(value).isdigit():
+                key = 'device__name'  # devices by id or name, as in the reading endpoints
+            queryset = queryset.filter(**{key: value})
+            criteria = True
+
+        try:
+            before = parse_moment(data.get('before'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if before is not None:
+            queryset = queryset.filter(created_at__lte=before)
+            criteria = True
+
+        if not criteria and data.get('all') is not True:
+            return Response(
+                {'error': 'Give ids, a filter (device, parameter, condition, before) or "all": true'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        resolved = queryset.update(is_resolved=True)
+        return Response({'status': 'resolved', 'resolved': resolved}, status=status.HTTP_200_OK)
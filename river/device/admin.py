@@ -3,7 +3,7 @@ from django import forms
 from django.urls import reverse
 from django.utils.html import format_html
 
-from .models import Device, Sensor, SensorReading, MQTTBroker
+from .models import Device, DeviceState, Sensor, SensorReading, MQTTBroker
 
 
 # --- Device Admin ---
@@ -14,6 +14,14 @@ class DeviceAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at']
 
 
+# --- DeviceState Admin ---
+@admin.register(DeviceState)
+class DeviceStateAdmin(admin.ModelAdmin):
+    list_display = ['device', 'last_seen', 'timestamp']
+    list_select_related = ['device']
+    readonly_fields = [field.name for field in DeviceState._meta.fields]
+
+
 # --- Sensor Admin ---
 @admin.register(Sensor)
 class SensorAdmin(admin.ModelAdmin):
@@ -55,11 +63,12 @@ class SensorReadingForm(forms.ModelForm):
 class SensorReadingAdmin(admin.ModelAdmin):
     form = SensorReadingForm
     list_display = [
-        'sensor', 'timestamp', 'manual_override', 'pH', 'temperature',
+        'device', 'sensor', 'timestamp', 'manual_override', 'pH', 'temperature',
         'turbidity', 'dissolved_oxygen', 'ise', 'tds', 'orp', 'ec',
         'toggle_manual_override_link'
     ]
     list_filter = ['timestamp', 'manual_override']
+    list_select_related = ['device', 'sensor']
 
     def toggle_manual_override_link(self, obj):
         url = reverse('toggle-manual-mode', args=[obj.pk])
@@ -0,0 +1,474 @@
+import asyncio
+import hashlib
+import json
+import re
+import ssl
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .codecs import CodecError, decode_record, device_name_from_topic
+from .ingest import IngestStats, database_available, flush_messages, host_id, publish_metrics
+from .mqtt_client import subscription_topic, subscription_topics
+from .presence import get_presence, is_status_topic, parse_status
+
+
+class IngestServiceError(Exception):
+    pass
+
+
+def _import_aiomqtt():
+    try:
+        import aiomqtt
+    except ImportError:
+        raise IngestServiceError("The ingest worker requires the 'aiomqtt' package")
+    return aiomqtt
+
+
+PARTITION_MODES = ('shared', 'hash')
+
+
+# === Worker membership and device ownership ===
+class RendezvousPartitioner:
+    """
+    Assigns every device to exactly one live worker by rendezvous (highest
+    random weight) hashing. When a worker joins or leaves only the devices
+    it gains or loses move, and every worker computes the same owner from
+    the same member list, so each device is written by one process and its
+    readings stay in order.
+
+    Members announce themselves with heartbeats; one that has not been heard
+    from for `timeout` seconds is dropped and its devices are rebalanced.
+    """
+
+    def __init__(self, worker_id, timeout=30.0):
+        self.worker_id = worker_id
+        self.timeout = timeout
+        self.members = {worker_id: time.monotonic()}   # worker id -> last heartbeat
+        self._owners = {}                              # device name -> owning worker id
+        self.rebalances = 0
+
+    @staticmethod
+    def weight(worker_id, device_name):
+        digest = hashlib.blake2b(f"{worker_id}/{device_name}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def owner(self, device_name):
+        owner = self._owners.get(device_name)
+        if owner is None:
+            owner = max(self.members, key=lambda member: self.weight(member, device_name))
+            self._owners[device_name] = owner
+        return owner
+
+    def owns(self, device_name):
+        return self.owner(device_name) == self.worker_id
+
+    def heartbeat(self, worker_id):
+        if worker_id not in self.members:
+            self._rebalance()
+        self.members[worker_id] = time.monotonic()
+
+    def leave(self, worker_id):
+        if worker_id != self.worker_id and self.members.pop(worker_id, None) is not None:
+            self._rebalance()
+
+    def sweep(self):
+        """Drop members whose heartbeats stopped. Returns the dropped ids."""
+        cutoff = time.monotonic() - self.timeout
+        expired = [member for member, seen in self.members.items() if seen < cutoff and member != self.worker_id]
+        for member in expired:
+            del self.members[member]
+        if expired:
+            self._rebalance()
+        return expired
+
+    def _rebalance(self):
+        self._owners.clear()
+        self.rebalances += 1
+
+
+# === Asyncio MQTT ingestion worker ===
+class AsyncIngestService:
+    """
+    Single-process MQTT consumer for `manage.py ingest`.
+
+    One task reads the broker into a bounded asyncio queue; another drains it
+    in batches into write_batch() (run in a worker thread via sync_to_async),
+    so reading never waits on Postgres until the queue is full, and then the
+    broker connection itself applies backpressure.
+
+    Several workers can share the stream:
+
+    * ``shared`` -- with `group` set the subscription is
+      "$share/<group>/<topic>" and the broker hands each message to one
+      worker. Cheapest, but consecutive readings of a device may land on
+      different workers and be written out of order.
+    * ``hash``   -- every worker subscribes to the full topic and keeps only
+      the devices a RendezvousPartitioner assigns to it. Workers announce
+      themselves with retained heartbeats under `membership_topic` (cleared
+      by their last will), so a worker that dies is noticed by the broker or
+      by its missing heartbeats and its devices move to the survivors. A
+      worker listens to membership for one heartbeat interval before it
+      subscribes to telemetry, so it starts out knowing its peers.
+
+    With a `spool` (an IngestSpool) the writer only appends to the local
+    spool, every `spool_interval` seconds, and a drain task replays the
+    spool into the database, acking each batch only after it committed. A
+    database outage then grows the spool instead of losing messages.
+    """
+
+    def __init__(self, host, port, topic, username=None, password=None, use_tls=True, group=None,
+                 client_id=None, batch_size=500, flush_interval=1.0, max_queue=10000,
+                 reconnect_delay=1.0, max_reconnect_delay=60.0, partition='shared',
+                 membership_topic='river/ingest/workers', heartbeat_interval=10.0, member_timeout=30.0,
+                 spool=None, spool_interval=0.1, protocol=5, status_topic='devices/+/status',
+                 metrics_interval=10.0):
+        if partition not in PARTITION_MODES:
+            raise IngestServiceError(f"Unknown partition mode {partition!r}, expected one of {PARTITION_MODES}")
+
+        self.host = host
+        self.port = port
+        self.partition = partition
+        self.topics = subscription_topics(topic, group if partition == 'shared' else None)
+        self.status_topic = subscription_topic(status_topic, group if partition == 'shared' else None)
+        self.protocol = protocol
+        self.worker_id = client_id or host_id()
+        self.membership_topic = membership_topic
+        self.heartbeat_interval = heartbeat_interval
+        self.partitioner = RendezvousPartitioner(self.worker_id, member_timeout) if partition == 'hash' else None
+        self.username = username or None
+        self.password = password or None
+        self.use_tls = use_tls
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.spool = spool
+        self.spool_interval = spool_interval
+        self.metrics_interval = metrics_interval
+
+        self.stats = IngestStats()
+        self.queue = None
+        self.connected = False
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        options = {
+            'host': settings.MQTT_BROKER_HOST,
+            'port': settings.MQTT_BROKER_PORT,
+            'topic': settings.MQTT_TOPIC,
+            'username': settings.MQTT_USERNAME,
+            'password': settings.MQTT_PASSWORD,
+            'use_tls': settings.MQTT_USE_TLS,
+            'group': settings.MQTT_SHARED_GROUP,
+            'batch_size': getattr(settings, 'INGEST_BATCH_SIZE', 500),
+            'flush_interval': getattr(settings, 'INGEST_FLUSH_INTERVAL', 1.0),
+            'max_queue': getattr(settings, 'INGEST_QUEUE_SIZE', 10000),
+            'partition': getattr(settings, 'INGEST_PARTITION', 'shared'),
+            'membership_topic': getattr(settings, 'INGEST_MEMBERSHIP_TOPIC', 'river/ingest/workers'),
+            'heartbeat_interval': getattr(settings, 'INGEST_HEARTBEAT_INTERVAL', 10.0),
+            'member_timeout': getattr(settings, 'INGEST_MEMBER_TIMEOUT', 30.0),
+            'spool_interval': getattr(settings, 'INGEST_SPOOL_INTERVAL', 0.1),
+            'protocol': getattr(settings, 'MQTT_PROTOCOL_VERSION', 5),
+            'status_topic': getattr(settings, 'MQTT_STATUS_TOPIC', 'devices/+/status'),
+            'metrics_interval': getattr(settings, 'INGEST_METRICS_INTERVAL', 10.0),
+        }
+        options.update({key: value for key, value in overrides.items() if value is not None})
+
+        # Every worker needs a spool of its own: the worker id goes into the path. The
+        # default id is the host name, so a restarted worker drains its predecessor's spool
+        options['client_id'] = options.get('client_id') or host_id()
+        spool_path = options.pop('spool_path', None) or getattr(settings, 'INGEST_SPOOL_PATH', None)
+        if spool_path:
+            import sqlite3
+            from .spool import IngestSpool
+
+            spool_path = spool_path.replace('{worker_id}', re.sub(r'[^\w.-]', '_', options['client_id']))
+            try:
+                options['spool'] = IngestSpool(spool_path)
+            except sqlite3.OperationalError as e:
+                raise IngestServiceError(
+                    f"Cannot open spool {spool_path}: {e} (is another worker using it? Workers sharing a "
+                    f"host need a --client-id each)"
+                )
+        return cls(**options)
+
+    # --- Lifecycle ---
+    async def run(self):
+        from .identity import get_resolver
+
+        aiomqtt = _import_aiomqtt()
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        await sync_to_async(get_resolver().warm)()
+        # The ingest worker is the process that marks silent devices offline
+        get_presence().enable_sweep()
+
+        tasks = [asyncio.create_task(self._write_loop())]
+        if self.spool is not None:
+            tasks.append(asyncio.create_task(self._spool_drain_loop()))
+        if self.metrics_interval:
+            tasks.append(asyncio.create_task(self._metrics_loop()))
+        try:
+            await self._read_loop(aiomqtt)
+        finally:
+            for task in tasks:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            await self._drain()
+
+    async def _read_loop(self, aiomqtt):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    hostname=self.host,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    identifier=self.worker_id,
+                    tls_context=ssl.create_default_context() if self.use_tls else None,
+                    keepalive=60,
+                    will=self._will(aiomqtt),
+                    protocol=aiomqtt.ProtocolVersion.V5 if self.protocol == 5 else aiomqtt.ProtocolVersion.V311,
+                ) as client:
+                    heartbeat = subscriber = None
+                    if self.partitioner is not None:
+                        # Learn the live members first (their retained heartbeats), so no
+                        # device is claimed by a worker that only thinks it is alone
+                        await client.subscribe(f"{self.membership_topic}/+", qos=1)
+                        heartbeat = asyncio.create_task(self._heartbeat_loop(client))
+                        subscriber = asyncio.create_task(self._subscribe_data(client, self.heartbeat_interval))
+                    else:
+                        await self._subscribe_data(client)
+                    self.connected = True
+                    delay = self.reconnect_delay
+
+                    reader = None
+                    try:
+                        if subscriber is None:
+                            await self._consume(client)
+                        else:
+                            # Awaited together: a failed subscribe or heartbeat drops the
+                            # connection and reconnects like a lost one
+                            reader = asyncio.create_task(self._consume(client))
+                            done, _ = await asyncio.wait(
+                                [reader, subscriber, heartbeat], return_when=asyncio.FIRST_EXCEPTION
+                            )
+                            for task in done:
+                                if task.exception() is not None:
+                                    raise task.exception()
+                    finally:
+                        for task in (reader, subscriber, heartbeat):
+                            if task is not None:
+                                task.cancel()
+            except aiomqtt.MqttError as e:
+                self.connected = False
+                print(f"[Ingest] ⚠️ MQTT connection lost ({e}), reconnecting in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _consume(self, client):
+        async for message in client.messages:
+            topic = str(message.topic)
+            if self.partitioner is not None and topic.startswith(self.membership_topic + '/'):
+                self._membership(topic, message.payload)
+            elif self.partitioner is not None and not self.partitioner.owns(device_name_from_topic(topic)):
+                self.stats.incr('skipped')
+            elif is_status_topic(topic):
+                self._status(topic, message.payload)
+            else:
+                await self._enqueue(topic, message.payload, self._content_type(message))
+
+    async def _subscribe_data(self, client, wait=0):
+        # With hash partitioning, `wait` is one heartbeat interval of membership only
+        if wait:
+            await asyncio.sleep(wait)
+        for topic in (*self.topics, self.status_topic):
+            await client.subscribe(topic, qos=1)
+        print(f"[Ingest] Connected to {self.host}:{self.port} as {self.worker_id}, subscribed to {', '.join(self.topics)}")
+
+    # --- Membership (hash partitioning) ---
+    def _will(self, aiomqtt):
+        if self.partitioner is None:
+            return None
+        # An empty retained payload clears this worker's announcement
+        return aiomqtt.Will(f"{self.membership_topic}/{self.worker_id}", b'', qos=1, retain=True)
+
+    async def _heartbeat_loop(self, client):
+        topic = f"{self.membership_topic}/{self.worker_id}"
+        try:
+            while True:
+                await client.publish(topic, json.dumps({'ts': time.time()}), qos=1, retain=True)
+                for member in self.partitioner.sweep():
+                    print(f"[Ingest] Worker {member} timed out, rebalancing")
+                await asyncio.sleep(self.heartbeat_interval)
+        except asyncio.CancelledError:
+            # Clean shutdown: withdraw so the others take over right away
+            try:
+                await client.publish(topic, b'', qos=1, retain=True)
+            except Exception:
+                pass
+            raise
+
+    def _membership(self, topic, payload):
+        member = topic.rsplit('/', 1)[-1]
+        if member == self.worker_id:
+            return
+        if payload:
+            try:
+                sent = json.loads(payload).get('ts', 0)
+            except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                return
+            # Retained announcements of workers that died without their will being sent
+            if time.time() - sent <= self.partitioner.timeout:
+                self.partitioner.heartbeat(member)
+        else:
+            self.partitioner.leave(member)
+            print(f"[Ingest] Worker {member} left, rebalancing")
+
+    @staticmethod
+    def _status(topic, payload):
+        online = parse_status(payload)
+        if online is not None:
+            get_presence().status(device_name_from_topic(topic), online)
+
+    @staticmethod
+    def _content_type(message):
+        # MQTT v5 "content type" property, when the publisher set one
+        return getattr(message.properties, 'ContentType', None) or None
+
+    async def _enqueue(self, topic, payload, content_type=None):
+        try:
+            record = decode_record(topic, payload, content_type)
+        except CodecError as e:
+            print(f"[Ingest] Failed to decode payload on {topic}: {e}")
+            self.stats.incr('rejected')
+            return
+        await self.queue.put(record)
+        self.stats.incr('enqueued')
+
+    # --- Writer ---
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        interval = self.spool_interval if self.spool is not None else self.flush_interval
+        batch = []
+        deadline = loop.time() + interval
+
+        try:
+            while True:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), max(0.0, deadline - loop.time())))
+                    while len(batch) < self.batch_size and not self.queue.empty():
+                        batch.append(self.queue.get_nowait())
+                except asyncio.TimeoutError:
+                    pass
+
+                if len(batch) >= self.batch_size or loop.time() >= deadline:
+                    if batch:
+                        # Hand the batch over before awaiting so a cancel can't write it twice
+                        pending, batch = batch, []
+                        await self._flush(pending)
+                    deadline = loop.time() + interval
+        finally:
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch):
+        if self.spool is not None:
+            await asyncio.to_thread(self.spool.append, batch)
+        else:
+            await sync_to_async(flush_messages)(batch, self.stats)
+
+    # --- Spool replay ---
+    def _replay_one_by_one(self, batch):
+        """
+        Store a batch that failed as a whole message by message. Messages
+        that still fail while the database is reachable are bad data, not an
+        outage: they go to the spool's dead-letter table so the rest of the
+        spool keeps moving. Raises if the database itself is down.
+        """
+        failed = []
+        for message in batch:
+            if not flush_messages([message], self.stats, (self.spool.source, message['position'])):
+                failed.append(message)
+        if failed:
+            if not database_available():
+                raise RuntimeError("database unavailable")
+            self.spool.dead_letter(failed, self.stats.last_error)
+            self.stats.incr('dead_lettered', len(failed))
+            print(f"[Ingest] ⚠️ Moved {len(failed)} unstorable messages to the dead-letter table")
+
+    async def _spool_drain_loop(self):
+        """
+        Replay the spool into the database in batches, backing off while
+        the database is down. A batch that fails is retried one message at
+        a time, and messages that fail on their own are dead-lettered.
+        """
+        from .models import IngestCheckpoint
+
+        def stored_position():
+            checkpoint = IngestCheckpoint.objects.filter(source=self.spool.source).first()
+            return checkpoint.position if checkpoint else 0
+
+        delay = self.reconnect_delay
+        resumed = False
+        while True:
+            try:
+                if not resumed:
+                    # Drop what a previous run stored but did not get to ack
+                    await asyncio.to_thread(self.spool.ack, await sync_to_async(stored_position)())
+                    resumed = True
+
+                if await asyncio.to_thread(self.spool.depth) < self.batch_size:
+                    await asyncio.sleep(self.flush_interval)
+                position, batch = await asyncio.to_thread(self.spool.read, self.batch_size)
+                if not batch:
+                    continue
+                if not await sync_to_async(flush_messages)(batch, self.stats, (self.spool.source, position)):
+                    await sync_to_async(self._replay_one_by_one)(batch)
+                await asyncio.to_thread(self.spool.ack, position)
+                delay = self.reconnect_delay
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Ingest] ⚠️ Spool replay failed ({e}), {self.spool.depth()} messages kept; retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _drain(self):
+        """Write whatever is still queued on shutdown."""
+        while not self.queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await self._flush(batch)
+
+    async def _metrics_loop(self):
+        # Served by /api/ingest/stats/ from the shared cache
+        while True:
+            try:
+                await sync_to_async(publish_metrics)(self.worker_id, 'worker', self.metrics(), self.metrics_interval)
+            except Exception as e:
+                print(f"[Ingest] ⚠️ Could not publish metrics: {e}")
+            await asyncio.sleep(self.metrics_interval)
+
+    def metrics(self):
+        data = self.stats.snapshot()
+        data['queue_depth'] = self.queue.qsize() if self.queue is not None else 0
+        data['queue_capacity'] = self.max_queue
+        data['connected'] = self.connected
+        data['topics'] = self.topics
+        data['worker_id'] = self.worker_id
+        data['partition'] = self.partition
+        if self.partitioner is not None:
+            data['members'] = sorted(self.partitioner.members)
+            data['rebalances'] = self.partitioner.rebalances
+        if self.spool is not None:
+            data['spool'] = self.spool.metrics()
+        return data
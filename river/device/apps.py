@@ -1,11 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 class DeviceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'device'
 
     def ready(self):
-        # Start the MQTT client when the app is ready
+        # Connect identity cache and snapshot index invalidation signals
+        from . import identity, snapshot  # noqa: F401
+
+        # Ingestion normally runs as its own process (manage.py ingest);
+        # MQTT_AUTOSTART keeps the old in-process listener for development
+        if not settings.MQTT_AUTOSTART:
+            return
+
         # This will run the MQTT client in a separate thread
         try:
             from .mqtt_client import start_mqtt
@@ -0,0 +1,147 @@
+import json
+import uuid
+from functools import lru_cache
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .codecs import payload_samples
+
+
+# === Dashboard broadcast ===
+# Every message goes to the fleet-wide group plus the groups of its device
+# and region, so subscribed dashboards only receive what they asked for.
+SENSORS_GROUP = 'sensors'
+
+
+def device_group(device_id):
+    return f'sensors.device.{device_id}'
+
+
+def region_group(region):
+    slug = slugify(region or '')[:80]
+    return f'sensors.region.{slug}' if slug else None
+
+
+def sensor_frame(device_name, payload, samples=1):
+    """Format a telemetry payload the way the dashboard frontend expects it."""
+    frame = {
+        "type": "sensor_data",
+        "device_id": device_name,
+        "timestamp": payload.get("timestamp") or timezone.now().isoformat(),
+        "data": {
+            "ph": payload.get("ph", 0.0),
+            "temperature": payload.get("temperature", 0.0),
+            "turbidity": payload.get("turbidity", 0.0),
+            "dissolved_oxygen": payload.get("dissolved_oxygen", 0.0),
+            "ise": payload.get("ise_value", 0.0),  # Cyanide
+            "conductivity": payload.get("conductivity", 0.0),
+            "orp": payload.get("orp", 0.0),
+            "ec": payload.get("conductivity", 0.0),  # Also conductivity
+            "value": payload.get("mercury_ppb", 0.0)  # Lead level
+        }
+    }
+    if samples > 1:
+        # Batch envelope: the frame shows its newest sample
+        frame["samples"] = samples
+    return frame
+
+
+def sensor_event(device_name, payload):
+    """
+    Channel-layer event for one message. The frame is serialized here, once,
+    and every dashboard consumer forwards the same text. A batch envelope is
+    sent as one frame carrying its last sample.
+    """
+    samples = payload_samples(payload)
+    return {
+        'type': 'send.sensor.data',
+        'event_id': uuid.uuid4().hex,   # a client in several of its groups gets it once
+        'device_id': device_name,
+        'text': json.dumps(sensor_frame(device_name, samples[-1], len(samples))),
+    }
+
+
+@lru_cache(maxsize=4096)
+def trim_frame(text, parameters):
+    """
+    A sensor_data frame with only the `parameters` (a frozenset) left in its
+    data. Memoized, so each parameter subset of an event is serialized once
+    per process however many dashboards asked for it.
+    """
+    frame = json.loads(text)
+    frame["data"] = {key: value for key, value in frame["data"].items() if key in parameters}
+    return json.dumps(frame)
+
+
+def message_events(message):
+    """[(group, event)] for one message; the event object is shared by all its groups."""
+    from device.identity import get_resolver
+
+    event = sensor_event(message['device_name'], message['payload'])
+    groups = [SENSORS_GROUP]
+
+    device_id = message.get('device_id')
+    if device_id is not None:
+        groups.append(device_group(device_id))
+        region = region_group(get_resolver().region(device_id))
+        if region:
+            groups.append(region)
+
+    return [(group, event) for group in groups]
+
+
+async def group_send_events(channel_layer, events):
+    for group, event in events:
+        await channel_layer.group_send(group, event)
+
+
+def broadcast_messages(messages):
+    """
+    Send every message of a flushed batch to its dashboard groups in one
+    event-loop hop, skipping duplicates of already stored messages.
+    Returns {device name: frame text} of the newest frames.
+    """
+    frames = {}
+    events = []
+    for message in messages:
+        if message.get('duplicate'):
+            continue
+        pairs = message_events(message)
+        events.extend(pairs)
+        frames[message['device_name']] = pairs[0][1]['text']
+
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(group_send_events)(channel_layer, events)
+    return frames
+
+
+# === Streaming device acks ===
+# Records from a streaming WebSocket device carry the connection's channel
+# name and the frame's "seq"; once the batch they were in is written (or
+# lost) the connection is told, so it only acks what is really stored.
+
+async def send_channel_events(channel_layer, events):
+    for channel, event in events:
+        await channel_layer.send(channel, event)
+
+
+def report_stored(messages, stored):
+    """Tell streaming connections which of their frames were stored (or failed to be)."""
+    seqs = {}
+    for message in messages:
+        channel = message.get('reply_channel')
+        if channel is not None:
+            seqs.setdefault(channel, []).append(message['seq'])
+    if not seqs:
+        return
+
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        event_type = 'stream.stored' if stored else 'stream.failed'
+        async_to_sync(send_channel_events)(channel_layer, [
+            (channel, {'type': event_type, 'seqs': values}) for channel, values in seqs.items()
+        ])
@@ -0,0 +1,319 @@
+import json
+import math
+import struct
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+# === Telemetry payload codecs ===
+# Every codec turns the raw MQTT payload into the same telemetry record the
+# rest of the pipeline works with, whatever transport it came in on:
+#
+#     {'device_name': 'river-watcher-23', 'payload': {'ph': 7.1, 'temperature': 18.2, ...},
+#      'received_at': <epoch seconds>}
+#
+# 'received_at' is stamped per message as it is decoded and kept by the spool;
+# it is the reading time of messages without a timestamp of their own. Ingest
+# adds 'device_id' and 'duplicate' as the record moves through device/ingest.py.
+#
+# where the payload uses the JSON message keys (see SENSOR_TYPE_FIELDS in
+# device/ingest.py) plus optional "timestamp" and "seq", or a batch envelope
+# of such samples (see below). The codec is picked from the MQTT v5 content
+# type when the publisher sets one, else from the last topic level
+# (devices/<id>/telemetry/cbor), else JSON.
+
+class CodecError(ValueError):
+    pass
+
+
+def device_name_from_topic(topic):
+    topic_parts = topic.split('/')
+    return topic_parts[1] if len(topic_parts) > 1 else 'unknown'
+
+
+def _decode_json(data):
+    # json.loads() takes the bytes as they are, no separate str copy
+    return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+
+def _decode_msgpack(data):
+    try:
+        import msgpack
+    except ImportError:
+        raise CodecError("MessagePack payloads require the 'msgpack' package")
+    # Unpacks straight from the buffer
+    return msgpack.unpackb(data, raw=False)
+
+
+def _decode_cbor(data):
+    try:
+        import cbor2
+    except ImportError:
+        raise CodecError("CBOR payloads require the 'cbor2' package")
+    return cbor2.loads(data)
+
+
+# --- Packed struct ---
+# Fixed little-endian layouts keyed by their leading version byte. Absent
+# measurements are sent as NaN.
+STRUCT_SCHEMAS = {
+    1: (
+        struct.Struct('<BIQ9f'),
+        ('seq', 'timestamp_ms', 'ph', 'temperature', 'turbidity', 'dissolved_oxygen',
+         'ise_value', 'conductivity', 'orp', 'ec', 'mercury_ppb'),
+    ),
+}
+
+
+def _decode_struct(data):
+    view = memoryview(data)
+    if not view.nbytes:
+        raise CodecError("Empty packed payload")
+    schema = STRUCT_SCHEMAS.get(view[0])
+    if schema is None:
+        raise CodecError(f"Unknown packed payload version {view[0]}")
+    layout, fields = schema
+    if view.nbytes != layout.size:
+        raise CodecError(f"Packed payload v{view[0]} must be {layout.size} bytes, got {view.nbytes}")
+
+    # unpack_from reads the fields in place
+    values = layout.unpack_from(view)[1:]
+    payload = {}
+    for field, value in zip(fields, values):
+        if field == 'timestamp_ms':
+            if value:
+                payload['timestamp'] = value
+        elif not (isinstance(value, float) and math.isnan(value)):
+            payload[field] = value
+    return payload
+
+
+def encode_struct(payload, version=1):
+    """Pack a payload dict with schema `version` (for device firmware tests and simulators)."""
+    layout, fields = STRUCT_SCHEMAS[version]
+    values = []
+    for field in fields:
+        if field == 'timestamp_ms':
+            values.append(int(payload.get('timestamp') or 0))
+        elif field == 'seq':
+            values.append(int(payload.get('seq') or 0))
+        else:
+            value = payload.get(field)
+            values.append(math.nan if value is None else float(value))
+    return layout.pack(version, *values)
+
+
+CODECS = {
+    'json': _decode_json,
+    'msgpack': _decode_msgpack,
+    'cbor': _decode_cbor,
+    'struct': _decode_struct,
+}
+
+CONTENT_TYPES = {
+    'application/json': 'json',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+    'application/cbor': 'cbor',
+    'application/vnd.river.packed': 'struct',
+    'application/octet-stream': 'struct',
+}
+
+
+def select_codec(topic, content_type=None):
+    if content_type:
+        name = CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+        if name is None:
+            raise CodecError(f"Unsupported content type {content_type!r}")
+        return name
+    suffix = topic.rsplit('/', 1)[-1]
+    return suffix if suffix in CODECS else 'json'
+
+
+# --- Batch envelopes ---
+# A station that buffered readings while offline can send them in one message,
+# either as a list of samples
+#
+#     {"samples": [{"timestamp": 1718000000, "ph": 7.1, ...}, ...]}
+#
+# or as one array per parameter
+#
+#     {"columns": {"timestamp": [...], "ph": [...], "temperature": [...]}}
+#
+# Keys next to "samples"/"columns" apply to every sample. Both forms are
+# normalized to {"samples": [...]}, every sample needs its own valid timestamp
+# no more than INGEST_MAX_CLOCK_SKEW seconds in the future, and one invalid
+# sample rejects the whole envelope.
+MEASUREMENT_KEYS = (
+    'ph', 'temperature', 'turbidity', 'dissolved_oxygen', 'ise_value', 'conductivity', 'orp', 'ec', 'mercury_ppb',
+)
+
+
+def parse_timestamp(value):
+    """Aware UTC datetime from a datetime, an ISO 8601 string or epoch seconds/milliseconds; None if invalid."""
+    if isinstance(value, datetime):
+        moment = value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = value / 1000 if value > 1e11 else value  # epoch milliseconds
+        try:
+            moment = datetime.fromtimestamp(seconds, dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    elif isinstance(value, str):
+        try:
+            moment = parse_datetime(value)
+        except ValueError:
+            return None
+        if moment is None:
+            return None
+    else:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, dt_timezone.utc)
+    return moment
+
+
+def _timestamp(value):
+    # CBOR can carry native datetimes; keep the record JSON-serializable for the spool
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=dt_timezone.utc)
+        return value.isoformat()
+    return value
+
+
+def _columns_to_samples(columns):
+    if not isinstance(columns, dict) or not columns:
+        raise CodecError('"columns" must be a map of parameter -> array')
+    lengths = set()
+    for key, values in columns.items():
+        if not isinstance(values, list):
+            raise CodecError(f'Column "{key}" must be an array')
+        lengths.add(len(values))
+    if len(lengths) != 1:
+        raise CodecError(f"Columns must all have the same length, got {sorted(lengths)}")
+    keys = list(columns)
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+
+def _check_measurements(label, sample):
+    for key in MEASUREMENT_KEYS:
+        value = sample.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise CodecError(f'{label} has a non-numeric "{key}"')
+
+
+def _validate_sample(index, sample, latest):
+    # A sample without a usable time of its own would be stored at arrival
+    # time, and every such sample of the envelope under the same key
+    if not isinstance(sample, dict):
+        raise CodecError(f"Sample {index} must be a map")
+    moment = parse_timestamp(sample.get('timestamp'))
+    if moment is None:
+        raise CodecError(f"Sample {index} has no valid timestamp")
+    if moment > latest:
+        raise CodecError(f"Sample {index} is timestamped {moment.isoformat()}, too far in the future")
+    _check_measurements(f"Sample {index}", sample)
+
+
+def _normalize_batch(payload):
+    common = {key: value for key, value in payload.items() if key not in ('samples', 'columns')}
+    if 'columns' in payload:
+        samples = _columns_to_samples(payload['columns'])
+    else:
+        samples = payload['samples']
+        if not isinstance(samples, list):
+            raise CodecError('"samples" must be an array')
+
+    limit = getattr(settings, 'INGEST_MAX_BATCH_SAMPLES', 10000)
+    if not samples:
+        raise CodecError("Batch envelope has no samples")
+    if len(samples) > limit:
+        raise CodecError(f"Batch envelope has {len(samples)} samples, the limit is {limit}")
+
+    latest = timezone.now() + timedelta(seconds=getattr(settings, 'INGEST_MAX_CLOCK_SKEW', 300))
+    normalized = []
+    for index, sample in enumerate(samples):
+        if isinstance(sample, dict):
+            sample = {**common, **sample}
+            sample['timestamp'] = _timestamp(sample.get('timestamp'))
+        _validate_sample(index, sample, latest)
+        normalized.append(sample)
+    return {'samples': normalized}
+
+
+def normalize_payload(payload):
+    """Validate a decoded payload; batch envelopes come back as {"samples": [...]}."""
+    if not isinstance(payload, dict):
+        raise CodecError("Telemetry payload must be a map")
+    if 'samples' in payload or 'columns' in payload:
+        return _normalize_batch(payload)
+    # A single reading is checked like a batch sample, so a bad value is
+    # rejected by the transport instead of failing the whole flush. Its
+    # timestamp is optional, and one too far in the future falls back to
+    # arrival time (see reading_time() in device/ingest.py).
+    _check_measurements("Payload", payload)
+    if payload.get('timestamp') is not None:
+        if parse_timestamp(payload['timestamp']) is None:
+            raise CodecError(f"Invalid timestamp {payload['timestamp']!r}")
+        payload['timestamp'] = _timestamp(payload['timestamp'])
+    return payload
+
+
+def payload_samples(payload):
+    """The samples carried by a normalized payload, oldest first as the device sent them."""
+    return payload['samples'] if 'samples' in payload else [payload]
+
+
+def decode_with(name, data):
+    """Decode raw bytes with codec `name`, without normalizing; raises CodecError."""
+    try:
+        return CODECS[name](data)
+    except CodecError:
+        raise
+    except Exception as e:
+        raise CodecError(f"Invalid {name} payload: {e}")
+
+
+def encode_with(name, obj):
+    """Encode a reply (acks, heartbeats) for a peer speaking codec `name`: str for JSON, bytes otherwise."""
+    if name == 'msgpack':
+        try:
+            import msgpack
+        except ImportError:
+            raise CodecError("MessagePack payloads require the 'msgpack' package")
+        return msgpack.packb(obj)
+    if name == 'cbor':
+        try:
+            import cbor2
+        except ImportError:
+            raise CodecError("CBOR payloads require the 'cbor2' package")
+        return cbor2.dumps(obj)
+    return json.dumps(obj)
+
+
+def decode_payload(topic, data, content_type=None):
+    """Decode one raw payload into a payload dict; raises CodecError on anything malformed."""
+    return normalize_payload(decode_with(select_codec(topic, content_type), data))
+
+
+def telemetry_record(device_name, payload):
+    """
+    The record every transport hands to the ingest pipeline, from an already
+    decoded payload (WebSocket JSON, legacy handlers). Raises CodecError.
+    """
+    return {'device_name': device_name, 'payload': normalize_payload(payload), 'received_at': time.time()}
+
+
+def decode_record(topic, data, content_type=None):
+    """Telemetry record for a raw MQTT message received on `topic`."""
+    return {
+        'device_name': device_name_from_topic(topic),
+        'payload': decode_payload(topic, data, content_type),
+        'received_at': time.time(),
+    }
@@ -1,58 +1,276 @@
+import asyncio
 import json
+import logging
+from collections import deque
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
-from device.utils import save_sensor_data
+from django.conf import settings
+from django.core.cache import cache
+from device.broadcast import SENSORS_GROUP, device_group, region_group, trim_frame
+from device.codecs import CodecError, decode_with, encode_with, payload_samples, telemetry_record
+from device.ingest import get_pipeline
+from device.presence import PRESENCE_GROUP, get_presence
+from device.snapshot import SNAPSHOT_KEY, SNAPSHOT_LOCK_KEY, build_snapshot, device_index, seed_snapshot
 from django.utils import timezone
 from datetime import timedelta
 
+logger = logging.getLogger(__name__)
+
 
 # --- WebSocket Consumer: Device to Backend ---
+# Subprotocols of the streaming device protocol -> frame codec
+DEVICE_STREAM_PROTOCOLS = {
+    'river.stream.msgpack': 'msgpack',
+    'river.stream.cbor': 'cbor',
+    'river.stream.json': 'json',
+}
+
+
 class DeviceConsumer(AsyncWebsocketConsumer):
+    """
+    Telemetry from a WebSocket-connected device, queued on the same batched
+    writer as MQTT.
+
+    Plain connections send JSON text frames and get a
+    {"status": "received"} reply per frame. A client that negotiates one of
+    DEVICE_STREAM_PROTOCOLS (Sec-WebSocket-Protocol) streams instead:
+    frames are MessagePack/CBOR binary (or JSON text) payloads or batch
+    envelopes numbered with an increasing integer "seq", and the server
+    answers with one cumulative {"type": "ack", "seq": <n>, "frames": n,
+    "rejected": [...], "failed": [...]} every DEVICE_STREAM_ACK_EVERY
+    settled frames or DEVICE_STREAM_ACK_INTERVAL seconds, whichever comes
+    first.
+
+    An ack's "seq" means every frame up to it is committed to the database:
+    the writer reports each flushed batch back to this connection, and a
+    frame that was dropped by backpressure or lost with a failed batch is
+    listed under "failed" and holds the ack back until it is resent.
+    "rejected" frames are malformed and will never be stored. "seq" doubles
+    as the reading sequence, and streamed frames must carry their own
+    timestamp (per sample for batches): the (device, timestamp, sequence)
+    key is what makes a resent frame a duplicate instead of a second row.
+    """
+
     async def connect(self):
         self.device_name = self.scope['url_route']['kwargs']['device_name']
         self.group_name = f'device_{self.device_name.lower()}'
 
+        protocol = next((p for p in self.scope.get('subprotocols', []) if p in DEVICE_STREAM_PROTOCOLS), None)
+        self.codec = DEVICE_STREAM_PROTOCOLS.get(protocol)
+        self.ack_every = getattr(settings, 'DEVICE_STREAM_ACK_EVERY', 100)
+        self.ack_interval = getattr(settings, 'DEVICE_STREAM_ACK_INTERVAL', 0.2)
+        self.acked_seq = None   # every frame up to this one is stored
+        self.highest_seq = None
+        self.queued = set()     # seqs handed to the writer, not stored yet
+        self.failed = set()     # seqs lost before they were stored
+        self.settled = 0        # frames stored, failed or rejected since the last ack
+        self.rejected = []
+        self.newly_failed = []
+        self.ack_task = None
+
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
+        await self.accept(subprotocol=protocol)
+        get_presence().status(self.device_name, True)
 
         # Notify successful connection
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'heartbeat',
             'data': f'Device {self.device_name} is connected'
-        }))
+        })
 
     async def disconnect(self, close_code):
+        if self.ack_task is not None:
+            self.ack_task.cancel()
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        get_presence().status(self.device_name, False)
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def send_frame(self, data):
+        if self.codec in (None, 'json'):
+            await self.send(text_data=json.dumps(data))
+        else:
+            await self.send(bytes_data=encode_with(self.codec, data))
 
-        # Save incoming sensor data to the database
-        await sync_to_async(save_sensor_data)(self.device_name, data)
+    async def submit(self, record):
+        # Same batched writer as MQTT: stored, cached and broadcast when the pipeline flushes
+        pipeline = get_pipeline()
+        if pipeline.policy == 'block':
+            return await asyncio.to_thread(pipeline.submit, record)
+        return pipeline.submit(record)
 
-        # Broadcast to frontend dashboard
-        await self.channel_layer.group_send(
-            "sensors",
-            {
-                "type": "send.sensor.data",
-                "data": {
-                    "device": self.device_name,
-                    "payload": data
-                }
-            }
-        )
+    async def receive(self, text_data=None, bytes_data=None):
+        if self.codec is not None:
+            await self.receive_stream(text_data, bytes_data)
+            return
+
+        # A single reading or a batch envelope ({"samples": [...]} / {"columns": {...}})
+        try:
+            if text_data is None:
+                raise CodecError("Binary frames need a river.stream.* subprotocol")
+            record = telemetry_record(self.device_name, json.loads(text_data))
+        except (json.JSONDecodeError, CodecError) as e:
+            await self.send(text_data=json.dumps({"status": "rejected", "error": str(e)}))
+            return
+
+        accepted = await self.submit(record)
 
         # Optional ack
-        await self.send(text_data=json.dumps({"status": "received"}))
+        await self.send(text_data=json.dumps({
+            "status": "received" if accepted else "dropped",
+            "samples": len(payload_samples(record['payload']))
+        }))
+
+    # --- Streaming protocol ---
+    async def receive_stream(self, text_data, bytes_data):
+        seq = None
+        try:
+            frame = decode_with('json' if bytes_data is None else self.codec, bytes_data or text_data)
+            if isinstance(frame, dict):
+                seq = frame.get('seq')
+            if isinstance(seq, bool) or not isinstance(seq, int):
+                raise CodecError('Streamed frames need an integer "seq"')
+            record = telemetry_record(self.device_name, frame)
+            if 'samples' not in record['payload'] and record['payload'].get('timestamp') is None:
+                raise CodecError("Streamed frames need their own timestamp")
+        except CodecError as e:
+            self.rejected.append({"seq": seq, "error": str(e)})
+            await self.settle(1)
+            return
+
+        # The writer reports back (stream_stored / stream_failed) once the batch is flushed
+        record['reply_channel'] = self.channel_name
+        record['seq'] = seq
+        self.highest_seq = seq if self.highest_seq is None else max(self.highest_seq, seq)
+        self.failed.discard(seq)
+        self.queued.add(seq)
+        if not await self.submit(record):
+            await self.stream_failed({'seqs': [seq]})
+
+    async def stream_stored(self, event):
+        for seq in event['seqs']:
+            self.queued.discard(seq)
+            self.failed.discard(seq)
+        await self.settle(len(event['seqs']))
+
+    async def stream_failed(self, event):
+        for seq in event['seqs']:
+            self.queued.discard(seq)
+            self.failed.add(seq)
+            self.newly_failed.append(seq)
+        await self.settle(len(event['seqs']))
+
+    async def settle(self, frames):
+        self.settled += frames
+        if self.settled >= self.ack_every:
+            await self.send_ack()
+        elif self.ack_task is None:
+            self.ack_task = asyncio.ensure_future(self.ack_later())
+
+    def committed_seq(self):
+        """Highest seq such that every frame up to it is stored."""
+        outstanding = self.queued | self.failed
+        seq = min(outstanding) - 1 if outstanding else self.highest_seq
+        if self.acked_seq is not None and (seq is None or seq < self.acked_seq):
+            # A resend of an already stored frame doesn't take the ack back
+            return self.acked_seq
+        return seq
+
+    async def ack_later(self):
+        try:
+            await asyncio.sleep(self.ack_interval)
+        finally:
+            self.ack_task = None
+        await self.send_ack()
+
+    async def send_ack(self):
+        if self.ack_task is not None:
+            self.ack_task.cancel()
+            self.ack_task = None
+        if not self.settled:
+            return
+        self.acked_seq = self.committed_seq()
+        ack = {"type": "ack", "seq": self.acked_seq, "frames": self.settled}
+        if self.rejected:
+            ack["rejected"] = self.rejected
+        if self.newly_failed:
+            ack["failed"] = self.newly_failed
+        self.settled, self.rejected, self.newly_failed = 0, [], []
+        await self.send_frame(ack)
 
     async def send_device_data(self, event):
         await self.send(text_data=json.dumps(event["data"]))
 
 
+# --- WebSocket Consumer: Device Presence ---
+class PresenceConsumer(AsyncWebsocketConsumer):
+    """
+    Sends every device's online state once on connect as
+    {"type": "presence_snapshot", "items": [...]}, then a
+    {"type": "presence", "items": [...]} frame whenever devices go online
+    or offline.
+    """
+
+    async def connect(self):
+        await self.channel_layer.group_add(PRESENCE_GROUP, self.channel_name)
+        await self.accept()
+        await self.send(text_data=json.dumps({"type": "presence_snapshot", "items": await self.current_presence()}))
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(PRESENCE_GROUP, self.channel_name)
+
+    @sync_to_async
+    def current_presence(self):
+        from device.models import Device
+
+        rows = Device.objects.values_list('name', 'is_online', 'state__last_seen').order_by('name')
+        return [
+            {"device_id": name, "online": online, "last_seen": last_seen.isoformat() if last_seen else None}
+            for name, online, last_seen in rows
+        ]
+
+    async def send_presence(self, event):
+        # Already serialized once by the presence tracker
+        await self.send(text_data=event["text"])
+
+
 # --- WebSocket Consumer: Dashboard Frontend ---
+
+
 class SensorDataConsumer(AsyncWebsocketConsumer):
+    """
+    Dashboard feed. Updates are coalesced per client: at most one frame per
+    device per `interval` seconds, carrying that device's latest values.
+    Clients can tune this by sending
+    {"type": "configure", "interval": 0.5, "batch": true}; with "batch" the
+    pending updates of all devices go out as one "sensor_batch" frame.
+
+    By default a client gets the whole fleet. Sending
+    {"type": "subscribe", "devices": [...], "regions": [...], "parameters": [...]}
+    (or "unsubscribe" with the same keys) narrows that down: the client moves
+    from the fleet group to per-device/per-region groups, and "parameters"
+    trims each frame's data to the listed keys. A device frame reaches a
+    client once even when it is subscribed to the device and its region.
+    With no device or region subscriptions left the client is back on the
+    whole fleet.
+
+    On connect the client gets the latest state of every device as one
+    {"type": "sensor_snapshot", "items": [...]} frame, read from the cache
+    that ingestion keeps up to date.
+    """
+
     async def connect(self):
-        await self.channel_layer.group_add("sensors", self.channel_name)
+        self.interval = getattr(settings, 'SENSOR_BROADCAST_INTERVAL', 1.0)
+        self.batch = False
+        self.pending = {}       # device id -> latest pre-serialized frame
+        self.last_sent = {}     # device id -> loop time of the last frame sent
+        self.flush_task = None
+        self.devices = {}       # device name -> channel group
+        self.regions = {}       # region -> channel group
+        self.parameters = frozenset()
+        self.groups_joined = {SENSORS_GROUP}
+        self.recent_events = deque(maxlen=256)   # event ids already sent, when in several groups
+        self.recent_event_ids = set()
+
+        await self.channel_layer.group_add(SENSORS_GROUP, self.channel_name)
         await self.accept()
 
         # Send connection confirmation
@@ -61,123 +279,218 @@ class SensorDataConsumer(AsyncWebsocketConsumer):
             "data": "Sensor dashboard connected"
         }))
 
-        # Send existing sensor data from database
+        # Send the latest state of every device
         await self.send_existing_data()
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard("sensors", self.channel_name)
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        for group in self.groups_joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
 
     async def receive(self, text_data):
-        data = json.loads(text_data)
-        print("Dashboard received:", data)  # Optional for debugging
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+
+        if not isinstance(data, dict):
+            return
+        if data.get("type") == "configure":
+            await self.configure(data)
+        elif data.get("type") in ("subscribe", "unsubscribe"):
+            await self.update_subscriptions(data, subscribe=data["type"] == "subscribe")
+
+    @sync_to_async
+    def device_groups(self, names):
+        from device.models import Device
+
+        found = Device.objects.filter(name__in=names).values_list('name', 'pk')
+        return {name: device_group(pk) for name, pk in found}
+
+    async def update_subscriptions(self, request, subscribe=True):
+        devices = [str(name) for name in request.get("devices") or []]
+        regions = [str(region) for region in request.get("regions") or []]
+        parameters = frozenset(str(parameter) for parameter in request.get("parameters") or [])
+
+        if subscribe:
+            self.devices.update(await self.device_groups(devices))
+            self.regions.update({region: group for region in regions if (group := region_group(region))})
+            self.parameters |= parameters
+        else:
+            for name in devices:
+                self.devices.pop(name, None)
+            for region in regions:
+                self.regions.pop(region, None)
+            self.parameters -= parameters
+
+        wanted = set(self.devices.values()) | set(self.regions.values()) or {SENSORS_GROUP}
+        for group in wanted - self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        for group in self.groups_joined - wanted:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.groups_joined = wanted
+
+        await self.send(text_data=json.dumps({
+            "type": "subscriptions",
+            "devices": sorted(self.devices),
+            "regions": sorted(self.regions),
+            "parameters": sorted(self.parameters)
+        }))
+
+    async def configure(self, options):
+        minimum = getattr(settings, 'SENSOR_BROADCAST_MIN_INTERVAL', 0.1)
+        try:
+            self.interval = min(max(float(options.get("interval", self.interval)), minimum), 60.0)
+        except (TypeError, ValueError):
+            pass
+        self.batch = bool(options.get("batch", self.batch))
+
+        await self.send(text_data=json.dumps({
+            "type": "configured",
+            "interval": self.interval,
+            "batch": self.batch
+        }))
 
     async def send_sensor_data(self, event):
         """Handle sensor data from MQTT and send to frontend"""
-        try:
+        event_id = event.get("event_id")
+        if event_id is not None and len(self.groups_joined) > 1:
+            # The same event arrives once per group: subscribed to a device and its region
+            if event_id in self.recent_event_ids:
+                return
+            if len(self.recent_events) == self.recent_events.maxlen:
+                self.recent_event_ids.discard(self.recent_events[0])
+            self.recent_events.append(event_id)
+            self.recent_event_ids.add(event_id)
+
+        text = event.get("text")
+        device_id = event.get("device_id", "unknown")
+        if text is None:
+            # Event without a pre-serialized frame: format it here
             data = event["data"]
             device_id = data.get("device_id", "unknown")
-            timestamp = data.get("timestamp") or timezone.now().isoformat()
             sensor_data = data.get("data", {})
-            
-            # Format the data to match frontend expectations
-            formatted_data = {
+            text = json.dumps({
                 "type": "sensor_data",
                 "device_id": device_id,
-                "timestamp": timestamp,
+                "timestamp": data.get("timestamp") or timezone.now().isoformat(),
                 "data": {
                     "ph": sensor_data.get("ph", 0.0),
                     "temperature": sensor_data.get("temperature", 0.0),
                     "turbidity": sensor_data.get("turbidity", 0.0),
                     "dissolved_oxygen": sensor_data.get("dissolved_oxygen", 0.0),
-                    "ise": sensor_data.get("ise", 0.0),  # Cyanide (from ise_value)
-                    "conductivity": sensor_data.get("tds", 0.0),  # Conductivity (from conductivity)
+                    "ise": sensor_data.get("ise", 0.0),
+                    "conductivity": sensor_data.get("tds", 0.0),
                     "orp": sensor_data.get("orp", 0.0),
-                    "ec": sensor_data.get("ec", 0.0),  # Also conductivity
-                    "value": sensor_data.get("value", 0.0)  # Lead level (from mercury_ppb)
+                    "ec": sensor_data.get("ec", 0.0),
+                    "value": sensor_data.get("value", 0.0)
                 }
-            }
-            
-            print(f"[WebSocket] 📡 Sending sensor data to frontend: {formatted_data}")
-            await self.send(text_data=json.dumps(formatted_data))
-            
-        except Exception as e:
-            print(f"[WebSocket] ❌ Error sending sensor data: {e}")
-            import traceback
-            traceback.print_exc()
+            })
+
+        if self.parameters:
+            text = trim_frame(text, self.parameters)
+
+        now = asyncio.get_running_loop().time()
+        if (not self.batch and device_id not in self.pending
+                and now - self.last_sent.get(device_id, float('-inf')) >= self.interval):
+            self.last_sent[device_id] = now
+            await self.send(text_data=text)
+            return
+
+        # Coalesce: keep only the newest frame per device until the next flush
+        self.pending[device_id] = text
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_pending())
+
+    async def flush_pending(self):
+        try:
+            await asyncio.sleep(self.interval)
+        finally:
+            self.flush_task = None
+
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+
+        now = asyncio.get_running_loop().time()
+        for device_id in pending:
+            self.last_sent[device_id] = now
+
+        if self.batch:
+            # Frames are already JSON; splice them instead of re-serializing
+            await self.send(text_data='{"type": "sensor_batch", "items": [' + ', '.join(pending.values()) + ']}')
+        else:
+            for text in pending.values():
+                await self.send(text_data=text)
 
     @sync_to_async
-    def get_recent_sensor_data(self):
-        """Get recent sensor readings from the database"""
+    def build_snapshot(self):
+        """Splice the frames ingest published per device, or fall back to the database"""
+        text = build_snapshot(device_index())
+        return text if text is not None else self.build_snapshot_from_db()
+
+    def build_snapshot_from_db(self):
+        """Cold-cache fallback: latest values of every device heard from in the last 24 hours"""
         # Import models here to avoid AppRegistryNotReady error
-        from device.models import SensorReading, Device
-        
-        print("🔍 Querying database for sensor readings...")
-        
-        # Get all readings first to see what we have
-        all_readings = SensorReading.objects.all()
-        print(f"📊 Total readings in database: {all_readings.count()}")
-        
-        if all_readings.count() > 0:
-            # Show some sample readings
-            sample_readings = all_readings[:3]
-            for reading in sample_readings:
-                print(f"📋 Sample reading: {reading} - timestamp: {reading.timestamp}")
-        
-        # Get readings from the last 24 hours (but be more lenient)
-        from django.utils import timezone
-        recent_time = timezone.now() - timedelta(hours=24)
-        print(f"⏰ Looking for readings after: {recent_time}")
-        
-        readings = SensorReading.objects.filter(
-            timestamp__gte=recent_time
-        ).select_related('device', 'sensor').order_by('-timestamp')[:50]  # Last 50 readings
-        
-        print(f"📊 Found {readings.count()} readings in last 24 hours")
-        
-        # If no recent readings, get all readings (up to 50)
-        if readings.count() == 0:
-            print("⚠️ No recent readings found, getting all readings...")
-            readings = SensorReading.objects.all().select_related('device', 'sensor').order_by('-timestamp')[:50]
-            print(f"📊 Found {readings.count()} total readings")
-        
-        return list(readings)
+        from device.models import DeviceState
+
+        def format_value(val):
+            return None if val is None else round(val, 4)
+
+        states = DeviceState.objects.filter(
+            timestamp__gte=timezone.now() - timedelta(hours=24)
+        ).select_related('device').order_by('-timestamp')
+
+        frames = {}
+        for state in states:
+            frames[state.device.name] = json.dumps({
+                "type": "sensor_data",
+                "device_id": state.device.name,
+                "timestamp": state.timestamp.isoformat(),
+                "data": {
+                    "ph": format_value(state.pH),
+                    "temperature": format_value(state.temperature),
+                    "turbidity": format_value(state.turbidity),
+                    "dissolved_oxygen": format_value(state.dissolved_oxygen),
+                    "ise": format_value(state.ise),  # Cyanide
+                    "conductivity": format_value(state.tds),  # Conductivity
+                    "orp": format_value(state.orp),
+                    "ec": format_value(state.ec),  # Also conductivity
+                    "value": format_value(state.value)  # Lead level
+                }
+            })
+
+        return seed_snapshot(frames)
+
+    async def load_snapshot(self):
+        """The cached snapshot frame; on a miss only one client per fleet rebuilds it."""
+        text = await cache.aget(SNAPSHOT_KEY)
+        if text is not None:
+            return text
+
+        wait = getattr(settings, 'SENSOR_SNAPSHOT_BUILD_WAIT', 2.0)
+        if not await cache.aadd(SNAPSHOT_LOCK_KEY, True, timeout=max(1, int(wait * 2))):
+            # Another client is rebuilding: wait for its result, then give up and build too
+            deadline = asyncio.get_running_loop().time() + wait
+            while asyncio.get_running_loop().time() < deadline:
+                await asyncio.sleep(0.05)
+                text = await cache.aget(SNAPSHOT_KEY)
+                if text is not None:
+                    return text
+            return await self.build_snapshot()
+        try:
+            return await self.build_snapshot()
+        finally:
+            await cache.adelete(SNAPSHOT_LOCK_KEY)
 
     async def send_existing_data(self):
-        """Send existing sensor data to the newly connected client"""
+        """Send the latest state of every device to the newly connected client as one frame"""
         try:
-            readings = await self.get_recent_sensor_data()
-            
-            for reading in readings:
-                # Helper function to format numbers to max 4 decimal places
-                def format_value(val):
-                    if val is None:
-                        return None
-                    return round(val, min(4, len(str(val).split('.')[-1]) if '.' in str(val) else 0))
-                
-                # Format data to match frontend expectations
-                sensor_data = {
-                    "type": "sensor_data",
-                    "device_id": reading.device.name if reading.device else "unknown",
-                    "timestamp": reading.timestamp.isoformat(),
-                    "data": {
-                        "ph": format_value(reading.pH),
-                        "temperature": format_value(reading.temperature),
-                        "turbidity": format_value(reading.turbidity),
-                        "dissolved_oxygen": format_value(reading.dissolved_oxygen),
-                        "ise": format_value(reading.ise),  # Cyanide
-                        "conductivity": format_value(reading.tds),  # Conductivity
-                        "orp": format_value(reading.orp),
-                        "ec": format_value(reading.ec),  # Also conductivity
-                        "value": format_value(reading.value)  # Lead level
-                    }
-                }
-                
-                await self.send(text_data=json.dumps(sensor_data))
-                
+            await self.send(text_data=await self.load_snapshot())
+
         except Exception as e:
-            print(f"❌ Error sending existing data: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error sending existing data")
             # Send error message to client
             await self.send(text_data=json.dumps({
                 "type": "error",
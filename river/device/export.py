@@ -0,0 +1,194 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+
+from device.models import Device, SensorReading
+
+
+# format -> (content type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def export_queryset(queryset, parameters=None):
+    """Restrict readings to rows that have at least one of the requested parameters."""
+    if parameters:
+        condition = Q()
+        for parameter in parameters:
+            condition |= Q(**{f'{parameter}__isnull': False})
+        queryset = queryset.filter(condition)
+    return queryset.order_by('timestamp', 'id')
+
+
+def iter_chunks(queryset, parameters, chunk_size=5000):
+    """
+    Yield lists of (id, timestamp, device name, *parameters) tuples.
+
+    Rows come from a server-side cursor and device names from one lookup of
+    the (small) device table, so memory is bounded by `chunk_size`.
+    """
+    device_names = dict(Device.objects.values_list('pk', 'name'))
+    rows = queryset.values_list('id', 'timestamp', 'device_id', *parameters).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield [(pk, timestamp, device_names.get(device_id), *values) for pk, timestamp, device_id, *values in chunk]
+
+
+# --- Writers ---
+
+class _Buffer:
+    """Write-only file object that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def write_csv(chunks, parameters):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data.encode()
+
+    writer.writerow(['id', 'timestamp', 'device', *parameters])
+    yield drain()
+    for chunk in chunks:
+        writer.writerows((pk, timestamp.isoformat(), device, *values) for pk, timestamp, device, *values in chunk)
+        yield drain()
+
+
+def write_ndjson(chunks, parameters):
+    columns = ['id', 'timestamp', 'device', *parameters]
+    for chunk in chunks:
+        lines = []
+        for pk, timestamp, device, *values in chunk:
+            lines.append(json.dumps(dict(zip(columns, (pk, timestamp.isoformat(), device, *values)))))
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def _arrow_batch(pa, schema, chunk):
+    columns = list(zip(*chunk))
+    return pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
+
+def _arrow_schema(pa, parameters):
+    return pa.schema(
+        [('id', pa.int64()), ('timestamp', pa.timestamp('us', tz='UTC')), ('device', pa.string())]
+        + [(parameter, pa.float64()) for parameter in parameters]
+    )
+
+
+def write_parquet(chunks, parameters):
+    pa, pq = _import_pyarrow()
+    schema = _arrow_schema(pa, parameters)
+    buffer = _Buffer()
+    writer = pq.ParquetWriter(buffer, schema, compression='zstd')
+    for chunk in chunks:
+        # One row group per chunk, flushed to the client as soon as it is encoded
+        writer.write_batch(_arrow_batch(pa, schema, chunk))
+        yield buffer.drain()
+    writer.close()
+    yield buffer.drain()
+
+
+def write_arrow(chunks, parameters):
+    pa, _ = _import_pyarrow()
+    schema = _arrow_schema(pa, parameters)
+    buffer = _Buffer()
+    writer = pa.ipc.new_stream(buffer, schema)
+    for chunk in chunks:
+        writer.write_batch(_arrow_batch(pa, schema, chunk))
+        yield buffer.drain()
+    writer.close()
+    yield buffer.drain()
+
+
+WRITERS = {
+    'csv': write_csv,
+    'ndjson': write_ndjson,
+    'parquet': write_parquet,
+    'arrow': write_arrow,
+}
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportError("Parquet/Arrow export requires the 'pyarrow' package")
+    return pyarrow, pyarrow.parquet
+
+
+def stream_export(queryset, fmt, parameters=None, chunk_size=5000):
+    """Return an iterator of encoded bytes for the filtered readings in `fmt`."""
+    if fmt not in WRITERS:
+        raise ExportError(f"Unknown export format {fmt!r}, expected one of {', '.join(WRITERS)}")
+    parameters = list(parameters or SensorReading.MEASUREMENT_FIELDS)
+    unknown = set(parameters) - set(SensorReading.MEASUREMENT_FIELDS)
+    if unknown:
+        raise ExportError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    if fmt in ('parquet', 'arrow'):
+        _import_pyarrow()  # fail before the response starts streaming
+
+    queryset = export_queryset(queryset, parameters if len(parameters) < len(SensorReading.MEASUREMENT_FIELDS) else None)
+    return WRITERS[fmt](iter_chunks(queryset, parameters, chunk_size), parameters)
+
+
+async def aiter_export(stream):
+    """
+    Serve a stream_export() iterator to an ASGI response. Django would
+    collect a sync iterator into a list first; here each chunk is fetched
+    and encoded on the sync thread one at a time, so memory stays bounded
+    by `chunk_size` under ASGI too.
+    """
+    done = object()
+    pull = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            data = await pull(stream, done)
+            if data is done:
+                return
+            yield data
+    finally:
+        # Releases the server-side cursor when the client goes away early
+        await sync_to_async(stream.close, thread_sensitive=True)()
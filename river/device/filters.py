@@ -0,0 +1,45 @@
+import django_filters
+from django.db.models import Q
+
+from device.ingest import SENSOR_TYPE_FIELDS
+from device.models import Device, Sensor, SensorReading
+
+
+# --- SensorReading Filters ---
+class SensorReadingFilter(django_filters.FilterSet):
+    """
+    ?device=<id or name>[,...]  ?sensor_type=PH,TEMP (or field names: pH,temperature)
+    ?start=<ISO 8601>  ?end=<ISO 8601, exclusive>
+    """
+    device = django_filters.CharFilter(method='filter_device')
+    sensor_type = django_filters.CharFilter(method='filter_sensor_type')
+    start = django_filters.IsoDateTimeFilter(field_name='timestamp', lookup_expr='gte')
+    end = django_filters.IsoDateTimeFilter(field_name='timestamp', lookup_expr='lt')
+
+    class Meta:
+        model = SensorReading
+        fields = ['device', 'sensor_type', 'start', 'end', 'manual_override']
+
+    def filter_device(self, queryset, name, value):
+        ids, names = [], []
+        for item in value.split(','):
+            item = item.strip()
+            if item:
+                (ids if item.isdigit() else names).append(item)
+        condition = Q(device_id__in=ids) if ids else Q()
+        if names:
+            condition |= Q(device_id__in=Device.objects.filter(name__in=names).values('pk'))
+        return queryset.filter(condition) if ids or names else queryset
+
+    def filter_sensor_type(self, queryset, name, value):
+        condition = Q()
+        for item in value.split(','):
+            item = item.strip()
+            if item.upper() in SENSOR_TYPE_FIELDS:
+                field = SENSOR_TYPE_FIELDS[item.upper()][2]
+                # Legacy per-sensor rows still carry the sensor
+                condition |= Q(sensor_id__in=Sensor.objects.filter(sensor_type=item.upper()).values('pk'))
+                condition |= Q(sensor_id__isnull=True, **{f'{field}__isnull': False})
+            elif item in SensorReading.MEASUREMENT_FIELDS:
+                condition |= Q(**{f'{item}__isnull': False})
+        return queryset.filter(condition) if condition else queryset.none()
@@ -0,0 +1,225 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Device, Sensor
+
+
+# --- Device/Sensor identity cache ---
+class IdentityResolver:
+    """
+    Bounded LRU map from device names and (device_name, sensor_type) pairs to
+    primary keys, so the ingest hot path does no identity queries once warm.
+
+    Entries are evicted through post_save/post_delete on Device and Sensor.
+    Signals only reach the process that made the change, so entries also
+    expire `ttl` seconds after they were loaded: a device another process
+    renamed or deleted is looked up again within that time. A write that
+    hits a foreign key error before then calls forget_devices() and retries
+    (see write_batch() in device/ingest.py).
+    """
+
+    def __init__(self, max_entries=10000, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._devices = OrderedDict()   # device name -> (device pk, expires at)
+        self._sensors = OrderedDict()   # (device name, sensor type) -> (sensor pk, expires at)
+        self._device_keys = {}          # device pk -> device name
+        self._regions = {}              # device pk -> device location
+        self._sensor_keys = {}          # sensor pk -> (device name, sensor type)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # --- Lookups ---
+    def _cached(self, entries, key):
+        # Called with the lock held
+        entry = entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        pk, expires_at = entry
+        if expires_at < time.monotonic():
+            self.expirations += 1
+            self.misses += 1
+            return None
+        entries.move_to_end(key)
+        self.hits += 1
+        return pk
+
+    def device_id(self, name):
+        with self._lock:
+            pk = self._cached(self._devices, name)
+        if pk is not None:
+            return pk
+
+        device, _ = Device.objects.get_or_create(name=name)
+        self._store_device(name, device.pk, device.location)
+        return device.pk
+
+    def lookup_devices(self, names):
+        """{name: pk} of the devices among `names` that exist; unlike device_id() never creates one."""
+        found, missing = {}, []
+        with self._lock:
+            for name in names:
+                pk = self._cached(self._devices, name)
+                if pk is None:
+                    missing.append(name)
+                else:
+                    found[name] = pk
+        if missing:
+            for pk, name, location in Device.objects.filter(name__in=missing).values_list('pk', 'name', 'location'):
+                self._store_device(name, pk, location)
+                found[name] = pk
+        return found
+
+    def sensor_id(self, device_name, sensor_type):
+        key = (device_name, sensor_type)
+        with self._lock:
+            pk = self._cached(self._sensors, key)
+        if pk is not None:
+            return pk
+
+        sensor, _ = Sensor.objects.get_or_create(
+            name=f"{device_name} - {sensor_type}",
+            sensor_type=sensor_type,
+            device_id=self.device_id(device_name)
+        )
+        self._store_sensor(key, sensor.pk)
+        return sensor.pk
+
+    def region(self, device_pk):
+        """Cached location of a device, None if unknown. Never queries."""
+        return self._regions.get(device_pk)
+
+    def warm(self):
+        """Preload the most recently created devices and their sensors."""
+        devices = Device.objects.order_by('-pk').values_list('pk', 'name', 'location')[:self.max_entries]
+        for pk, name, location in reversed(list(devices)):
+            self._store_device(name, pk, location)
+
+        sensors = Sensor.objects.filter(device__isnull=False).order_by('-pk').values_list(
+            'pk', 'name', 'sensor_type', 'device__name'
+        )[:self.max_entries]
+        for pk, name, sensor_type, device_name in reversed(list(sensors)):
+            # Only the sensors ingest itself would get_or_create
+            if name == f"{device_name} - {sensor_type}":
+                self._store_sensor((device_name, sensor_type), pk)
+
+    # --- Invalidation ---
+    def evict_device(self, pk):
+        with self._lock:
+            self._regions.pop(pk, None)
+            name = self._device_keys.pop(pk, None)
+            if name is None:
+                return
+            self._devices.pop(name, None)
+            for sensor_type, _ in Sensor.SENSOR_TYPES:
+                entry = self._sensors.pop((name, sensor_type), None)
+                if entry is not None:
+                    self._sensor_keys.pop(entry[0], None)
+
+    def forget_devices(self, names):
+        """Drop the entries of devices by name, e.g. after a write hit a pk another process deleted."""
+        with self._lock:
+            pks = [self._devices[name][0] for name in names if name in self._devices]
+            for pk in pks:
+                self.evict_device(pk)
+
+    def evict_sensor(self, pk):
+        with self._lock:
+            key = self._sensor_keys.pop(pk, None)
+            if key is not None:
+                self._sensors.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+            self._sensors.clear()
+            self._device_keys.clear()
+            self._regions.clear()
+            self._sensor_keys.clear()
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'devices': len(self._devices),
+                'sensors': len(self._sensors),
+                'capacity': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'ttl': self.ttl,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    # --- Internals ---
+    def _store_device(self, name, pk, location=None):
+        with self._lock:
+            previous = self._devices.get(name)
+            if previous is not None and previous[0] != pk:
+                self._device_keys.pop(previous[0], None)
+                self._regions.pop(previous[0], None)
+            self._devices[name] = (pk, time.monotonic() + self.ttl)
+            self._devices.move_to_end(name)
+            self._device_keys[pk] = name
+            if location:
+                self._regions[pk] = location
+            else:
+                self._regions.pop(pk, None)
+            while len(self._devices) > self.max_entries:
+                old_name, (old_pk, _) = self._devices.popitem(last=False)
+                self._device_keys.pop(old_pk, None)
+                self._regions.pop(old_pk, None)
+                self.evictions += 1
+
+    def _store_sensor(self, key, pk):
+        with self._lock:
+            self._sensors[key] = (pk, time.monotonic() + self.ttl)
+            self._sensors.move_to_end(key)
+            self._sensor_keys[pk] = key
+            while len(self._sensors) > self.max_entries:
+                old_key, (old_pk, _) = self._sensors.popitem(last=False)
+                self._sensor_keys.pop(old_pk, None)
+                self.evictions += 1
+
+
+# --- Process-wide resolver ---
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = IdentityResolver(
+                    max_entries=getattr(settings, 'IDENTITY_CACHE_SIZE', 10000),
+                    ttl=getattr(settings, 'IDENTITY_CACHE_TTL', 300.0),
+                )
+    return _resolver
+
+
+# --- Cache invalidation ---
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def invalidate_device(sender, instance, created=False, **kwargs):
+    if not created:
+        get_resolver().evict_device(instance.pk)
+
+
+@receiver(post_save, sender=Sensor)
+@receiver(post_delete, sender=Sensor)
+def invalidate_sensor(sender, instance, created=False, **kwargs):
+    if not created:
+        get_resolver().evict_sensor(instance.pk)
@@ -0,0 +1,558 @@
+import os
+import queue
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .broadcast import broadcast_messages, report_stored
+from .codecs import parse_timestamp, payload_samples
+from .snapshot import get_snapshot
+
+
+# === Payload mapping ===
+# sensor type -> (payload key that enables the sensor, payload key holding the value, SensorReading field)
+SENSOR_TYPE_FIELDS = {
+    'PH': ('ph', 'ph', 'pH'),
+    'TEMP': ('temperature', 'temperature', 'temperature'),
+    'TURB': ('turbidity', 'turbidity', 'turbidity'),
+    'DO': ('dissolved_oxygen', 'dissolved_oxygen', 'dissolved_oxygen'),
+    'ISE': ('ise_value', 'ise_value', 'ise'),
+    'TDS': ('conductivity', 'conductivity', 'tds'),
+    'ORP': ('orp', 'orp', 'orp'),
+    'EC': ('ec', 'conductivity', 'ec'),  # EC uses conductivity value
+}
+
+BACKPRESSURE_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+
+# --- Counters ---
+class IngestStats:
+    """Thread-safe counters describing the pipeline's throughput and latency."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.dead_lettered = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_size = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+        self.last_error = None
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def record_flush(self, size, latency, ok):
+        with self._lock:
+            self.flushes += 1
+            self.last_flush_size = size
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.total_flush_latency += latency
+            if ok:
+                self.written += size
+            else:
+                self.failed += size
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'skipped': self.skipped,
+                'rejected': self.rejected,
+                'dead_lettered': self.dead_lettered,
+                'written': self.written,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'last_flush_size': self.last_flush_size,
+                'last_flush_latency_ms': round(self.last_flush_latency * 1000, 3),
+                'max_flush_latency_ms': round(self.max_flush_latency * 1000, 3),
+                'avg_flush_latency_ms': round(self.total_flush_latency * 1000 / self.flushes, 3) if self.flushes else 0.0,
+                'last_error': self.last_error,
+            }
+
+
+# --- Device timestamps ---
+def reading_time(payload, received_at=None, now=None):
+    """
+    When a sample was measured: the device's own payload timestamp, else
+    when it reached us (kept by the spool across replays), else now. Device
+    clocks more than INGEST_MAX_CLOCK_SKEW seconds in the future are ignored.
+    """
+    now = now or timezone.now()
+    received = parse_timestamp(received_at) or now
+    device_time = parse_timestamp(payload.get('timestamp'))
+    skew = timedelta(seconds=getattr(settings, 'INGEST_MAX_CLOCK_SKEW', 300))
+    if device_time is None or device_time > now + skew:
+        return received
+    return device_time
+
+
+def reading_sequence(payload):
+    """Device message counter ("seq" or "sequence"); 0 when the device sends none."""
+    value = payload.get('seq', payload.get('sequence'))
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+# --- Database writer ---
+def build_readings(device_name, device_id, payload, resolver, layout='wide', timestamp=None, sequence=0):
+    """
+    Turn one decoded payload into SensorReading instances.
+
+    The ``wide`` layout stores the whole message in one row with every
+    measured column filled; ``per_sensor`` is the legacy layout of one row
+    per sensor with a single column set.
+    """
+    from .models import SensorReading
+
+    timestamp = timestamp or timezone.now()
+    readings = []
+    wide = SensorReading(device_id=device_id, timestamp=timestamp, sequence=sequence) if layout == 'wide' else None
+
+    for sensor_type, (sensor_key, value_key, field) in SENSOR_TYPE_FIELDS.items():
+        if payload.get(sensor_key) is None:
+            continue
+
+        # Keep the device's sensor inventory up to date (cached after the first message)
+        sensor_id = resolver.sensor_id(device_name, sensor_type)
+
+        if payload.get(value_key) is None:
+            continue
+
+        if wide is not None:
+            setattr(wide, field, payload[value_key])
+            if sensor_type == 'ISE':
+                wide.value = payload.get('mercury_ppb')
+            continue
+
+        reading = SensorReading(
+            sensor_id=sensor_id, device_id=device_id, timestamp=timestamp, sequence=sequence,
+            **{field: payload[value_key]}
+        )
+        if sensor_type == 'ISE':
+            reading.value = payload.get('mercury_ppb')
+        readings.append(reading)
+
+    if wide is not None and any(getattr(wide, field) is not None for field in SensorReading.MEASUREMENT_FIELDS):
+        readings.append(wide)
+    return readings
+
+
+def reading_key(reading):
+    return reading.sensor_id, reading.device_id, reading.timestamp, reading.sequence
+
+
+def claim_keys(readings, keys, arrival_time=False):
+    """
+    The readings of one sample whose (device, timestamp, sequence) key is not
+    taken yet by an earlier sample of the same batch; their keys are added
+    to `keys`. Samples timed by their arrival are distinct readings that
+    merely arrived in the same instant, so they are moved on by a
+    microsecond until they fit; a device-timed sample that collides is a
+    redelivery and is left out (its message is then flagged a duplicate).
+    """
+    while arrival_time and any(reading_key(reading) in keys for reading in readings):
+        for reading in readings:
+            reading.timestamp += timedelta(microseconds=1)
+    fresh = [reading for reading in readings if reading_key(reading) not in keys]
+    keys.update(reading_key(reading) for reading in fresh)
+    return fresh
+
+
+def insert_readings(readings, chunk_size=1000):
+    """
+    Bulk INSERT ... ON CONFLICT DO NOTHING RETURNING. Readings whose
+    (device, timestamp, sequence) key is already stored -- QoS 1
+    redeliveries, replays, overlapping backfills -- are skipped. Returns
+    the readings that were inserted, with their primary keys set.
+    """
+    from .models import SensorReading
+
+    if not readings:
+        return []
+
+    meta = SensorReading._meta
+    quote = connection.ops.quote_name
+    fields = [field for field in meta.concrete_fields if not field.primary_key]
+    columns = ', '.join(quote(field.column) for field in fields)
+    row = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    returning = ', '.join(quote(column) for column in ('id', 'sensor_id', 'device_id', 'timestamp', 'sequence'))
+
+    inserted = []
+    with connection.cursor() as cursor:
+        for i in range(0, len(readings), chunk_size):
+            chunk = readings[i:i + chunk_size]
+            params = [field.get_db_prep_save(getattr(reading, field.attname), connection)
+                      for reading in chunk for field in fields]
+            cursor.execute(
+                f'INSERT INTO {quote(meta.db_table)} ({columns}) VALUES {", ".join([row] * len(chunk))} '
+                f'ON CONFLICT DO NOTHING RETURNING {returning}',
+                params
+            )
+            # Keys are unique within a batch (claim_keys); the first one wins like in the INSERT
+            pending = {}
+            for reading in chunk:
+                pending.setdefault(reading_key(reading), reading)
+            for pk, sensor_id, device_id, timestamp, sequence in cursor.fetchall():
+                reading = pending.pop((sensor_id, device_id, parse_timestamp(timestamp), sequence), None)
+                if reading is not None:
+                    reading.pk = pk
+                    reading._state.adding = False
+                    reading._state.db = connection.alias
+                    inserted.append(reading)
+    return inserted
+
+
+def write_batch(messages, checkpoint=None):
+    """
+    Persist a batch of decoded telemetry messages with a single bulk insert.
+    Every sample of a batch envelope becomes its own reading, all in the same
+    transaction.
+
+    Only newly inserted readings feed rollups and alerts; a message whose
+    readings were all stored before is marked ``duplicate`` and not
+    broadcast again. Returns the inserted readings.
+
+    `checkpoint` is an optional (source, position) pair recorded in the same
+    transaction, marking the batch as stored for replaying sources.
+
+    A foreign key error usually means a cached device pk outlived a delete
+    in another process; the batch's devices are then looked up again and
+    the write retried once.
+    """
+    try:
+        return _write_batch(messages, checkpoint)
+    except IntegrityError:
+        from .identity import get_resolver
+
+        get_resolver().forget_devices({message['device_name'] for message in messages})
+        return _write_batch(messages, checkpoint)
+
+
+def _write_batch(messages, checkpoint):
+    from alerts.engine import get_engine
+    from .identity import get_resolver
+    from .models import IngestCheckpoint
+    from .presence import get_presence
+    from .rollups import apply_rollups
+    from .state import apply_state
+
+    resolver = get_resolver()
+    layout = getattr(settings, 'READING_STORAGE', 'wide')
+    now = timezone.now()
+    last_seen = {}
+    readings = []
+    keys = set()
+    per_message = []
+
+    for message in messages:
+        device_name = message['device_name']
+        device_id = resolver.device_id(device_name)
+        received = message.get('received_at') or now.timestamp()
+        last_seen[device_name] = max(last_seen.get(device_name, 0), received)
+        message['device_id'] = device_id
+        built = []
+        for sample in payload_samples(message['payload']):
+            timestamp = reading_time(sample, message.get('received_at'), now)
+            sample_readings = build_readings(
+                device_name, device_id, sample, resolver, layout,
+                timestamp=timestamp, sequence=reading_sequence(sample)
+            )
+            arrival_time = timestamp != parse_timestamp(sample.get('timestamp'))
+            readings.extend(claim_keys(sample_readings, keys, arrival_time))
+            built.extend(sample_readings)
+        per_message.append((message, built))
+
+    with transaction.atomic():
+        inserted = insert_readings(readings)
+        if getattr(settings, 'INGEST_ROLLUPS', True):
+            apply_rollups(inserted)
+        if getattr(settings, 'INGEST_DEVICE_STATE', True):
+            apply_state(inserted)
+        if getattr(settings, 'INGEST_ALERTS', True):
+            get_engine().process(inserted)
+        # Presence only touches memory; it writes last-seen/online in bulk on its own schedule
+        transaction.on_commit(lambda: get_presence().seen(last_seen))
+        if checkpoint is not None:
+            source, position = checkpoint
+            IngestCheckpoint.objects.update_or_create(source=source, defaults={'position': position})
+
+    for message, built in per_message:
+        message['duplicate'] = bool(built) and all(reading.pk is None for reading in built)
+    return inserted
+
+
+def flush_messages(batch, stats, checkpoint=None):
+    """Write a batch, record it in `stats`, then fan it out to dashboards. Returns True if it was stored."""
+    started = time.monotonic()
+    ok = False
+    close_old_connections()
+    try:
+        write_batch(batch, checkpoint)
+        ok = True
+    except Exception as e:
+        print(f"[Ingest] ❌ Error saving batch of {len(batch)} messages: {e}")
+        stats.last_error = f"{type(e).__name__}: {e}"
+    finally:
+        stats.record_flush(len(batch), time.monotonic() - started, ok)
+
+    try:
+        report_stored(batch, ok)
+    except Exception as e:
+        print(f"[Ingest] ❌ Error reporting stored frames: {e}")
+    if not ok:
+        return False
+    try:
+        frames = broadcast_messages(batch)
+        get_snapshot().update(frames)
+    except Exception as e:
+        print(f"[Ingest] ❌ Error broadcasting batch: {e}")
+    return ok
+
+
+def database_available():
+    """True if the database answers; tells a bad message apart from an outage after a failed write."""
+    close_old_connections()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return True
+    except DatabaseError:
+        return False
+
+
+def ingest_now(records):
+    """
+    Write records synchronously, through the same write/snapshot/broadcast
+    path as a pipeline flush, for callers that need them stored on return.
+    """
+    return flush_messages(records, get_pipeline().stats)
+
+
+# --- Published metrics ---
+# Every process that writes telemetry (the ingest worker, and a web process
+# with WebSocket devices) publishes its metrics to the shared cache, where
+# /api/ingest/stats/ reads them. Entries expire a few intervals after the
+# process stops publishing.
+METRICS_WORKERS_KEY = 'ingest:workers'
+
+
+def process_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def host_id():
+    """Default ingest worker id: stable across restarts, so a worker finds its spool again."""
+    return socket.gethostname()
+
+
+def metrics_key(worker_id):
+    return f'ingest:metrics:{worker_id}'
+
+
+def publish_metrics(worker_id, role, ingest_metrics, interval):
+    """Publish this process's ingest, identity cache, presence and alert delivery metrics."""
+    from alerts.delivery import get_dispatcher
+    from .identity import get_resolver
+    from .presence import get_presence
+
+    cache.set(metrics_key(worker_id), {
+        'worker_id': worker_id,
+        'role': role,
+        'published_at': timezone.now().isoformat(),
+        'ingest': ingest_metrics,
+        'identity_cache': get_resolver().metrics(),
+        'presence': get_presence().metrics(),
+        'alert_delivery': get_dispatcher().metrics(),
+    }, timeout=int(interval * 3) + 1)
+
+    workers = cache.get(METRICS_WORKERS_KEY) or []
+    if worker_id not in workers:
+        # Racing registrations heal on the next publish
+        cache.set(METRICS_WORKERS_KEY, sorted({*workers, worker_id}), timeout=None)
+
+
+def published_metrics():
+    """Metrics of every process that published recently, read from the cache only."""
+    workers = cache.get(METRICS_WORKERS_KEY) or []
+    found = cache.get_many([metrics_key(worker_id) for worker_id in workers])
+    alive = [worker_id for worker_id in workers if metrics_key(worker_id) in found]
+    if len(alive) < len(workers):
+        cache.set(METRICS_WORKERS_KEY, alive, timeout=None)
+    return [found[metrics_key(worker_id)] for worker_id in alive]
+
+
+# --- Pipeline ---
+class IngestPipeline:
+    """
+    Bounded buffer between the transports and the database.
+
+    Every transport adapter -- the paho MQTT callbacks, the legacy
+    mqtt_handlers and DeviceConsumer for WebSocket-connected devices --
+    turns what it receives into a telemetry record and calls submit(); the
+    asyncio worker (device/aio_ingest.py) batches the same records itself
+    and flushes them through flush_messages() too.
+
+    Producers call submit() with decoded messages; a single worker thread
+    flushes them with bulk_create() once `batch_size` messages are waiting
+    or `flush_interval` seconds have passed, whichever comes first. When the
+    queue is full the backpressure policy decides what happens:
+
+    * ``block``       -- wait up to `block_timeout` seconds for room, then drop
+    * ``drop_newest`` -- reject the incoming message
+    * ``drop_oldest`` -- evict the oldest queued message to make room
+    """
+
+    def __init__(self, batch_size=500, flush_interval=1.0, max_queue=10000,
+                 policy='drop_oldest', block_timeout=1.0, metrics_interval=10.0):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy!r}, expected one of {BACKPRESSURE_POLICIES}")
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.metrics_interval = metrics_interval
+        self.worker_id = process_id()
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = IngestStats()
+
+        self._evicted = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- Producer side ---
+    def submit(self, message):
+        """Queue a telemetry record (device/codecs.py). Returns False if it was dropped."""
+        try:
+            if self.policy == 'block':
+                self.queue.put(message, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(message)
+        except queue.Full:
+            if self.policy != 'drop_oldest':
+                self.stats.incr('dropped')
+                return False
+            try:
+                # Its sender hears about it with the next flush
+                self._evicted.append(self.queue.get_nowait())
+                self.stats.incr('dropped')
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(message)
+            except queue.Full:
+                self.stats.incr('dropped')
+                return False
+
+        self.stats.incr('enqueued')
+        return True
+
+    # --- Worker lifecycle ---
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Stop the worker after it has flushed everything already queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        from .identity import get_resolver
+
+        try:
+            get_resolver().warm()
+        except Exception as e:
+            print(f"[Ingest] ⚠️ Could not warm identity cache: {e}")
+
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        publish_at = time.monotonic()
+
+        while not (self._stop.is_set() and self.queue.empty() and not batch):
+            try:
+                batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                # Drain whatever else is already waiting without blocking
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline or self._stop.is_set():
+                if batch:
+                    self._flush(batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+            if self.metrics_interval and time.monotonic() >= publish_at:
+                publish_at = time.monotonic() + self.metrics_interval
+                try:
+                    publish_metrics(self.worker_id, 'pipeline', self.metrics(), self.metrics_interval)
+                except Exception as e:
+                    print(f"[Ingest] ⚠️ Could not publish metrics: {e}")
+
+    def _flush(self, batch):
+        evicted, self._evicted = self._evicted, []
+        if evicted:
+            try:
+                report_stored(evicted, False)
+            except Exception as e:
+                print(f"[Ingest] ❌ Error reporting evicted frames: {e}")
+        flush_messages(batch, self.stats)
+
+    def metrics(self):
+        data = self.stats.snapshot()
+        data['queue_depth'] = self.queue.qsize()
+        data['queue_capacity'] = self.queue.maxsize
+        data['batch_size'] = self.batch_size
+        data['flush_interval'] = self.flush_interval
+        data['backpressure'] = self.policy
+        return data
+
+
+# --- Process-wide pipeline ---
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    """Return the process-wide pipeline, creating and starting it from settings on first use."""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                pipeline = IngestPipeline(
+                    batch_size=getattr(settings, 'INGEST_BATCH_SIZE', 500),
+                    flush_interval=getattr(settings, 'INGEST_FLUSH_INTERVAL', 1.0),
+                    max_queue=getattr(settings, 'INGEST_QUEUE_SIZE', 10000),
+                    policy=getattr(settings, 'INGEST_BACKPRESSURE', 'drop_oldest'),
+                    block_timeout=getattr(settings, 'INGEST_BLOCK_TIMEOUT', 1.0),
+                    metrics_interval=getattr(settings, 'INGEST_METRICS_INTERVAL', 10.0),
+                )
+                pipeline.start()
+                _pipeline = pipeline
+    return _pipeline
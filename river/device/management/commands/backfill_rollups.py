@@ -0,0 +1,72 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from device.models import Device, SensorReading
+from device.rollups import ROLLUP_RESOLUTIONS, bucket_start, rebuild_rollups
+
+
+def parse_moment(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid date/time: {value}")
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = "Rebuild SensorReadingRollup buckets from raw SensorReading rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Start date/time (default: oldest reading)')
+        parser.add_argument('--until', help='End date/time, exclusive (default: now)')
+        parser.add_argument('--resolution', action='append', choices=sorted(ROLLUP_RESOLUTIONS),
+                            help='Resolution to rebuild; repeat for several (default: all)')
+        parser.add_argument('--device', action='append', help='Device name; repeat for several (default: all)')
+        parser.add_argument('--chunk-days', type=int, default=1, help='Days of raw data per statement')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Rollup backfill requires PostgreSQL")
+
+        readings = SensorReading.objects.all()
+        device_ids = None
+        if options['device']:
+            device_ids = list(Device.objects.filter(name__in=options['device']).values_list('pk', flat=True))
+            if not device_ids:
+                raise CommandError("No matching devices")
+            readings = readings.filter(device_id__in=device_ids)
+
+        bounds = readings.aggregate(first=Min('timestamp'), last=Max('timestamp'))
+        if bounds['first'] is None:
+            self.stdout.write("No readings to roll up.")
+            return
+
+        # Whole days, so every bucket is rebuilt from all of its readings
+        start = bucket_start(parse_moment(options['since']) if options['since'] else bounds['first'], '1d')
+        end = parse_moment(options['until']) if options['until'] else bounds['last'] + timedelta(seconds=1)
+        end = bucket_start(end - timedelta(microseconds=1), '1d') + timedelta(days=1)
+        step = timedelta(days=options['chunk_days'])
+        resolutions = options['resolution'] or list(ROLLUP_RESOLUTIONS)
+
+        chunk_start = start
+        while chunk_start < end:
+            chunk_end = min(chunk_start + step, end)
+            with transaction.atomic(), connection.cursor() as cursor:
+                written = {
+                    resolution: rebuild_rollups(cursor, resolution, start=chunk_start, end=chunk_end, device_ids=device_ids)
+                    for resolution in resolutions
+                }
+            summary = ', '.join(f"{count} x {resolution}" for resolution, count in written.items())
+            self.stdout.write(f"{chunk_start:%Y-%m-%d} -> {chunk_end:%Y-%m-%d}: {summary}")
+            chunk_start = chunk_end
+
+        self.stdout.write(self.style.SUCCESS("Rollup backfill complete"))
@@ -0,0 +1,46 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from device.export import EXPORT_FORMATS, ExportError, stream_export
+from device.filters import SensorReadingFilter
+from device.models import SensorReading
+
+
+class Command(BaseCommand):
+    help = "Export sensor readings as CSV, NDJSON, Parquet or Arrow with constant memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+        parser.add_argument('--device', help='Device id(s) or name(s), comma separated')
+        parser.add_argument('--parameter', help='SensorReading fields to export, comma separated (default: all)')
+        parser.add_argument('--start', help='ISO 8601 start time (inclusive)')
+        parser.add_argument('--end', help='ISO 8601 end time (exclusive)')
+        parser.add_argument('--chunk-size', type=int, default=getattr(settings, 'EXPORT_CHUNK_SIZE', 5000))
+
+    def handle(self, *args, **options):
+        data = {key: options[key] for key in ('device', 'start', 'end') if options[key]}
+        filterset = SensorReadingFilter(data=data, queryset=SensorReading.objects.all())
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+
+        parameters = [p for p in (options['parameter'] or '').split(',') if p]
+        try:
+            stream = stream_export(filterset.qs, options['format'], parameters, chunk_size=options['chunk_size'])
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        written = 0
+        try:
+            for data in stream:
+                out.write(data)
+                written += len(data)
+        finally:
+            if options['output']:
+                out.close()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from device.aio_ingest import PARTITION_MODES, AsyncIngestService, IngestServiceError
+
+# Backends that keep everything inside the worker process
+PROCESS_LOCAL_BACKENDS = (
+    'channels.layers.InMemoryChannelLayer',
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def process_local_settings():
+    """Names of the settings whose backend the ASGI server can't share with this worker."""
+    backends = {
+        'CHANNEL_LAYERS': settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND'),
+        'CACHES': settings.CACHES.get('default', {}).get('BACKEND'),
+    }
+    return [name for name, backend in backends.items() if backend in PROCESS_LOCAL_BACKENDS]
+
+
+class Command(BaseCommand):
+    help = "Run the MQTT ingestion worker (the only process that writes telemetry)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partition', choices=PARTITION_MODES,
+                            help="How several workers split devices: 'shared' ($share subscription) or 'hash' "
+                                 "(rendezvous hashing, keeps each device's readings in order)")
+        parser.add_argument('--group', help='Shared subscription group; start several workers with the same group to split the load')
+        parser.add_argument('--topic', help='Topic filter to subscribe to (default: MQTT_TOPIC)')
+        parser.add_argument('--client-id', help='MQTT client identifier and worker id (default: the host name; give each worker on one host its own)')
+        parser.add_argument('--spool', dest='spool_path',
+                            help='SQLite file to spool messages in before they are written; "{worker_id}" is '
+                                 'replaced by the worker id (default: INGEST_SPOOL_PATH)')
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--flush-interval', type=float)
+        parser.add_argument('--stats-interval', type=float, default=60.0,
+                            help='Seconds between metrics log lines (0 disables)')
+        parser.add_argument('--allow-in-memory', action='store_true',
+                            help='Start even though CHANNEL_LAYERS/CACHES are in-memory (dashboards will not see '
+                                 'anything this worker broadcasts)')
+
+    def handle(self, *args, **options):
+        local = process_local_settings()
+        if local and not options['allow_in_memory']:
+            raise CommandError(
+                f"{' and '.join(local)} use an in-memory backend, so the ASGI server would never see this "
+                f"worker's broadcasts, snapshot or metrics. Set REDIS_URL, or pass --allow-in-memory."
+            )
+
+        try:
+            service = AsyncIngestService.from_settings(
+                partition=options['partition'],
+                group=options['group'],
+                topic=options['topic'],
+                client_id=options['client_id'],
+                spool_path=options['spool_path'],
+                batch_size=options['batch_size'],
+                flush_interval=options['flush_interval'],
+            )
+        except IngestServiceError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Starting ingest worker on {', '.join(service.topics)}..."))
+        try:
+            asyncio.run(self.serve(service, options['stats_interval']))
+        except KeyboardInterrupt:
+            pass
+        except IngestServiceError as e:
+            raise CommandError(str(e))
+        self.stdout.write(json.dumps(service.metrics()))
+
+    async def serve(self, service, stats_interval):
+        if stats_interval:
+            reporter = asyncio.create_task(self.report(service, stats_interval))
+        try:
+            await service.run()
+        finally:
+            if stats_interval:
+                reporter.cancel()
+
+    async def report(self, service, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.stdout.write(json.dumps(service.metrics()))
@@ -0,0 +1,65 @@
+import argparse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from device import partitions
+
+
+class Command(BaseCommand):
+    help = "Create upcoming SensorReading partitions and retire expired ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=getattr(settings, 'SENSOR_READING_PARTITIONS_AHEAD', 2),
+                            help='Number of future periods to create partitions for')
+        parser.add_argument('--interval', choices=sorted(partitions.INTERVALS),
+                            default=getattr(settings, 'SENSOR_READING_PARTITION_INTERVAL', 'week'))
+        parser.add_argument('--retention-days', type=int,
+                            default=getattr(settings, 'SENSOR_READING_RETENTION_DAYS', None),
+                            help='Retire partitions entirely older than this (default: keep everything)')
+        parser.add_argument('--rollup', action=argparse.BooleanOptionalAction, default=getattr(settings, 'SENSOR_READING_ROLLUP_ON_EXPIRE', True),
+                            help='Compact expired partitions into the rollup table before retiring them')
+        parser.add_argument('--detach-only', action='store_true',
+                            help='Detach expired partitions but keep them as standalone tables')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("SensorReading partitioning requires PostgreSQL")
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if options['dry_run']:
+                for name, lower, upper, is_default in partitions.list_partitions(cursor):
+                    self.stdout.write(f"{name}: {'DEFAULT' if is_default else f'{lower} -> {upper}'}")
+            else:
+                for name in partitions.ensure_partitions(cursor, options['interval'], options['ahead']):
+                    self.stdout.write(self.style.SUCCESS(f"Created partition {name}"))
+
+            if options['retention_days'] is not None:
+                self.retire(cursor, options)
+
+            spilled = partitions.default_partition_rows(cursor)
+            if spilled:
+                self.stdout.write(self.style.WARNING(
+                    f"{spilled} readings are in {partitions.DEFAULT_PARTITION}; run this command more often "
+                    f"or raise --ahead"
+                ))
+
+    def retire(self, cursor, options):
+        from device.rollups import rebuild_rollups
+
+        resolution = getattr(settings, 'SENSOR_READING_ROLLUP_RESOLUTION', '1h')
+
+        for name, lower, upper in partitions.expired_partitions(cursor, options['retention_days']):
+            if options['dry_run']:
+                self.stdout.write(f"Would retire {name} ({lower} -> {upper})")
+                continue
+
+            if options['rollup']:
+                buckets = rebuild_rollups(cursor, resolution, source_table=name)
+                self.stdout.write(f"Compacted {name} into {buckets} {resolution} rollup buckets")
+
+            partitions.detach_partition(cursor, name, drop=not options['detach_only'])
+            action = 'Detached' if options['detach_only'] else 'Dropped'
+            self.stdout.write(self.style.SUCCESS(f"{action} partition {name}"))
@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, When, Value
+
+
+# Per-sensor rows written for the same message are created back to back,
+# so rows of one device this close together belong to one message.
+MERGE_WINDOW = timedelta(seconds=1)
+CHUNK_SIZE = 2000
+
+MEASUREMENT_FIELDS = ['pH', 'temperature', 'turbidity', 'dissolved_oxygen', 'ise', 'tds', 'orp', 'ec', 'value']
+
+
+def merge_per_sensor_rows(apps, schema_editor):
+    SensorReading = apps.get_model('device', 'SensorReading')
+    Alert = apps.get_model('alerts', 'Alert')
+
+    survivors = []      # merged SensorReading instances to bulk_update
+    replaced = {}       # duplicate reading id -> surviving reading id
+
+    def flush():
+        if survivors:
+            SensorReading.objects.bulk_update(survivors, MEASUREMENT_FIELDS + ['sensor'])
+            survivors.clear()
+        if replaced:
+            ids = list(replaced)
+            Alert.objects.filter(reading_id__in=ids).update(reading_id=Case(
+                *[When(reading_id=old, then=Value(new)) for old, new in replaced.items()]
+            ))
+            SensorReading.objects.filter(id__in=ids).delete()
+            replaced.clear()
+
+    def close_group(group):
+        head = group[0]
+        reading = SensorReading(id=head['id'], sensor=None)
+        for field in MEASUREMENT_FIELDS:
+            setattr(reading, field, next((row[field] for row in group if row[field] is not None), None))
+        survivors.append(reading)
+        for row in group[1:]:
+            replaced[row['id']] = head['id']
+        if len(survivors) >= CHUNK_SIZE or len(replaced) >= CHUNK_SIZE:
+            flush()
+
+    rows = SensorReading.objects.filter(sensor__isnull=False, manual_override=False).order_by(
+        'device_id', 'timestamp', 'id'
+    ).values('id', 'device_id', 'timestamp', *MEASUREMENT_FIELDS)
+
+    # Rows are only rewritten once their group is closed, i.e. after the scan has passed them
+    group = []
+    filled = set()
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        columns = {field for field in MEASUREMENT_FIELDS if row[field] is not None}
+        if group and (
+            row['device_id'] != group[0]['device_id']
+            or row['timestamp'] - group[0]['timestamp'] > MERGE_WINDOW
+            or columns & filled
+        ):
+            close_group(group)
+            group, filled = [], set()
+        group.append(row)
+        filled |= columns
+
+    if group:
+        close_group(group)
+    flush()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('device', '0001_initial'),
+        ('alerts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sensorreading',
+            name='sensor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='readings', to='device.sensor'),
+        ),
+        migrations.RunPython(merge_per_sensor_rows, migrations.RunPython.noop),
+    ]
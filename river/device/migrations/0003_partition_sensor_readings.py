@@ -0,0 +1,114 @@
+from datetime import datetime, time, timedelta, timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Frozen copies of what device/partitions.py did when this migration was
+# written, so later changes there cannot change what it does
+TABLE = 'device_sensorreading'
+INTERVALS = {
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+
+
+def period_start(moment, interval):
+    moment = moment.astimezone(timezone.utc)
+    start = datetime.combine(moment.date(), time.min, tzinfo=timezone.utc)
+    if interval == 'week':
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def partition_sensor_readings(apps, schema_editor):
+    """Rebuild device_sensorreading as a table range-partitioned on "timestamp" (Postgres only)."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    interval = getattr(settings, 'SENSOR_READING_PARTITION_INTERVAL', 'week')
+    ahead = getattr(settings, 'SENSOR_READING_PARTITIONS_AHEAD', 2)
+    now = datetime.now(timezone.utc)
+    table = TABLE
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_unpartitioned')
+        cursor.execute(f'ALTER TABLE {table}_unpartitioned RENAME CONSTRAINT {table}_pkey TO {table}_unpartitioned_pkey')
+
+        # The partition key has to be part of the primary key
+        cursor.execute(f'CREATE TABLE {table} (LIKE {table}_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")')
+        cursor.execute(f'CREATE SEQUENCE {table}_part_id_seq OWNED BY {table}.id')
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_part_id_seq')")
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, "timestamp")')
+        cursor.execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_device_fk FOREIGN KEY (device_id) '
+            f'REFERENCES device_device (id) DEFERRABLE INITIALLY DEFERRED'
+        )
+        cursor.execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_sensor_fk FOREIGN KEY (sensor_id) '
+            f'REFERENCES device_sensor (id) DEFERRABLE INITIALLY DEFERRED'
+        )
+        cursor.execute(f'CREATE INDEX {table}_sensor_idx ON {table} (sensor_id)')
+
+        # Everything before the current period goes to one archive partition,
+        # then one partition per period through `ahead` periods from now
+        step = INTERVALS[interval]
+        start = period_start(now, interval)
+        cursor.execute(
+            f'CREATE TABLE {table}_archive PARTITION OF {table} FOR VALUES FROM (MINVALUE) TO (%s)', [start]
+        )
+        cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+        for _ in range(ahead + 1):
+            end = start + step
+            cursor.execute(
+                f'CREATE TABLE {table}_p{start:%Y%m%d} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)',
+                [start, end]
+            )
+            start = end
+
+        cursor.execute(f'INSERT INTO {table} SELECT * FROM {table}_unpartitioned')
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f"SELECT setval('{table}_part_id_seq', COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+        cursor.execute(f'DROP TABLE {table}_unpartitioned')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('device', '0002_wide_sensor_readings'),
+        ('alerts', '0002_alter_alert_reading'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorReadingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('parameter', models.CharField(max_length=32)),
+                ('resolution', models.CharField(choices=[('1m', '1 minute'), ('1h', '1 hour'), ('1d', '1 day')], max_length=2)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('sum_value', models.FloatField(default=0.0)),
+                ('min_value', models.FloatField(blank=True, null=True)),
+                ('max_value', models.FloatField(blank=True, null=True)),
+                ('last_value', models.FloatField(blank=True, null=True)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='device.device')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('device', 'parameter', 'resolution', 'bucket'), name='unique_rollup_bucket')],
+            },
+        ),
+        # Not undone on the way back: the partitioned table has the same columns,
+        # so the earlier migrations and models work on it unchanged
+        migrations.RunPython(partition_sensor_readings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['device', '-timestamp'], name='sensorreading_device_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['-timestamp'], name='sensorreading_ts_idx'),
+        ),
+    ]
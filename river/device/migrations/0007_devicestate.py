@@ -0,0 +1,51 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+MEASUREMENT_FIELDS = ('pH', 'temperature', 'turbidity', 'dissolved_oxygen', 'ise', 'tds', 'orp', 'ec', 'value')
+
+
+def seed_device_state(apps, schema_editor):
+    """Start every device from its newest stored reading."""
+    Device = apps.get_model('device', 'Device')
+    DeviceState = apps.get_model('device', 'DeviceState')
+    SensorReading = apps.get_model('device', 'SensorReading')
+
+    states = []
+    for device_id in Device.objects.values_list('pk', flat=True):
+        reading = SensorReading.objects.filter(device_id=device_id).order_by('-timestamp').first()
+        if reading is None:
+            continue
+        states.append(DeviceState(
+            device_id=device_id, last_seen=reading.timestamp, timestamp=reading.timestamp,
+            **{field: getattr(reading, field) for field in MEASUREMENT_FIELDS}
+        ))
+    DeviceState.objects.bulk_create(states, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('device', '0006_reading_device_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceState',
+            fields=[
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='state', serialize=False, to='device.device')),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField(blank=True, null=True)),
+                ('pH', models.FloatField(blank=True, null=True)),
+                ('temperature', models.FloatField(blank=True, null=True)),
+                ('turbidity', models.FloatField(blank=True, null=True)),
+                ('dissolved_oxygen', models.FloatField(blank=True, null=True)),
+                ('ise', models.FloatField(blank=True, null=True)),
+                ('tds', models.FloatField(blank=True, null=True)),
+                ('orp', models.FloatField(blank=True, null=True)),
+                ('ec', models.FloatField(blank=True, null=True)),
+                ('value', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(seed_device_state, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 # --- Device Model ---
@@ -37,10 +38,17 @@ class Sensor(models.Model):
 
 # --- SensorReading Model ---
 class SensorReading(models.Model):
-    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='readings')
+    # Columns a telemetry message can fill; one row holds every value of one message
+    MEASUREMENT_FIELDS = ('pH', 'temperature', 'turbidity', 'dissolved_oxygen', 'ise', 'tds', 'orp', 'ec', 'value')
+
+    # Only set on legacy per-sensor rows; wide rows carry every measured column
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='readings', null=True, blank=True)
     device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='readings')
 
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # When the device measured it (payload "timestamp"), falling back to arrival time
+    timestamp = models.DateTimeField(default=timezone.now)
+    # Device message counter, tells apart messages sent within the same timestamp
+    sequence = models.PositiveIntegerField(default=0)
     manual_override = models.BooleanField(default=False)
 
     # Optional fields
@@ -55,8 +63,101 @@ class SensorReading(models.Model):
 
     value = models.FloatField(null=True, blank=True)  # for generic sensors
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['device', '-timestamp'], name='sensorreading_device_ts_idx'),
+            # Matches the (timestamp, id) keyset used by the reading list cursor
+            models.Index(fields=['-timestamp', '-id'], name='sensorreading_ts_id_idx'),
+        ]
+        constraints = [
+            # Ingest inserts with ON CONFLICT DO NOTHING against this key, so redelivered
+            # messages are stored once. Legacy per-sensor rows share it and are exempt.
+            models.UniqueConstraint(
+                fields=['device', 'timestamp', 'sequence'], condition=models.Q(sensor__isnull=True),
+                name='unique_device_reading'
+            ),
+        ]
+
+    def __str__(self):
+        if self.sensor_id:
+            return f"{self.sensor.name or 'Sensor'} @ {self.timestamp}"
+        return f"{self.device.name} @ {self.timestamp}"
+
+
+# --- SensorReadingRollup Model ---
+class SensorReadingRollup(models.Model):
+    """Aggregated readings of one device parameter over a fixed time bucket."""
+    RESOLUTIONS = [
+        ('1m', '1 minute'),
+        ('1h', '1 hour'),
+        ('1d', '1 day'),
+    ]
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='rollups')
+    parameter = models.CharField(max_length=32)  # SensorReading field name, e.g. "pH"
+    resolution = models.CharField(max_length=2, choices=RESOLUTIONS)
+    bucket = models.DateTimeField()  # bucket start
+
+    count = models.PositiveBigIntegerField(default=0)
+    sum_value = models.FloatField(default=0.0)
+    min_value = models.FloatField(null=True, blank=True)
+    max_value = models.FloatField(null=True, blank=True)
+    last_value = models.FloatField(null=True, blank=True)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'parameter', 'resolution', 'bucket'], name='unique_rollup_bucket'),
+        ]
+
+    @property
+    def mean(self):
+        return self.sum_value / self.count if self.count else None
+
+    def __str__(self):
+        return f"{self.device.name} {self.parameter} {self.resolution} @ {self.bucket}"
+
+
+# --- DeviceState Model ---
+class DeviceState(models.Model):
+    """
+    Latest known values of a device, upserted by ingestion (device/state.py)
+    so the fleet overview never scans SensorReading. Every measurement keeps
+    its newest non-null value, so devices that send one sensor per message
+    still show all of them. `last_seen` is flushed by the presence tracker
+    (device/presence.py).
+    """
+    device = models.OneToOneField(Device, on_delete=models.CASCADE, primary_key=True, related_name='state')
+    last_seen = models.DateTimeField(null=True, blank=True)   # when the last message arrived
+    timestamp = models.DateTimeField(null=True, blank=True)   # newest reading
+
+    pH = models.FloatField(null=True, blank=True)
+    temperature = models.FloatField(null=True, blank=True)
+    turbidity = models.FloatField(null=True, blank=True)
+    dissolved_oxygen = models.FloatField(null=True, blank=True)
+    ise = models.FloatField(null=True, blank=True)
+    tds = models.FloatField(null=True, blank=True)
+    orp = models.FloatField(null=True, blank=True)
+    ec = models.FloatField(null=True, blank=True)
+    value = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.device.name} state @ {self.timestamp}"
+
+
+# --- Ingest Checkpoint Model ---
+class IngestCheckpoint(models.Model):
+    """
+    Highest spool position of an ingest source that is stored in the
+    database. Updated in the same transaction as the readings, so a spool
+    replayed after a crash skips what was already written.
+    """
+    source = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
-        return f"{self.sensor.name or 'Sensor'} @ {self.timestamp}"
+        return f"{self.source} @ {self.position}"
 
 
 # --- MQTT Broker Model ---
@@ -1,134 +1,68 @@
-import json
 import ssl
 import paho.mqtt.client as mqtt
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .codecs import CodecError, decode_record, device_name_from_topic
+from .ingest import get_pipeline
+from .presence import get_presence, is_status_topic, parse_status
+
+# === Broker connection settings (see MQTT_* in settings.py) ===
+MQTT_BROKER = settings.MQTT_BROKER_HOST
+MQTT_PORT = settings.MQTT_BROKER_PORT
+MQTT_USERNAME = settings.MQTT_USERNAME
+MQTT_PASSWORD = settings.MQTT_PASSWORD
+MQTT_TOPIC = settings.MQTT_TOPIC  # Topic to subscribe to
+
+
+def subscription_topic(topic=MQTT_TOPIC, group=None):
+    """`topic`, or its shared-subscription form so the broker splits messages across a group of consumers."""
+    return f"$share/{group}/{topic}" if group else topic
+
+
+def subscription_topics(topic=MQTT_TOPIC, group=None):
+    """Subscriptions for `topic` itself and its codec-suffixed form (<topic>/cbor, <topic>/msgpack, ...)."""
+    return [subscription_topic(topic, group), subscription_topic(f"{topic}/+", group)]
 
-# === HiveMQ Cloud credentials and connection settings ===
-MQTT_BROKER = "92b7e65bda9c471984d325f2818f92b2.s1.eu.hivemq.cloud"  # e.g., "xxxxxx.s1.eu.hivemq.cloud"
-MQTT_PORT = 8883  # TLS-secured port
-MQTT_USERNAME = "donfrass"
-MQTT_PASSWORD = "Monkey1991"
-MQTT_TOPIC = "devices/river-watcher-23/telemetry"  # Topic to subscribe to
 
 # === Callback: on successful connection ===
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("[MQTT] Connected successfully.")
-        client.subscribe(MQTT_TOPIC)
+        for topic in subscription_topics(group=settings.MQTT_SHARED_GROUP):
+            client.subscribe(topic)
+        # Device online/offline reports, including their Last Will
+        client.subscribe(subscription_topic(settings.MQTT_STATUS_TOPIC, settings.MQTT_SHARED_GROUP))
     else:
         print(f"[MQTT] Connection failed. Code: {rc}")
 
 # === Callback: on receiving message ===
 def on_message(client, userdata, msg):
-    try:
-        # Import models inside function to avoid AppRegistryNotReady
-        from .models import Device, Sensor, SensorReading
-        
-        payload = json.loads(msg.payload.decode())
-        print(f"[MQTT] Received from {msg.topic}: {payload}")
-
-        # Extract device name from topic
-        topic_parts = msg.topic.split('/')
-        device_name = topic_parts[1] if len(topic_parts) > 1 else 'unknown'
-        
-        # Create or get device
-        device, _ = Device.objects.get_or_create(name=device_name)
-        
-        # Create or get sensors for each sensor type
-        sensors = {}
-        sensor_types = {
-            'ph': 'PH',
-            'temperature': 'TEMP', 
-            'turbidity': 'TURB',
-            'dissolved_oxygen': 'DO',
-            'ise_value': 'ISE',
-            'conductivity': 'TDS',
-            'orp': 'ORP',
-            'ec': 'EC'
-        }
-        
-        for payload_key, sensor_type in sensor_types.items():
-            if payload.get(payload_key) is not None:
-                sensor, _ = Sensor.objects.get_or_create(
-                    name=f"{device_name} - {sensor_type}",
-                    sensor_type=sensor_type,
-                    device=device
-                )
-                sensors[sensor_type] = sensor
-        
-        # Save sensor readings to database
-        try:
-            for sensor_type, sensor in sensors.items():
-                # Map sensor types to payload keys
-                payload_mapping = {
-                    'PH': 'ph',
-                    'TEMP': 'temperature',
-                    'TURB': 'turbidity', 
-                    'DO': 'dissolved_oxygen',
-                    'ISE': 'ise_value',
-                    'TDS': 'conductivity',
-                    'ORP': 'orp',
-                    'EC': 'conductivity'  # EC uses conductivity value
-                }
-                
-                payload_key = payload_mapping.get(sensor_type)
-                if payload_key and payload.get(payload_key) is not None:
-                    SensorReading.objects.create(
-                        sensor=sensor,
-                        device=device,
-                        pH=payload.get("ph") if sensor_type == 'PH' else None,
-                        temperature=payload.get("temperature") if sensor_type == 'TEMP' else None,
-                        turbidity=payload.get("turbidity") if sensor_type == 'TURB' else None,
-                        dissolved_oxygen=payload.get("dissolved_oxygen") if sensor_type == 'DO' else None,
-                        ise=payload.get("ise_value") if sensor_type == 'ISE' else None,
-                        tds=payload.get("conductivity") if sensor_type == 'TDS' else None,
-                        orp=payload.get("orp") if sensor_type == 'ORP' else None,
-                        ec=payload.get("conductivity") if sensor_type == 'EC' else None,
-                        value=payload.get("mercury_ppb") if sensor_type == 'ISE' else None
-                    )
-            
-            print(f"[MQTT] ✅ Saved sensor readings to database for device {device_name}")
-        except Exception as e:
-            print(f"[MQTT] ❌ Error saving sensor reading: {e}")
+    # Runs on paho's network thread: decode and hand off, the ingest worker does the DB work
+    if is_status_topic(msg.topic):
+        online = parse_status(msg.payload)
+        if online is not None:
+            get_presence().status(device_name_from_topic(msg.topic), online)
+        return
 
-        # Update device online status
-        device.is_online = True
-        device.save()
+    try:
+        record = decode_record(msg.topic, msg.payload)
+    except CodecError as e:
+        print(f"[MQTT] Failed to decode payload: {e}")
+        return
 
-        # Send to WebSocket group
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            'sensors',
-            {
-                'type': 'send.sensor.data',
-                'data': {
-                    'device_id': device_name,
-                    'timestamp': payload.get('timestamp'),
-                    'data': {
-                        'ph': payload.get("ph", 0.0),
-                        'temperature': payload.get("temperature", 0.0),
-                        'turbidity': payload.get("turbidity", 0.0),
-                        'dissolved_oxygen': payload.get("dissolved_oxygen", 0.0),
-                        'ise': payload.get("ise_value", 0.0),
-                        'tds': payload.get("conductivity", 0.0),
-                        'orp': payload.get("orp", 0.0),
-                        'ec': payload.get("conductivity", 0.0),
-                        'value': payload.get("mercury_ppb", 0.0)
-                    }
-                }
-            }
-        )
-    except json.JSONDecodeError:
-        print("[MQTT] Failed to decode JSON payload.")
+    try:
+        get_pipeline().submit(record)
     except Exception as e:
         print(f"[MQTT] Error processing message: {e}")
 
 # === Initialize and configure MQTT client ===
 def start_mqtt():
+    # In-process listener (MQTT_AUTOSTART): this process stands in for the ingest worker
+    get_presence().enable_sweep()
     client = mqtt.Client(protocol=mqtt.MQTTv311)
     client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-    client.tls_set(tls_version=ssl.PROTOCOL_TLS)
+    if settings.MQTT_USE_TLS:
+        client.tls_set(tls_version=ssl.PROTOCOL_TLS)
 
     client.on_connect = on_connect
     client.on_message = on_message
@@ -1,7 +1,9 @@
-import json
-from .models import Device, SensorReading
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from .codecs import CodecError, decode_with, device_name_from_topic, select_codec, telemetry_record
+from .ingest import get_pipeline
+from .presence import get_presence, parse_status
+
+# Legacy devices/<id>/data + devices/<id>/status topics. Only an adapter now:
+# telemetry goes through the same pipeline as device/mqtt_client.py.
 
 def on_connect(client, userdata, flags, rc):
     print(f"[MQTT] Connected with code {rc}")
@@ -9,36 +11,20 @@ def on_connect(client, userdata, flags, rc):
     client.subscribe("devices/+/status")
 
 def on_message(client, userdata, msg):
-    topic_parts = msg.topic.split('/')
-    device_name = topic_parts[1]
-
-    if 'data' in msg.topic:
-        payload = json.loads(msg.payload.decode())
-        device, _ = Device.objects.get_or_create(name=device_name)
-
-        SensorReading.objects.create(
-            device=device,
-            pH=payload.get("pH"),
-            temperature=payload.get("temperature"),
-            turbidity=payload.get("turbidity"),
-            dissolved_oxygen=payload.get("dissolved_oxygen")
-        )
-
-        device.is_online = True
-        device.save()
-
-        # Broadcast to WebSocket
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"device_{device_name}",
-            {
-                "type": "send_sensor_data",
-                "data": payload
-            }
-        )
+    if msg.topic.endswith('/status'):
+        online = parse_status(msg.payload)
+        if online is not None:
+            get_presence().status(device_name_from_topic(msg.topic), online)
+        return
 
-    elif 'status' in msg.topic:
-        status = msg.payload.decode()
-        device, _ = Device.objects.get_or_create(name=device_name)
-        device.is_online = (status == "online")
-        device.save()
+    if msg.topic.endswith('/data'):
+        try:
+            payload = decode_with(select_codec(msg.topic), msg.payload)
+            if isinstance(payload, dict) and 'pH' in payload:  # these devices send the SensorReading field name
+                payload.setdefault('ph', payload.pop('pH'))
+            # Renamed before validation, so "pH" is checked like "ph"
+            record = telemetry_record(device_name_from_topic(msg.topic), payload)
+        except CodecError as e:
+            print(f"[MQTT] Failed to decode payload: {e}")
+            return
+        get_pipeline().submit(record)
@@ -0,0 +1,129 @@
+import re
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.utils.dateparse import parse_datetime
+
+
+# === Native range partitioning of SensorReading on "timestamp" (Postgres) ===
+PARENT_TABLE = 'device_sensorreading'
+ARCHIVE_PARTITION = f'{PARENT_TABLE}_archive'
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+
+INTERVALS = {
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+
+_BOUND_RE = re.compile(r"FROM \((?P<lower>[^)]*)\) TO \((?P<upper>[^)]*)\)")
+
+
+def period_start(moment, interval):
+    """Start (UTC midnight, Monday for weeks) of the partition period containing `moment`."""
+    moment = moment.astimezone(dt_timezone.utc)
+    start = datetime.combine(moment.date(), time.min, tzinfo=dt_timezone.utc)
+    if interval == 'week':
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def partition_name(start):
+    return f'{PARENT_TABLE}_p{start:%Y%m%d}'
+
+
+def _parse_bound(value):
+    value = value.strip()
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return parse_datetime(value.strip("'"))
+
+
+def list_partitions(cursor):
+    """Return [(name, lower, upper, is_default)] for every partition, oldest first."""
+    cursor.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, [PARENT_TABLE])
+
+    partitions = []
+    for name, bound in cursor.fetchall():
+        if bound == 'DEFAULT':
+            partitions.append((name, None, None, True))
+            continue
+        match = _BOUND_RE.search(bound)
+        partitions.append((name, _parse_bound(match['lower']), _parse_bound(match['upper']), False))
+
+    epoch = datetime.min.replace(tzinfo=dt_timezone.utc)
+    partitions.sort(key=lambda p: (p[3], p[1] or epoch))
+    return partitions
+
+
+def create_partition(cursor, start, end, name=None):
+    """
+    Create the partition [start, end). Rows that already landed in the
+    default partition for that range are moved into the new partition.
+    """
+    name = name or partition_name(start)
+    cursor.execute(f"""
+        CREATE TEMP TABLE _partition_spill AS
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *
+        )
+        SELECT * FROM moved
+    """, [start, end])
+    cursor.execute(
+        f'CREATE TABLE {name} PARTITION OF {PARENT_TABLE} FOR VALUES FROM (%s) TO (%s)',
+        [start, end]
+    )
+    cursor.execute(f'INSERT INTO {PARENT_TABLE} SELECT * FROM _partition_spill')
+    cursor.execute('DROP TABLE _partition_spill')
+    return name
+
+
+def ensure_partitions(cursor, interval='week', ahead=2, now=None):
+    """
+    Create partitions from the newest existing upper bound (or the current
+    period) through `ahead` periods into the future. Returns created names.
+    """
+    now = now or datetime.now(dt_timezone.utc)
+    step = INTERVALS[interval]
+    current = period_start(now, interval)
+    horizon = current + step * (ahead + 1)
+
+    uppers = [upper for _, _, upper, is_default in list_partitions(cursor) if not is_default and upper]
+    start = max(uppers) if uppers else current
+
+    created = []
+    while start < horizon:
+        end = period_start(start, interval) + step
+        created.append(create_partition(cursor, start, end))
+        start = end
+    return created
+
+
+def expired_partitions(cursor, retention_days, now=None):
+    """Partitions whose whole range is older than the retention window."""
+    now = now or datetime.now(dt_timezone.utc)
+    cutoff = now - timedelta(days=retention_days)
+    return [
+        (name, lower, upper)
+        for name, lower, upper, is_default in list_partitions(cursor)
+        if not is_default and upper is not None and upper <= cutoff
+    ]
+
+
+def detach_partition(cursor, name, drop=True):
+    """Detach an expired partition and (by default) drop it; one catalog change instead of a huge DELETE."""
+    # Keep alert history, just forget the raw reading it pointed at
+    cursor.execute(
+        f'UPDATE alerts_alert SET reading_id = NULL WHERE reading_id IN (SELECT id FROM {name})'
+    )
+    cursor.execute(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}')
+    if drop:
+        cursor.execute(f'DROP TABLE {name}')
+
+
+def default_partition_rows(cursor):
+    cursor.execute(f'SELECT COUNT(*) FROM {DEFAULT_PARTITION}')
+    return cursor.fetchone()[0]
@@ -0,0 +1,314 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, close_old_connections, connection, transaction
+
+
+# === Device presence ===
+# Devices are online while they keep sending. Last-seen times are kept in
+# memory and flushed in bulk; a sweeper marks devices offline once nothing
+# was heard from them for PRESENCE_TIMEOUT seconds. Devices can also report
+# themselves on MQTT_STATUS_TOPIC ("online" / "offline"), typically with
+# "offline" as their MQTT Last Will so the broker reports them when the
+# connection drops. Dashboards on the `presence` group get one frame per
+# flush listing the devices whose state actually changed.
+PRESENCE_GROUP = 'presence'
+
+
+def presence_key(device_name):
+    return f'presence:{device_name}'
+
+
+def topic_matches(pattern, topic):
+    """MQTT topic filter match with "+" and "#" wildcards."""
+    pattern_parts, topic_parts = pattern.split('/'), topic.split('/')
+    for i, part in enumerate(pattern_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts) or (part != '+' and part != topic_parts[i]):
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+def is_status_topic(topic):
+    return topic_matches(getattr(settings, 'MQTT_STATUS_TOPIC', 'devices/+/status'), topic)
+
+
+def parse_status(payload):
+    """True/False for an "online"/"offline" status payload (text or {"status": ...}), None otherwise."""
+    try:
+        text = bytes(payload).decode().strip()
+    except (TypeError, UnicodeDecodeError):
+        return None
+    if text.startswith('{'):
+        try:
+            text = str(json.loads(text).get('status', ''))
+        except (json.JSONDecodeError, AttributeError):
+            return None
+    return {'online': True, 'offline': False}.get(text.lower())
+
+
+def presence_frame(items):
+    return json.dumps({'type': 'presence', 'items': items})
+
+
+def set_online(names, online):
+    """Flip is_online for `names`; returns the names whose row actually changed."""
+    from .models import Device
+
+    if not names:
+        return []
+    quote = connection.ops.quote_name
+    table = quote(Device._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET is_online = %s WHERE name IN ({", ".join(["%s"] * len(names))}) '
+            f'AND is_online <> %s RETURNING name',
+            [online, *names, online]
+        )
+        return [name for name, in cursor.fetchall()]
+
+
+class PresenceTracker:
+    """
+    Tracks which devices are online without a Device write per message.
+
+    seen() and status() only touch memory. A worker thread flushes every
+    `flush_interval` seconds: last-seen times go to the shared cache and, as
+    one upsert, to DeviceState; online/offline changes are written with one
+    UPDATE ... RETURNING per direction, and only the rows that really
+    changed are broadcast. Several processes can track the same fleet
+    (ingest workers, ASGI servers with WebSocket devices), but only the one
+    that called enable_sweep() -- the ingest worker -- marks devices
+    offline, going by the newest last-seen time any process flushed. The
+    database decides which process reports a transition.
+    """
+
+    def __init__(self, timeout=300.0, flush_interval=10.0, sweep=False):
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.sweeping = sweep
+
+        self._lock = threading.Lock()
+        self._last_seen = {}    # device name -> epoch seconds
+        self._online = {}       # device name -> is_online as last read/written
+        self._pending = {}      # device name -> online, not written yet
+        self._touched = set()   # seen since the last flush
+        self._reloaded_at = None  # epoch seconds of the last _reload(); None until the first full one
+        self._stop = threading.Event()
+        self._thread = None
+        self.counters = {'transitions': 0, 'flushes': 0, 'swept': 0}
+
+    # --- Producer side ---
+    def seen(self, last_seen):
+        """Record {device name: epoch seconds} of messages that were just stored."""
+        cutoff = time.time() - self.timeout
+        with self._lock:
+            for name, at in last_seen.items():
+                if at > self._last_seen.get(name, 0):
+                    self._last_seen[name] = at
+                    self._touched.add(name)
+                # Spool replays of old messages don't bring a device back
+                if at >= cutoff and not self._online.get(name) and self._pending.get(name) is not True:
+                    self._pending[name] = True
+
+    def status(self, name, online, at=None):
+        """A device reported itself online/offline (status topic, Last Will, WebSocket connect)."""
+        at = at or time.time()
+        with self._lock:
+            if online and at > self._last_seen.get(name, 0):
+                self._last_seen[name] = at
+                self._touched.add(name)
+            self._pending[name] = online
+
+    # --- Worker lifecycle ---
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='presence', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def enable_sweep(self):
+        """Make this process the one that marks silent devices offline (the ingest worker)."""
+        self.sweeping = True
+
+    def run_once(self):
+        self._reload()
+        if self.sweeping:
+            self.sweep()
+        return self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.flush_interval)
+            close_old_connections()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[Presence] ❌ Error flushing presence: {e}")
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[Presence] ❌ Error flushing presence on shutdown: {e}")
+
+    # --- Sweeper ---
+    def _reload(self):
+        """
+        Pick up is_online and last-seen times written by other processes.
+        Every process flushes DeviceState.last_seen, so the newer of that and
+        our own time is what the sweeper goes by. The whole table is read
+        once; later reloads read only the devices seen since.
+        """
+        from .models import Device
+
+        now = time.time()
+        rows = Device.objects.values_list('name', 'is_online', 'state__last_seen')
+        if self._reloaded_at is not None:
+            # After the first full load, only the devices some process flushed a
+            # last-seen time for since; going online always comes with one
+            since = self._reloaded_at - 2 * self.flush_interval
+            rows = rows.filter(state__last_seen__gte=datetime.fromtimestamp(since, dt_timezone.utc))
+        self._reloaded_at = now
+        with self._lock:
+            for name, online, last_seen in rows:
+                self._online[name] = online
+                if last_seen is not None:
+                    self._last_seen[name] = max(self._last_seen.get(name, 0), last_seen.timestamp())
+                elif name not in self._last_seen:
+                    # Never seen: a full timeout of grace from now
+                    self._last_seen[name] = now
+
+    def sweep(self, now=None):
+        """Queue an offline transition for every online device not heard from in `timeout` seconds."""
+        now = now or time.time()
+        cutoff = now - self.timeout
+        with self._lock:
+            stale = [name for name, online in self._online.items()
+                     if online and name not in self._pending and self._last_seen.get(name, 0) < cutoff]
+        if not stale:
+            return 0
+
+        # Another process may have heard from them since its last flush
+        shared = cache.get_many([presence_key(name) for name in stale])
+        swept = 0
+        with self._lock:
+            for name in stale:
+                at = shared.get(presence_key(name)) or 0
+                if at >= cutoff:
+                    self._last_seen[name] = max(self._last_seen.get(name, 0), at)
+                elif name not in self._pending:
+                    self._pending[name] = False
+                    swept += 1
+            self.counters['swept'] += swept
+        return swept
+
+    # --- Flush ---
+    def flush(self):
+        from .identity import get_resolver
+        from .state import touch_last_seen
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            touched, self._touched = self._touched, set()
+            seen = {name: self._last_seen[name] for name in touched}
+
+        resolver = get_resolver()
+        changed = []
+        try:
+            if seen:
+                cache.set_many({presence_key(name): at for name, at in seen.items()},
+                               timeout=int(self.timeout * 2))
+            # Presence never creates devices: names that are not in the table are skipped
+            device_ids = resolver.lookup_devices(seen)
+            with transaction.atomic():
+                touch_last_seen({
+                    device_ids[name]: datetime.fromtimestamp(at, dt_timezone.utc)
+                    for name, at in seen.items() if name in device_ids
+                })
+                for online in (True, False):
+                    names = sorted(name for name, state in pending.items() if state is online)
+                    changed.extend((name, online) for name in set_online(names, online))
+        except IntegrityError:
+            # A cached pk of a device another process deleted
+            resolver.forget_devices(seen)
+            self._restore(pending, touched)
+            raise
+        except Exception:
+            self._restore(pending, touched)
+            raise
+
+        with self._lock:
+            self._online.update(pending)
+            self.counters['flushes'] += 1
+            self.counters['transitions'] += len(changed)
+
+        if changed:
+            self.broadcast(changed)
+        return changed
+
+    def _restore(self, pending, touched):
+        """Keep what a failed flush did not write for the next one; newer transitions win."""
+        with self._lock:
+            self._pending = {**pending, **self._pending}
+            self._touched |= touched
+
+    def broadcast(self, changed):
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        items = []
+        for name, online in changed:
+            at = self._last_seen.get(name)
+            items.append({
+                'device_id': name,
+                'online': online,
+                'last_seen': datetime.fromtimestamp(at, dt_timezone.utc).isoformat() if at else None,
+            })
+        async_to_sync(channel_layer.group_send)(PRESENCE_GROUP, {
+            'type': 'send.presence',
+            'text': presence_frame(items),
+        })
+
+    def metrics(self):
+        with self._lock:
+            data = dict(self.counters)
+            data['tracked'] = len(self._last_seen)
+            data['online'] = sum(1 for online in self._online.values() if online)
+            data['pending'] = len(self._pending)
+        data['sweeping'] = self.sweeping
+        data['timeout'] = self.timeout
+        data['flush_interval'] = self.flush_interval
+        return data
+
+
+# --- Process-wide tracker ---
+_presence = None
+_presence_lock = threading.Lock()
+
+
+def get_presence():
+    """Return the process-wide tracker, creating and starting it from settings on first use."""
+    global _presence
+    if _presence is None:
+        with _presence_lock:
+            if _presence is None:
+                presence = PresenceTracker(
+                    timeout=getattr(settings, 'PRESENCE_TIMEOUT', 300.0),
+                    flush_interval=getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 10.0),
+                )
+                presence.start()
+                _presence = presence
+    return _presence
@@ -0,0 +1,144 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import connection
+
+from device.models import SensorReading, SensorReadingRollup
+
+
+# Rollup resolution -> Postgres date_trunc() unit
+ROLLUP_RESOLUTIONS = {
+    '1m': 'minute',
+    '1h': 'hour',
+    '1d': 'day',
+}
+
+ROLLUP_SPANS = {
+    '1m': timedelta(minutes=1),
+    '1h': timedelta(hours=1),
+    '1d': timedelta(days=1),
+}
+
+
+def bucket_start(moment, resolution):
+    moment = moment.astimezone(dt_timezone.utc)
+    if resolution == '1m':
+        return moment.replace(second=0, microsecond=0)
+    if resolution == '1h':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def choose_resolution(start, end, max_points):
+    """Finest resolution whose bucket count over [start, end) fits in `max_points`, else the coarsest."""
+    span = end - start
+    for resolution, step in ROLLUP_SPANS.items():
+        if span / step <= max_points:
+            return resolution
+    return '1d'
+
+
+# --- Incremental maintenance ---
+
+def accumulate(readings, resolutions=ROLLUP_SPANS):
+    """Fold a batch of readings into {(device_id, parameter, resolution, bucket): [count, sum, min, max, last, last_ts]}."""
+    buckets = {}
+    for reading in readings:
+        for parameter in SensorReading.MEASUREMENT_FIELDS:
+            value = getattr(reading, parameter)
+            if value is None:
+                continue
+            for resolution in resolutions:
+                key = (reading.device_id, parameter, resolution, bucket_start(reading.timestamp, resolution))
+                agg = buckets.get(key)
+                if agg is None:
+                    buckets[key] = [1, value, value, value, value, reading.timestamp]
+                    continue
+                agg[0] += 1
+                agg[1] += value
+                agg[2] = min(agg[2], value)
+                agg[3] = max(agg[3], value)
+                if reading.timestamp >= agg[5]:
+                    agg[4], agg[5] = value, reading.timestamp
+    return buckets
+
+
+def apply_rollups(readings, chunk_size=1000):
+    """Merge a freshly inserted batch of readings into the rollup buckets with upserts."""
+    buckets = accumulate(readings)
+    if not buckets:
+        return 0
+
+    table = SensorReadingRollup._meta.db_table
+    least, greatest = ('LEAST', 'GREATEST') if connection.vendor == 'postgresql' else ('MIN', 'MAX')
+    # Sorted so concurrent writers lock bucket rows in the same order
+    rows = [(*key, *agg) for key, agg in sorted(buckets.items())]
+
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), chunk_size):
+            chunk = rows[i:i + chunk_size]
+            cursor.execute(f"""
+                INSERT INTO {table}
+                    (device_id, parameter, resolution, bucket, count, sum_value, min_value, max_value, last_value, last_timestamp)
+                VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(chunk))}
+                ON CONFLICT (device_id, parameter, resolution, bucket) DO UPDATE SET
+                    count = {table}.count + EXCLUDED.count,
+                    sum_value = {table}.sum_value + EXCLUDED.sum_value,
+                    min_value = {least}({table}.min_value, EXCLUDED.min_value),
+                    max_value = {greatest}({table}.max_value, EXCLUDED.max_value),
+                    last_value = CASE WHEN EXCLUDED.last_timestamp >= {table}.last_timestamp
+                                      THEN EXCLUDED.last_value ELSE {table}.last_value END,
+                    last_timestamp = {greatest}({table}.last_timestamp, EXCLUDED.last_timestamp)
+            """, [value for row in chunk for value in row])
+    return len(rows)
+
+
+# --- Rebuild from raw readings ---
+
+
+def _measurement_values_sql():
+    return ', '.join(f"('{field}', r.\"{field}\")" for field in SensorReading.MEASUREMENT_FIELDS)
+
+
+def rebuild_rollups(cursor, resolution, source_table=None, start=None, end=None, device_ids=None):
+    """
+    Recompute rollup buckets from raw readings with one grouped scan (Postgres only).
+
+    Buckets are replaced, not merged, so `start`/`end` should fall on bucket
+    boundaries of `resolution` -- partition bounds always do. Returns the
+    number of buckets written.
+    """
+    unit = ROLLUP_RESOLUTIONS[resolution]
+    table = SensorReadingRollup._meta.db_table
+    source = connection.ops.quote_name(source_table or SensorReading._meta.db_table)
+
+    where = ['m.v IS NOT NULL']
+    params = [resolution, unit]
+    if start is not None:
+        where.append('r."timestamp" >= %s')
+        params.append(start)
+    if end is not None:
+        where.append('r."timestamp" < %s')
+        params.append(end)
+    if device_ids:
+        where.append('r.device_id = ANY(%s)')
+        params.append(list(device_ids))
+
+    cursor.execute(f"""
+        INSERT INTO {table}
+            (device_id, parameter, resolution, bucket, count, sum_value, min_value, max_value, last_value, last_timestamp)
+        SELECT r.device_id, m.parameter, %s, date_trunc(%s, r."timestamp") AS bucket,
+               COUNT(*), SUM(m.v), MIN(m.v), MAX(m.v),
+               (array_agg(m.v ORDER BY r."timestamp" DESC))[1], MAX(r."timestamp")
+        FROM {source} r
+        CROSS JOIN LATERAL (VALUES {_measurement_values_sql()}) AS m(parameter, v)
+        WHERE {' AND '.join(where)}
+        GROUP BY r.device_id, m.parameter, bucket
+        ON CONFLICT (device_id, parameter, resolution, bucket) DO UPDATE SET
+            count = EXCLUDED.count,
+            sum_value = EXCLUDED.sum_value,
+            min_value = EXCLUDED.min_value,
+            max_value = EXCLUDED.max_value,
+            last_value = EXCLUDED.last_value,
+            last_timestamp = EXCLUDED.last_timestamp
+    """, params)
+    return cursor.rowcount
@@ -1,5 +1,5 @@
 from django.urls import re_path
-from .consumers import DeviceConsumer, SensorDataConsumer
+from .consumers import DeviceConsumer, PresenceConsumer, SensorDataConsumer
 
 websocket_urlpatterns = [
     # WebSocket for individual device updates
@@ -7,4 +7,7 @@ websocket_urlpatterns = [
 
     # WebSocket for real-time dashboard updates
     re_path(r'^ws/sensors/$', SensorDataConsumer.as_asgi()),
+
+    # WebSocket for device online/offline transitions
+    re_path(r'^ws/presence/$', PresenceConsumer.as_asgi()),
 ]
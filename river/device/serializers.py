@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from device.models import Device, Sensor, SensorReading, MQTTBroker
+from device.models import Device, DeviceState, Sensor, SensorReading, MQTTBroker
 
 
 # --- SENSOR SERIALIZER ---
@@ -19,13 +19,68 @@ class SensorReadingSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+# --- SENSOR READING LIST SERIALIZER ---
+class SensorReadingListSerializer(serializers.Serializer):
+    """
+    Read-only serializer over SensorReading.values() rows for the list
+    endpoint. Device and sensor names are filled in per page by the view,
+    so no row touches a related object. Pass `fields` to project a subset.
+    """
+    id = serializers.IntegerField()
+    sensor = serializers.CharField(source='sensor_name', allow_null=True)
+    device = serializers.CharField(source='device_name', allow_null=True)
+    timestamp = serializers.DateTimeField()
+    sequence = serializers.IntegerField()
+    manual_override = serializers.BooleanField()
+    pH = serializers.FloatField(allow_null=True)
+    temperature = serializers.FloatField(allow_null=True)
+    turbidity = serializers.FloatField(allow_null=True)
+    dissolved_oxygen = serializers.FloatField(allow_null=True)
+    ise = serializers.FloatField(allow_null=True)
+    tds = serializers.FloatField(allow_null=True)
+    orp = serializers.FloatField(allow_null=True)
+    ec = serializers.FloatField(allow_null=True)
+    value = serializers.FloatField(allow_null=True)
+
+    # Output field -> SensorReading column to fetch for it
+    COLUMNS = {
+        'id': 'id',
+        'sensor': 'sensor_id',
+        'device': 'device_id',
+        'timestamp': 'timestamp',
+        'sequence': 'sequence',
+        'manual_override': 'manual_override',
+        **{field: field for field in SensorReading.MEASUREMENT_FIELDS},
+    }
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+# --- DEVICE STATE SERIALIZER ---
+class DeviceStateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeviceState
+        fields = ['last_seen', 'timestamp', *SensorReading.MEASUREMENT_FIELDS]
+
+
 # --- DEVICE SERIALIZER ---
 class DeviceSerializer(serializers.ModelSerializer):
+    """`state` is only included when the view's context asks for it (?include=state)."""
     sensors = SensorSerializer(many=True, read_only=True)
+    state = DeviceStateSerializer(read_only=True)
 
     class Meta:
         model = Device
-        fields = ['id', 'name', 'location', 'is_online', 'description', 'created_at', 'sensors']
+        fields = ['id', 'name', 'location', 'is_online', 'description', 'created_at', 'sensors', 'state']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if 'state' not in self.context.get('include', ()):
+            self.fields.pop('state')
 
 
 # --- MQTT BROKER SERIALIZER ---
@@ -0,0 +1,180 @@
+import numpy as np
+from django.conf import settings
+
+from device.models import SensorReading, SensorReadingRollup
+from device.rollups import bucket_start, choose_resolution
+
+
+SERIES_METHODS = ('lttb', 'minmax', 'mean')
+
+
+class SeriesError(Exception):
+    pass
+
+
+# === Columnar fetch ===
+# Every source is turned into the same per-parameter columns, sorted by time:
+#
+#     {'t': epoch seconds, 'sum': ..., 'count': ..., 'min': ..., 'max': ...}
+#
+# A raw reading is a bucket of one (sum = min = max = value, count = 1), so
+# the decimators below work the same on readings and on rollups.
+
+def _columns(times, sums, counts, mins, maxs):
+    return {'t': times, 'sum': sums, 'count': counts, 'min': mins, 'max': maxs}
+
+
+def raw_columns(device, parameters, start, end, max_rows):
+    """Readings in [start, end) as columns; None if there are more than `max_rows` of them."""
+    rows = list(
+        SensorReading.objects.filter(device=device, timestamp__gte=start, timestamp__lt=end)
+        .order_by('timestamp').values_list('timestamp', *parameters)[:max_rows + 1]
+    )
+    if len(rows) > max_rows:
+        return None
+
+    timestamps, *values = zip(*rows) if rows else ((),) * (len(parameters) + 1)
+    times = np.fromiter((moment.timestamp() for moment in timestamps), dtype=np.float64, count=len(timestamps))
+    series = {}
+    for parameter, column in zip(parameters, values):
+        # None -> NaN; per-sensor rows only fill their own column
+        y = np.array(column, dtype=np.float64)
+        keep = ~np.isnan(y)
+        y = y[keep]
+        series[parameter] = _columns(times[keep], y, np.ones(len(y)), y, y)
+    return series
+
+
+def rollup_columns(device, parameters, start, end, resolution):
+    """Rollup buckets of `resolution` overlapping [start, end) as columns."""
+    rows = SensorReadingRollup.objects.filter(
+        device=device,
+        parameter__in=parameters,
+        resolution=resolution,
+        bucket__gte=bucket_start(start, resolution),
+        bucket__lt=end,
+    ).order_by('parameter', 'bucket').values_list('parameter', 'bucket', 'sum_value', 'count', 'min_value', 'max_value')
+
+    grouped = {parameter: [] for parameter in parameters}
+    for parameter, *row in rows:
+        grouped[parameter].append(row)
+
+    series = {}
+    for parameter, buckets in grouped.items():
+        buckets = [row for row in buckets if row[2]]  # skip empty buckets
+        times = np.fromiter((row[0].timestamp() for row in buckets), dtype=np.float64, count=len(buckets))
+        _, *values = zip(*buckets) if buckets else ((),) * 5
+        series[parameter] = _columns(times, *(np.array(column, dtype=np.float64) for column in values))
+    return series
+
+
+# === Decimation ===
+
+def _bucket_index(t, start, end, buckets):
+    """Equal-width time bucket of every sample in [start, end)."""
+    width = (end - start) / buckets
+    return np.clip(((t - start) / width).astype(np.int64), 0, buckets - 1), width
+
+
+def lttb(t, y, threshold):
+    """
+    Indices of the `threshold` points Largest-Triangle-Three-Buckets keeps.
+
+    The first and last points are always kept; every bucket in between
+    contributes the point forming the largest triangle with the previous
+    pick and the next bucket's average. Areas of a whole bucket are computed
+    at once, so the Python loop runs once per output point.
+    """
+    n = len(t)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:max(threshold, 0)], dtype=np.int64)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    picks = np.empty(threshold, dtype=np.int64)
+    picks[0], picks[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_t, avg_y = t[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((t[a] - avg_t) * (y[lo:hi] - y[a]) - (t[a] - t[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        picks[i + 1] = a
+    return picks
+
+
+def decimate_lttb(columns, points, start, end):
+    y = columns['sum'] / columns['count']
+    picks = lttb(columns['t'], y, points)
+    return {'t': columns['t'][picks], 'v': y[picks]}
+
+
+def decimate_minmax(columns, points, start, end):
+    """Min/max envelope over points // 2 equal time buckets (two values per bucket)."""
+    t = columns['t']
+    if not len(t):
+        return {'t': t, 'min': t, 'max': t}
+    index, width = _bucket_index(t, start, end, max(points // 2, 1))
+    # Samples are sorted, so each bucket is one contiguous run
+    firsts = np.flatnonzero(np.r_[True, np.diff(index) != 0])
+    return {
+        't': start + index[firsts] * width,
+        'min': np.minimum.reduceat(columns['min'], firsts),
+        'max': np.maximum.reduceat(columns['max'], firsts),
+    }
+
+
+def decimate_mean(columns, points, start, end):
+    """Count-weighted mean over `points` equal time buckets; empty buckets are left out."""
+    t = columns['t']
+    if not len(t):
+        return {'t': t, 'v': t}
+    index, width = _bucket_index(t, start, end, points)
+    sums = np.bincount(index, weights=columns['sum'], minlength=points)
+    counts = np.bincount(index, weights=columns['count'], minlength=points)
+    filled = np.flatnonzero(counts)
+    return {'t': start + filled * width, 'v': sums[filled] / counts[filled]}
+
+
+DECIMATORS = {
+    'lttb': decimate_lttb,
+    'minmax': decimate_minmax,
+    'mean': decimate_mean,
+}
+
+
+def build_series(device, parameters, start, end, points, method='lttb'):
+    """
+    Decimated series of `parameters` for one device over [start, end).
+
+    Ranges up to SERIES_RAW_MAX_SPAN_HOURS are read from raw readings as
+    long as there are at most SERIES_RAW_MAX_ROWS of them; anything larger
+    comes from the finest rollup resolution that fits in that row budget.
+    Either way at most `points` points per parameter are returned, with
+    times as epoch milliseconds.
+    """
+    if method not in DECIMATORS:
+        raise SeriesError(f"Unknown method {method!r}, expected one of {', '.join(SERIES_METHODS)}")
+
+    max_rows = getattr(settings, 'SERIES_RAW_MAX_ROWS', 200000)
+    max_span = getattr(settings, 'SERIES_RAW_MAX_SPAN_HOURS', 48)
+
+    columns, source = None, 'raw'
+    if (end - start).total_seconds() <= max_span * 3600:
+        columns = raw_columns(device, parameters, start, end, max_rows)
+    if columns is None:
+        resolution = choose_resolution(start, end, max_rows)
+        columns, source = rollup_columns(device, parameters, start, end, resolution), f'rollup:{resolution}'
+
+    t0, t1 = start.timestamp(), end.timestamp()
+    series = {}
+    for parameter, data in columns.items():
+        decimated = DECIMATORS[method](data, points, t0, t1)
+        series[parameter] = {
+            key: (np.rint(values * 1000).astype(np.int64) if key == 't' else values).tolist()
+            for key, values in decimated.items()
+        }
+        series[parameter]['samples'] = int(data['count'].sum())
+    return source, series
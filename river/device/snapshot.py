@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Device
+
+
+# === Latest-state snapshot for dashboards that just connected ===
+# Every ingest flush writes the pre-serialized sensor_data frame of each
+# device it touched under that device's own key, and drops SNAPSHOT_KEY. The
+# first client to connect afterwards splices the per-device frames into one
+# "sensor_snapshot" frame and caches it under SNAPSHOT_KEY, so later clients
+# cost one cache read and one send. The device names to splice, in order, are
+# kept under DEVICE_INDEX_KEY: ingest adds new devices to it, and it is read
+# from the database only when it is missing. Point CACHES at Redis to share
+# all of it between the ingest worker and the ASGI processes.
+SNAPSHOT_KEY = 'sensors:snapshot'
+SNAPSHOT_LOCK_KEY = 'sensors:snapshot:building'
+DEVICE_INDEX_KEY = 'sensors:devices'
+
+
+def latest_key(device_name):
+    return f'sensors:latest:{device_name}'
+
+
+def snapshot_frame(frames):
+    return '{"type": "sensor_snapshot", "items": [' + ', '.join(frames) + ']}'
+
+
+def device_index():
+    """Names of all devices in snapshot order; from the database only when the cache has none."""
+    names = cache.get(DEVICE_INDEX_KEY)
+    if names is None:
+        names = list(Device.objects.order_by('name').values_list('name', flat=True))
+        cache.set(DEVICE_INDEX_KEY, names, timeout=getattr(settings, 'SENSOR_DEVICE_INDEX_TTL', 600))
+    return names
+
+
+class LatestStateSnapshot:
+    """Publishes the newest frame per device to the cache."""
+
+    def __init__(self):
+        self._indexed = set()   # device names this process has seen in DEVICE_INDEX_KEY
+
+    def update(self, frames):
+        """Publish {device name: frame text} from a flushed batch; only those devices' keys are written."""
+        if not frames:
+            return
+        cache.set_many({latest_key(name): text for name, text in frames.items()}, timeout=None)
+        new = frames.keys() - self._indexed
+        if new:
+            # A missing index is read from the database, which has these devices already
+            index = cache.get(DEVICE_INDEX_KEY)
+            if index is not None and not new.issubset(index):
+                cache.set(DEVICE_INDEX_KEY, sorted(new.union(index)),
+                          timeout=getattr(settings, 'SENSOR_DEVICE_INDEX_TTL', 600))
+            self._indexed |= new
+        cache.delete(SNAPSHOT_KEY)
+
+
+def build_snapshot(device_names):
+    """
+    Splice the published frames of `device_names` into the snapshot frame
+    and cache it; None if no ingest process has published any of them.
+    """
+    found = cache.get_many([latest_key(name) for name in device_names])
+    if not found:
+        return None
+    text = snapshot_frame(found[latest_key(name)] for name in device_names if latest_key(name) in found)
+    # Bounded, in case a flush dropped the key while this one was being built
+    cache.set(SNAPSHOT_KEY, text, timeout=getattr(settings, 'SENSOR_SNAPSHOT_TTL', 60))
+    return text
+
+
+def seed_snapshot(frames):
+    """Publish a snapshot built from the database while no ingest process has published one."""
+    ttl = getattr(settings, 'SENSOR_SNAPSHOT_FALLBACK_TTL', 30)
+    text = snapshot_frame(frames.values())
+    cache.set(SNAPSHOT_KEY, text, timeout=ttl)
+    return text
+
+
+_snapshot = LatestStateSnapshot()
+
+
+def get_snapshot():
+    return _snapshot
+
+
+# --- Cache invalidation ---
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def drop_device_index(sender, instance, created=False, **kwargs):
+    # Renamed or deleted: the next snapshot reads the names from the database again
+    if not created:
+        cache.delete_many([DEVICE_INDEX_KEY, SNAPSHOT_KEY])
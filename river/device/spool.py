@@ -0,0 +1,159 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# === Local write-ahead spool for ingested messages ===
+class IngestSpool:
+    """
+    Append-only SQLite queue between the broker and the database.
+
+    Messages are committed here before anything touches Postgres, and are
+    only deleted (ack) after the batch holding them was written. Positions
+    are AUTOINCREMENT ids, so they never go backwards even after rows are
+    deleted; together with IngestCheckpoint they make replays idempotent.
+
+    One connection is shared between threads behind a lock; WAL mode keeps
+    appends cheap while a drain is reading. The file is opened in exclusive
+    locking mode, so a second worker pointed at the same spool fails with
+    sqlite3.OperationalError ("database is locked") instead of draining it
+    too.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=1.0)
+        self._db.execute('PRAGMA locking_mode=EXCLUSIVE')
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_name TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                received_at REAL NOT NULL
+            )
+        """)
+        # Messages that failed on their own while the database was up, kept for inspection
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                position INTEGER,
+                device_name TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                received_at REAL NOT NULL,
+                failed_at REAL NOT NULL,
+                error TEXT
+            )
+        """)
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.source = f"spool:{self._spool_id()}"
+
+        self.appended = 0
+        self.drained = 0
+        self.drain_rate = 0.0       # messages/second, smoothed over recent acks
+        self._last_ack = None
+
+    def _spool_id(self):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'id'").fetchone()
+            if row:
+                return row[0]
+            spool_id = uuid.uuid4().hex
+            self._db.execute("INSERT INTO meta (key, value) VALUES ('id', ?)", [spool_id])
+            return spool_id
+
+    # --- Writing ---
+    def append(self, messages):
+        """Durably add decoded messages; returns once they are committed."""
+        if not messages:
+            return
+        now = time.time()
+        # Each message keeps its own arrival time: it is the reading time of untimestamped ones
+        rows = [(message['device_name'], json.dumps(message['payload']), message.get('received_at') or now)
+                for message in messages]
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.executemany('INSERT INTO spool (device_name, payload, received_at) VALUES (?, ?, ?)', rows)
+            self._db.execute('COMMIT')
+            self.appended += len(rows)
+
+    # --- Draining ---
+    def read(self, limit):
+        """Oldest `limit` messages as (last position, [message]); every message carries its own position."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, device_name, payload, received_at FROM spool ORDER BY id LIMIT ?', [limit]
+            ).fetchall()
+        if not rows:
+            return None, []
+        return rows[-1][0], [
+            {'device_name': name, 'payload': json.loads(payload), 'received_at': received_at, 'position': position}
+            for position, name, payload, received_at in rows
+        ]
+
+    def ack(self, position):
+        """Forget everything up to and including `position`."""
+        with self._lock:
+            deleted = self._db.execute('DELETE FROM spool WHERE id <= ?', [position]).rowcount
+
+        now = time.monotonic()
+        if deleted and self._last_ack is not None and now > self._last_ack:
+            rate = deleted / (now - self._last_ack)
+            self.drain_rate = rate if not self.drain_rate else 0.8 * self.drain_rate + 0.2 * rate
+        self._last_ack = now
+        self.drained += deleted
+        return deleted
+
+    def dead_letter(self, messages, error=None):
+        """Set messages aside that can't be stored; the caller still acks their positions."""
+        if not messages:
+            return
+        now = time.time()
+        rows = [
+            (message.get('position'), message['device_name'], json.dumps(message['payload']),
+             message.get('received_at') or now, now, error)
+            for message in messages
+        ]
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.executemany(
+                'INSERT INTO dead_letter (position, device_name, payload, received_at, failed_at, error) '
+                'VALUES (?, ?, ?, ?, ?, ?)', rows
+            )
+            self._db.execute('COMMIT')
+
+    def dead_letters(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM dead_letter').fetchone()[0]
+
+    # --- Introspection ---
+    def depth(self):
+        with self._lock:
+            low, high = self._db.execute('SELECT MIN(id), MAX(id) FROM spool').fetchone()
+        # Acks always delete a prefix, so the ids left are contiguous
+        return 0 if low is None else high - low + 1
+
+    def oldest_age(self):
+        with self._lock:
+            row = self._db.execute('SELECT received_at FROM spool ORDER BY id LIMIT 1').fetchone()
+        return round(time.time() - row[0], 3) if row else 0.0
+
+    def metrics(self):
+        return {
+            'path': self.path,
+            'source': self.source,
+            'depth': self.depth(),
+            'oldest_age_seconds': self.oldest_age(),
+            'appended': self.appended,
+            'drained': self.drained,
+            'drain_rate_per_second': round(self.drain_rate, 3),
+            'dead_letters': self.dead_letters(),
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,77 @@
+from django.db import connection
+
+from device.models import DeviceState, SensorReading
+
+
+# --- Incremental maintenance ---
+
+def accumulate(readings):
+    """Fold a batch of readings into {device_id: [timestamp, {field: value}]} of the newest values."""
+    states = {}
+    for reading in sorted(readings, key=lambda r: r.timestamp):
+        state = states.setdefault(reading.device_id, [reading.timestamp, {}])
+        state[0] = reading.timestamp
+        for field in SensorReading.MEASUREMENT_FIELDS:
+            value = getattr(reading, field)
+            if value is not None:
+                state[1][field] = value
+    return states
+
+
+def apply_state(readings):
+    """
+    Upsert the latest values of a stored batch into DeviceState. Older
+    readings (backfills, spool replays) only fill measurements the state
+    does not have yet.
+    """
+    states = accumulate(readings)
+    if not states:
+        return 0
+
+    fields = SensorReading.MEASUREMENT_FIELDS
+    quote = connection.ops.quote_name
+    table = quote(DeviceState._meta.db_table)
+    greatest = 'GREATEST' if connection.vendor == 'postgresql' else 'MAX'
+    ts = quote('timestamp')
+
+    # Sorted so concurrent writers lock rows in the same order
+    rows = [(device_id, timestamp, *(values.get(field) for field in fields))
+            for device_id, (timestamp, values) in sorted(states.items())]
+
+    newer = f'EXCLUDED.{ts} >= {table}.{ts}'
+    updates = ',\n'.join(
+        f'{quote(field)} = CASE WHEN {newer} THEN COALESCE(EXCLUDED.{quote(field)}, {table}.{quote(field)}) '
+        f'ELSE COALESCE({table}.{quote(field)}, EXCLUDED.{quote(field)}) END'
+        for field in fields
+    )
+    columns = ', '.join(['device_id', ts, *(quote(field) for field in fields)])
+    row = '(' + ', '.join(['%s'] * (2 + len(fields))) + ')'
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {table} ({columns})
+            VALUES {', '.join([row] * len(rows))}
+            ON CONFLICT (device_id) DO UPDATE SET
+                {updates},
+                {ts} = {greatest}(COALESCE({table}.{ts}, EXCLUDED.{ts}), EXCLUDED.{ts})
+        """, [value for row in rows for value in row])
+    return len(rows)
+
+
+def touch_last_seen(seen):
+    """Upsert DeviceState.last_seen from {device_id: datetime}, never moving it backwards."""
+    if not seen:
+        return 0
+
+    table = connection.ops.quote_name(DeviceState._meta.db_table)
+    greatest = 'GREATEST' if connection.vendor == 'postgresql' else 'MAX'
+    rows = sorted(seen.items())
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {table} (device_id, last_seen)
+            VALUES {', '.join(['(%s, %s)'] * len(rows))}
+            ON CONFLICT (device_id) DO UPDATE SET
+                last_seen = {greatest}(COALESCE({table}.last_seen, EXCLUDED.last_seen), EXCLUDED.last_seen)
+        """, [value for row in rows for value in row])
+    return len(rows)
@@ -1,3 +1,1022 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from device.aio_ingest import AsyncIngestService, RendezvousPartitioner
+from device.broadcast import sensor_event
+from device.codecs import CodecError, decode_record, encode_struct, payload_samples, telemetry_record
+from device.consumers import DeviceConsumer, SensorDataConsumer
+from device import ingest, partitions, presence, rollups, series
+from device.identity import IdentityResolver, get_resolver
+from device.models import Device, DeviceState, Sensor, SensorReading, SensorReadingRollup
+from device.presence import PresenceTracker
+from device.snapshot import SNAPSHOT_KEY, get_snapshot
+from device.spool import IngestSpool
+
+
+class IngestTestCase(TestCase):
+    def setUp(self):
+        # Cached pks would outlive the rolled back rows of earlier tests
+        get_resolver().clear()
+
+
+def make_service(**options):
+    defaults = {'host': 'localhost', 'port': 1883, 'topic': 'devices/+/telemetry', 'use_tls': False}
+    defaults.update(options)
+    return AsyncIngestService(**defaults)
+
+
+# --- Identity cache ---
+class IdentityResolverTests(IngestTestCase):
+    def test_write_recovers_from_a_device_deleted_by_another_process(self):
+        device = Device.objects.create(name='dev1')
+        get_resolver().device_id('dev1')
+        # Another process deletes it: no signal reaches this one
+        Device.objects.filter(pk=device.pk).delete()
+
+        ingest.write_batch([{'device_name': 'dev1', 'payload': {'ph': 7.1, 'timestamp': 1718000000}}])
+
+        reading = SensorReading.objects.get()
+        self.assertNotEqual(reading.device_id, device.pk)
+        self.assertEqual(reading.device.name, 'dev1')
+
+    def test_entries_expire(self):
+        device = Device.objects.create(name='dev1')
+        cached, expiring = IdentityResolver(), IdentityResolver(ttl=-1)
+        for resolver in (cached, expiring):
+            resolver.device_id('dev1')
+        # Renamed by another process; a new dev1 shows up
+        Device.objects.filter(pk=device.pk).update(name='renamed')
+        Device.objects.create(name='dev1')
+
+        self.assertEqual(cached.device_id('dev1'), device.pk)
+        self.assertNotEqual(expiring.device_id('dev1'), device.pk)
+        self.assertEqual(expiring.expirations, 1)
+
+
+# --- Pipeline ---
+class IngestPipelineTests(IngestTestCase):
+    def message(self, i):
+        return telemetry_record('dev1', {'ph': 7.0 + i / 10, 'timestamp': 1718000000 + i})
+
+    def test_queued_messages_are_flushed_in_batches(self):
+        pipeline = ingest.IngestPipeline(batch_size=2, flush_interval=60, metrics_interval=0)
+        for i in range(5):
+            self.assertTrue(pipeline.submit(self.message(i)))
+
+        # Stopped: the worker drains the queue and returns
+        pipeline._stop.set()
+        pipeline._run()
+
+        self.assertEqual(SensorReading.objects.count(), 5)
+        metrics = pipeline.metrics()
+        self.assertEqual((metrics['enqueued'], metrics['written'], metrics['flushes']), (5, 5, 3))
+        self.assertEqual(metrics['last_flush_size'], 1)
+        self.assertEqual(metrics['queue_depth'], 0)
+
+    def test_drop_newest_rejects_when_full(self):
+        pipeline = ingest.IngestPipeline(max_queue=2, policy='drop_newest')
+        results = [pipeline.submit(self.message(i)) for i in range(3)]
+
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual([m['payload']['timestamp'] for m in pipeline.queue.queue], [1718000000, 1718000001])
+        self.assertEqual(pipeline.stats.dropped, 1)
+
+    def test_drop_oldest_evicts_to_make_room(self):
+        pipeline = ingest.IngestPipeline(max_queue=2, policy='drop_oldest')
+        results = [pipeline.submit(self.message(i)) for i in range(3)]
+
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual([m['payload']['timestamp'] for m in pipeline.queue.queue], [1718000001, 1718000002])
+        self.assertEqual(pipeline.stats.dropped, 1)
+
+    def test_block_gives_up_after_the_timeout(self):
+        pipeline = ingest.IngestPipeline(max_queue=1, policy='block', block_timeout=0.01)
+        pipeline.submit(self.message(0))
+
+        self.assertFalse(pipeline.submit(self.message(1)))
+        self.assertEqual(pipeline.stats.dropped, 1)
+
+    def test_unknown_policy_is_refused(self):
+        with self.assertRaises(ValueError):
+            ingest.IngestPipeline(policy='drop_everything')
+
+
+# --- Reading storage ---
+class ReadingStorageTests(IngestTestCase):
+    payload = {'ph': 7.1, 'temperature': 18.5, 'turbidity': 3.0, 'timestamp': 1718000000}
+
+    def test_wide_layout_stores_one_row_per_message(self):
+        ingest.write_batch([{'device_name': 'dev1', 'payload': dict(self.payload)}])
+
+        reading = SensorReading.objects.get()
+        self.assertIsNone(reading.sensor_id)
+        self.assertEqual((reading.pH, reading.temperature, reading.turbidity), (7.1, 18.5, 3.0))
+        # The sensor inventory is still kept
+        self.assertEqual(Device.objects.get(name='dev1').sensors.count(), 3)
+
+    def test_per_sensor_layout_stores_one_row_per_sensor(self):
+        with self.settings(READING_STORAGE='per_sensor'):
+            ingest.write_batch([{'device_name': 'dev1', 'payload': dict(self.payload)}])
+
+        self.assertEqual(SensorReading.objects.filter(sensor__isnull=False).count(), 3)
+
+    def test_migration_merges_per_sensor_rows(self):
+        from django.apps import apps
+        from alerts.models import Alert
+        migration = importlib.import_module('device.migrations.0002_wide_sensor_readings')
+
+        device = Device.objects.create(name='dev1')
+        at = timezone.now()
+        rows = []
+        for offset, (sensor_type, field, value) in enumerate([('PH', 'pH', 7.1), ('TEMP', 'temperature', 18.5)]):
+            sensor = Sensor.objects.create(name=f'dev1 - {sensor_type}', sensor_type=sensor_type, device=device)
+            rows.append(SensorReading.objects.create(
+                sensor=sensor, device=device, timestamp=at + timedelta(milliseconds=offset), **{field: value}
+            ))
+        # A later message that repeats a column starts a new row
+        SensorReading.objects.create(sensor=sensor, device=device, timestamp=at + timedelta(milliseconds=5), temperature=19.0)
+        alert = Alert.objects.create(device=device, reading=rows[1], parameter='temperature', message='hot')
+
+        migration.merge_per_sensor_rows(apps, None)
+
+        merged = SensorReading.objects.order_by('timestamp')
+        self.assertEqual([(r.pH, r.temperature) for r in merged], [(7.1, 18.5), (None, 19.0)])
+        self.assertTrue(all(r.sensor_id is None for r in merged))
+        alert.refresh_from_db()
+        self.assertEqual(alert.reading_id, rows[0].pk)
+
+
+# --- Partitions ---
+class FakeCursor:
+    """Answers the pg_inherits query with `partitions` [(name, bound)] and records everything else."""
+
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((' '.join(sql.split()), params))
+
+    def fetchall(self):
+        return list(self.partitions)
+
+
+class PartitionTests(SimpleTestCase):
+    now = datetime(2025, 7, 10, 15, 30, tzinfo=dt_timezone.utc)   # a Thursday
+    existing = [
+        ('device_sensorreading_default', 'DEFAULT'),
+        ('device_sensorreading_p20250707', "FOR VALUES FROM ('2025-07-07 00:00:00+00') TO ('2025-07-14 00:00:00+00')"),
+        ('device_sensorreading_archive', "FOR VALUES FROM (MINVALUE) TO ('2025-07-07 00:00:00+00')"),
+        ('device_sensorreading_p20250512', "FOR VALUES FROM ('2025-05-12 00:00:00+00') TO ('2025-05-19 00:00:00+00')"),
+    ]
+
+    def test_periods_start_at_utc_midnight_and_on_mondays(self):
+        self.assertEqual(partitions.period_start(self.now, 'day'), datetime(2025, 7, 10, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.period_start(self.now, 'week'), datetime(2025, 7, 7, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.partition_name(datetime(2025, 7, 7)), 'device_sensorreading_p20250707')
+
+    def test_partitions_are_listed_oldest_first_with_default_last(self):
+        listed = partitions.list_partitions(FakeCursor(self.existing))
+        self.assertEqual([name for name, *_ in listed], [
+            'device_sensorreading_archive', 'device_sensorreading_p20250512',
+            'device_sensorreading_p20250707', 'device_sensorreading_default',
+        ])
+        self.assertIsNone(listed[0][1])
+
+    def test_future_partitions_continue_from_the_newest(self):
+        cursor = FakeCursor(self.existing)
+        created = partitions.ensure_partitions(cursor, 'week', ahead=2, now=self.now)
+        self.assertEqual(created, ['device_sensorreading_p20250714', 'device_sensorreading_p20250721'])
+        # Rows that landed in the default partition move into the new one
+        self.assertTrue(any('DELETE FROM device_sensorreading_default' in sql for sql, _ in cursor.executed))
+
+    def test_only_partitions_entirely_past_retention_expire(self):
+        expired = partitions.expired_partitions(FakeCursor(self.existing), retention_days=30, now=self.now)
+        self.assertEqual([name for name, *_ in expired], ['device_sensorreading_p20250512'])
+
+    def test_command_needs_postgres(self):
+        with self.assertRaises(CommandError):
+            call_command('partition_readings')
+
+    def test_migration_can_be_reversed(self):
+        migration = importlib.import_module('device.migrations.0003_partition_sensor_readings').Migration
+        self.assertTrue(all(operation.reversible for operation in migration.operations))
+
+
+# --- Rollups ---
+class RollupTests(IngestTestCase):
+    def test_finest_resolution_that_fits_the_budget(self):
+        end = datetime(2025, 7, 10, tzinfo=dt_timezone.utc)
+        self.assertEqual(rollups.choose_resolution(end - timedelta(hours=2), end, 1000), '1m')
+        self.assertEqual(rollups.choose_resolution(end - timedelta(days=30), end, 1000), '1h')
+        self.assertEqual(rollups.choose_resolution(end - timedelta(days=3650), end, 1000), '1d')
+
+    def test_batches_merge_into_the_buckets(self):
+        base = 1718000000 - 1718000000 % 3600   # top of an hour
+        ingest.write_batch([{'device_name': 'dev1', 'payload': {'ph': 7.0, 'timestamp': base + 10}}])
+        ingest.write_batch([
+            {'device_name': 'dev1', 'payload': {'ph': 8.0, 'timestamp': base + 20}},
+            {'device_name': 'dev1', 'payload': {'ph': 6.0, 'timestamp': base + 130}},
+        ])
+
+        response = self.client.get(reverse('sensorreading-aggregate'), {
+            'device': 'dev1', 'parameter': 'pH', 'points': 10,
+            'start': datetime.fromtimestamp(base, dt_timezone.utc).isoformat(),
+            'end': datetime.fromtimestamp(base + 300, dt_timezone.utc).isoformat(),
+        })
+
+        body = response.json()
+        self.assertEqual(body['resolution'], '1m')
+        self.assertEqual(
+            [(b['count'], b['min'], b['max'], b['mean'], b['last']) for b in body['series']['pH']],
+            [(2, 7.0, 8.0, 7.5, 8.0), (1, 6.0, 6.0, 6.0, 6.0)]
+        )
+        hour = SensorReadingRollup.objects.get(parameter='pH', resolution='1h')
+        self.assertEqual((hour.count, hour.min_value, hour.max_value, hour.last_value), (3, 6.0, 8.0, 6.0))
+
+    def test_aggregate_rejects_unknown_parameters(self):
+        Device.objects.create(name='dev1')
+        response = self.client.get(reverse('sensorreading-aggregate'), {'device': 'dev1', 'parameter': 'salinity'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_backfill_needs_postgres(self):
+        with self.assertRaises(CommandError):
+            call_command('backfill_rollups')
+
+
+# --- Reading API ---
+class ReadingListTests(IngestTestCase):
+    def store(self, count, device='dev1', **values):
+        ingest.write_batch([
+            {'device_name': device, 'payload': {'ph': 7.0, **values, 'timestamp': 1718000000 + i}} for i in range(count)
+        ])
+
+    def get(self, url=None, **params):
+        response = self.client.get(url or reverse('sensorreading-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_walk_back_by_cursor(self):
+        self.store(5)
+        first = self.get(page_size=2)
+        second = self.get(first['next'])
+        last = self.get(second['next'])
+        back = self.get(second['previous'])
+
+        timestamps = [row['timestamp'] for page in (first, second, last) for row in page['results']]
+        self.assertEqual(timestamps, sorted(timestamps, reverse=True))
+        self.assertEqual(len(set(timestamps)), 5)
+        self.assertIsNone(last['next'])
+        self.assertEqual(back['results'], first['results'])
+
+    def test_filters_and_fields(self):
+        self.store(3)
+        self.store(2, device='dev2', temperature=18.0)
+        start = datetime.fromtimestamp(1718000001, dt_timezone.utc).isoformat()
+
+        rows = self.get(device='dev2', sensor_type='TEMP', start=start, fields='device,temperature')['results']
+
+        self.assertEqual(rows, [{'device': 'dev2', 'temperature': 18.0}])
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        self.store(3)
+        self.store(3, device='dev2')
+        with self.assertNumQueries(2):   # the page, then the device names
+            self.assertEqual(len(self.get()['results']), 6)
+
+    def test_bad_fields_and_cursors_are_rejected(self):
+        self.assertEqual(self.client.get(reverse('sensorreading-list'), {'fields': 'pH,salinity'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('sensorreading-list'), {'cursor': 'garbage'}).status_code, 404)
+
+    def test_list_carries_the_sequence(self):
+        ingest.write_batch([{'device_name': 'dev1', 'payload': {'ph': 7.1, 'timestamp': 1718000000, 'seq': 9}}])
+
+        response = self.client.get(reverse('sensorreading-list'), {'fields': 'timestamp,sequence,pH'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['sequence'], 9)
+
+
+# --- Insert path ---
+class WriteBatchTests(IngestTestCase):
+    def test_untimestamped_messages_arriving_together_are_all_stored(self):
+        received = time.time()
+        messages = [
+            {'device_name': 'dev1', 'payload': {'ph': 7.0}, 'received_at': received},
+            {'device_name': 'dev1', 'payload': {'ph': 7.5}, 'received_at': received},
+        ]
+
+        ingest.write_batch(messages)
+
+        self.assertEqual(list(SensorReading.objects.order_by('timestamp').values_list('pH', flat=True)), [7.0, 7.5])
+        self.assertEqual([message['duplicate'] for message in messages], [False, False])
+
+    def test_redelivered_message_in_the_same_batch_is_a_duplicate(self):
+        payload = {'ph': 7.0, 'timestamp': 1718000000, 'seq': 4}
+        messages = [{'device_name': 'dev1', 'payload': dict(payload)}, {'device_name': 'dev1', 'payload': dict(payload)}]
+
+        ingest.write_batch(messages)
+
+        self.assertEqual(SensorReading.objects.count(), 1)
+        self.assertEqual([message['duplicate'] for message in messages], [False, True])
+
+    def test_device_timestamp_and_sequence_are_stored(self):
+        ingest.write_batch([
+            {'device_name': 'dev1', 'payload': {'ph': 7.0, 'timestamp': '2024-06-10T08:00:00Z', 'seq': 1}},
+            {'device_name': 'dev1', 'payload': {'ph': 7.1, 'timestamp': '2024-06-10T08:00:00Z', 'seq': 2}},
+        ])
+
+        self.assertEqual(
+            list(SensorReading.objects.order_by('sequence').values_list('timestamp', 'sequence')),
+            [(datetime(2024, 6, 10, 8, tzinfo=dt_timezone.utc), 1), (datetime(2024, 6, 10, 8, tzinfo=dt_timezone.utc), 2)]
+        )
+
+    def test_redelivery_in_a_later_batch_is_stored_once(self):
+        payload = {'ph': 7.0, 'timestamp': 1718000000, 'seq': 4}
+        ingest.write_batch([{'device_name': 'dev1', 'payload': dict(payload)}])
+        redelivered = [{'device_name': 'dev1', 'payload': dict(payload)}]
+
+        self.assertEqual(ingest.write_batch(redelivered), [])
+        self.assertTrue(redelivered[0]['duplicate'])
+        self.assertEqual(SensorReading.objects.count(), 1)
+
+    def test_device_clock_far_in_the_future_falls_back_to_arrival(self):
+        received = time.time()
+        future = received + 86400
+        with self.settings(INGEST_MAX_CLOCK_SKEW=300):
+            ingest.write_batch([{'device_name': 'dev1', 'payload': {'ph': 7.0, 'timestamp': future}, 'received_at': received}])
+
+        self.assertAlmostEqual(SensorReading.objects.get().timestamp.timestamp(), received, places=3)
+
+    def test_decoded_messages_carry_their_own_arrival_time(self):
+        first = telemetry_record('dev1', {'ph': 7.0})
+        second = decode_record('devices/dev1/telemetry', b'{"ph": 7.5}')
+        self.assertLessEqual(first['received_at'], second['received_at'])
+
+
+# --- Codecs ---
+class PayloadValidationTests(SimpleTestCase):
+    def test_single_reading_with_non_numeric_value_is_rejected(self):
+        with self.assertRaises(CodecError):
+            telemetry_record('dev1', {'ph': 'abc', 'timestamp': 1718000000})
+        with self.assertRaises(CodecError):
+            decode_record('devices/dev1/telemetry', b'{"temperature": true}')
+
+    def test_batch_with_unusable_timestamp_is_rejected(self):
+        future = (timezone.now() + timedelta(hours=1)).isoformat()
+        for timestamp in ('yesterday', future):
+            with self.assertRaises(CodecError):
+                telemetry_record('dev1', {'samples': [
+                    {'timestamp': 1718000000, 'ph': 7.1},
+                    {'timestamp': timestamp, 'ph': 7.2},
+                ]})
+
+    def test_single_reading_passes_through(self):
+        record = telemetry_record('dev1', {'ph': 7.1, 'temperature': 21})
+        self.assertEqual(record['payload'], {'ph': 7.1, 'temperature': 21})
+
+
+
+class CodecTests(SimpleTestCase):
+    payload = {'seq': 3, 'timestamp': 1718000000000, 'ph': 7.25, 'temperature': 18.5}
+
+    def test_codec_is_chosen_by_topic_suffix(self):
+        import cbor2
+        import msgpack
+
+        encoded = {
+            'devices/dev1/telemetry': json.dumps(self.payload).encode(),
+            'devices/dev1/telemetry/msgpack': msgpack.packb(self.payload),
+            'devices/dev1/telemetry/cbor': cbor2.dumps(self.payload),
+            'devices/dev1/telemetry/struct': encode_struct(self.payload),
+        }
+        for topic, data in encoded.items():
+            record = decode_record(topic, data)
+            self.assertEqual(record['device_name'], 'dev1', topic)
+            self.assertEqual(record['payload'], self.payload, topic)
+
+    def test_content_type_wins_over_the_topic(self):
+        data = encode_struct(self.payload)
+        self.assertEqual(decode_record('devices/dev1/telemetry', data, 'application/vnd.river.packed')['payload'], self.payload)
+        with self.assertRaises(CodecError):
+            decode_record('devices/dev1/telemetry', data, 'text/csv')
+
+    def test_packed_payloads_are_checked(self):
+        data = encode_struct(self.payload)
+        for broken in (b'', data[:-1], bytes([9]) + data[1:]):
+            with self.assertRaises(CodecError):
+                decode_record('devices/dev1/telemetry/struct', broken)
+
+    def test_column_batches_become_samples(self):
+        record = telemetry_record('dev1', {'site': 'weir', 'columns': {
+            'timestamp': [1718000000, 1718000060], 'ph': [7.1, 7.2],
+        }})
+        self.assertEqual(payload_samples(record['payload']), [
+            {'site': 'weir', 'timestamp': 1718000000, 'ph': 7.1},
+            {'site': 'weir', 'timestamp': 1718000060, 'ph': 7.2},
+        ])
+
+
+# --- Export ---
+class ExportTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        device = Device.objects.create(name='dev1')
+        start = timezone.now() - timedelta(hours=1)
+        SensorReading.objects.bulk_create([
+            SensorReading(device=device, timestamp=start + timedelta(seconds=i), pH=7.0 + i / 10) for i in range(5)
+        ])
+
+    async def test_asgi_export_streams_asynchronously(self):
+        response = await self.async_client.get(
+            '/api/sensor-readings/export/', {'format': 'csv', 'parameter': 'pH'}
+        )
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        lines = content.splitlines()
+        self.assertEqual(lines[0], 'id,timestamp,device,pH')
+        self.assertEqual(len(lines), 6)
+
+
+# --- Dashboard feed ---
+class SensorFeedTests(SimpleTestCase):
+    def setUp(self):
+        self.consumer = SensorDataConsumer()
+        self.consumer.interval, self.consumer.batch = 0, False
+        self.consumer.pending, self.consumer.last_sent, self.consumer.flush_task = {}, {}, None
+        self.consumer.parameters = frozenset({'ph'})
+        self.consumer.groups_joined = {'sensors.device.1', 'sensors.region.north'}
+        self.consumer.recent_events, self.consumer.recent_event_ids = deque(maxlen=256), set()
+        self.sent = []
+
+        async def send(text_data=None, bytes_data=None):
+            self.sent.append(text_data)
+
+        self.consumer.send = send
+
+    def test_event_from_device_and_region_group_is_sent_once_and_trimmed(self):
+        event = sensor_event('dev1', {'ph': 7.1, 'temperature': 20.0, 'timestamp': '2024-06-10T00:00:00+00:00'})
+        for _ in range(2):   # delivered through both groups
+            async_to_sync(self.consumer.send_sensor_data)(dict(event))
+
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(json.loads(self.sent[0])['data'], {'ph': 7.1})
+
+
+    def events(self, *values):
+        return [sensor_event(name, {'ph': ph, 'timestamp': '2024-06-10T00:00:00+00:00'}) for name, ph in values]
+
+    def test_updates_are_coalesced_to_the_latest_per_device(self):
+        self.consumer.interval, self.consumer.parameters = 0.05, frozenset()
+        events = self.events(('dev1', 7.0), ('dev1', 7.1), ('dev1', 7.2))
+
+        async def deliver():
+            for event in events:
+                await self.consumer.send_sensor_data(event)
+            await asyncio.sleep(0.1)
+
+        async_to_sync(deliver)()
+
+        # The first goes out at once, forwarded as serialized by ingest; then only the newest
+        self.assertEqual(self.sent, [events[0]['text'], events[2]['text']])
+
+    def test_batching_client_gets_one_frame_for_all_devices(self):
+        self.consumer.interval, self.consumer.parameters = 0.05, frozenset()
+
+        async def deliver():
+            await self.consumer.configure({'batch': True, 'interval': 0.01})
+            for event in self.events(('dev1', 7.0), ('dev2', 6.5), ('dev1', 7.1)):
+                await self.consumer.send_sensor_data(event)
+            await asyncio.sleep(0.3)
+
+        with self.settings(SENSOR_BROADCAST_MIN_INTERVAL=0.1):
+            async_to_sync(deliver)()
+
+        configured, frame = map(json.loads, self.sent)
+        self.assertEqual((configured['interval'], configured['batch']), (0.1, True))   # clamped to the minimum
+        self.assertEqual(frame['type'], 'sensor_batch')
+        self.assertEqual([(item['device_id'], item['data']['ph']) for item in frame['items']], [('dev1', 7.1), ('dev2', 6.5)])
+
+
+# --- Dashboard snapshot ---
+class SnapshotTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        for name in ('dev1', 'dev2'):
+            Device.objects.create(name=name)
+
+    def test_flush_publishes_per_device_and_drops_the_snapshot(self):
+        get_snapshot().update({'dev1': '{"device_id": "dev1"}', 'dev2': '{"device_id": "dev2"}'})
+        cache.set(SNAPSHOT_KEY, 'stale')
+        get_snapshot().update({'dev2': '{"device_id": "dev2", "v": 2}'})
+
+        self.assertIsNone(cache.get(SNAPSHOT_KEY))
+        text = async_to_sync(SensorDataConsumer().load_snapshot)()
+        self.assertEqual(json.loads(text)['items'], [{'device_id': 'dev1'}, {'device_id': 'dev2', 'v': 2}])
+        self.assertEqual(cache.get(SNAPSHOT_KEY), text)
+
+    def test_rebuild_during_live_ingest_does_not_query_the_database(self):
+        get_snapshot().update({'dev1': '{"device_id": "dev1"}'})
+        async_to_sync(SensorDataConsumer().load_snapshot)()
+        Device.objects.create(name='dev0')
+
+        with self.assertNumQueries(0):
+            get_snapshot().update({'dev0': '{"device_id": "dev0"}', 'dev2': '{"device_id": "dev2"}'})
+            text = async_to_sync(SensorDataConsumer().load_snapshot)()
+        self.assertEqual([item['device_id'] for item in json.loads(text)['items']], ['dev0', 'dev1', 'dev2'])
+
+    def test_deleted_device_leaves_the_snapshot(self):
+        get_snapshot().update({'dev1': '{"device_id": "dev1"}', 'dev2': '{"device_id": "dev2"}'})
+        async_to_sync(SensorDataConsumer().load_snapshot)()
+        Device.objects.filter(name='dev2').get().delete()
+
+        text = async_to_sync(SensorDataConsumer().load_snapshot)()
+        self.assertEqual([item['device_id'] for item in json.loads(text)['items']], ['dev1'])
+
+    def test_cold_snapshot_is_built_once_for_concurrent_clients(self):
+        get_snapshot().update({'dev1': '{"device_id": "dev1"}'})
+        consumer = SensorDataConsumer()
+        builds = []
+        build = consumer.build_snapshot
+
+        async def counting_build():
+            builds.append(1)
+            await asyncio.sleep(0.05)
+            return await build()
+
+        consumer.build_snapshot = counting_build
+
+        async def connect_many():
+            return await asyncio.gather(*(consumer.load_snapshot() for _ in range(5)))
+
+        texts = async_to_sync(connect_many)()
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(len(set(texts)), 1)
+
+
+# --- Published metrics ---
+class IngestStatsTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_stats_are_read_from_the_cache_without_starting_anything(self):
+        pipeline, tracker = ingest._pipeline, presence._presence
+        response = self.client.get('/api/ingest/stats/')
+        self.assertEqual(response.json(), {'workers': []})
+        self.assertIs(ingest._pipeline, pipeline)
+        self.assertIs(presence._presence, tracker)
+
+    def test_expired_workers_drop_out(self):
+        ingest.publish_metrics('worker-1', 'worker', {'written': 5}, 10)
+        ingest.publish_metrics('worker-2', 'worker', {'written': 7}, 10)
+        cache.delete(ingest.metrics_key('worker-1'))
+
+        workers = self.client.get('/api/ingest/stats/').json()['workers']
+        self.assertEqual([(w['worker_id'], w['ingest']['written']) for w in workers], [('worker-2', 7)])
+        self.assertEqual(cache.get(ingest.METRICS_WORKERS_KEY), ['worker-2'])
+
+
+# --- Hash partitioning ---
+DEVICES = [f'dev{i}' for i in range(200)]
+
+
+class RendezvousPartitionerTests(SimpleTestCase):
+    def test_workers_agree_on_one_owner_per_device(self):
+        a, b = RendezvousPartitioner('a'), RendezvousPartitioner('b')
+        a.heartbeat('b')
+        b.heartbeat('a')
+
+        self.assertEqual([a.owner(name) for name in DEVICES], [b.owner(name) for name in DEVICES])
+        owned = sum(a.owns(name) for name in DEVICES)
+        self.assertEqual(owned + sum(b.owns(name) for name in DEVICES), len(DEVICES))
+        self.assertTrue(0 < owned < len(DEVICES))
+
+    def test_joining_worker_only_takes_devices_over(self):
+        partitioner = RendezvousPartitioner('a')
+        partitioner.heartbeat('b')
+        before = {name: partitioner.owner(name) for name in DEVICES}
+
+        partitioner.heartbeat('c')
+        moved = [name for name in DEVICES if partitioner.owner(name) != before[name]]
+
+        self.assertTrue(moved)
+        self.assertTrue(all(partitioner.owner(name) == 'c' for name in moved))
+        self.assertEqual(partitioner.rebalances, 2)
+
+    def test_silent_worker_is_swept_and_its_devices_move(self):
+        partitioner = RendezvousPartitioner('a', timeout=30)
+        partitioner.heartbeat('b')
+        owned_by_b = [name for name in DEVICES if partitioner.owner(name) == 'b']
+
+        partitioner.members['b'] -= 60
+        self.assertEqual(partitioner.sweep(), ['b'])
+        self.assertTrue(all(partitioner.owns(name) for name in owned_by_b))
+
+    def test_membership_messages(self):
+        service = make_service(partition='hash', client_id='a')
+        topic = 'river/ingest/workers/b'
+
+        # A retained announcement of a worker that died without its will
+        service._membership(topic, json.dumps({'ts': time.time() - 3600}).encode())
+        self.assertEqual(set(service.partitioner.members), {'a'})
+
+        service._membership(topic, json.dumps({'ts': time.time()}).encode())
+        self.assertEqual(set(service.partitioner.members), {'a', 'b'})
+        service._membership(topic, b'')
+        self.assertEqual(set(service.partitioner.members), {'a'})
+
+
+class Disconnected(Exception):
+    pass
+
+
+class FakeClient:
+    """Stands in for aiomqtt.Client: one retained peer heartbeat, then the connection drops."""
+    instances = []
+
+    def __init__(self, service):
+        self.service = service
+        self.subscribed = []
+        self.members_at_data_subscribe = None
+        FakeClient.instances.append(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def subscribe(self, topic, qos=0):
+        if not topic.startswith('river/ingest/workers') and self.members_at_data_subscribe is None:
+            self.members_at_data_subscribe = set(self.service.partitioner.members)
+        self.subscribed.append(topic)
+
+    async def publish(self, topic, payload, qos=0, retain=False):
+        pass
+
+    @property
+    def messages(self):
+        return self._messages()
+
+    async def _messages(self):
+        yield SimpleNamespace(
+            topic='river/ingest/workers/b', payload=json.dumps({'ts': time.time()}).encode(), properties=None
+        )
+        await asyncio.sleep(0.2)
+        raise Disconnected()
+
+
+class HashWorkerStartupTests(SimpleTestCase):
+    def test_membership_is_known_before_telemetry_is_subscribed(self):
+        service = make_service(partition='hash', client_id='a', heartbeat_interval=0.05)
+        fake_aiomqtt = SimpleNamespace(
+            Client=lambda **options: FakeClient(service),
+            MqttError=ConnectionError,
+            ProtocolVersion=SimpleNamespace(V5=5, V311=4),
+            Will=lambda *args, **kwargs: None,
+        )
+        FakeClient.instances.clear()
+        with self.assertRaises(Disconnected):
+            async_to_sync(service._read_loop)(fake_aiomqtt)
+
+        client = FakeClient.instances[0]
+        self.assertEqual(client.subscribed, ['river/ingest/workers/+', *service.topics, service.status_topic])
+        self.assertEqual(client.members_at_data_subscribe, {'a', 'b'})
+
+    def test_failed_data_subscribe_reconnects(self):
+        service = make_service(partition='hash', client_id='a', heartbeat_interval=0.05)
+        service.reconnect_delay = 0
+        clients = []
+
+        def connect(**options):
+            if clients:
+                raise Disconnected()   # the reconnect attempt ends the test
+            clients.append(RejectingClient(service))
+            return clients[0]
+
+        fake_aiomqtt = SimpleNamespace(
+            Client=connect,
+            MqttError=ConnectionError,
+            ProtocolVersion=SimpleNamespace(V5=5, V311=4),
+            Will=lambda *args, **kwargs: None,
+        )
+        with self.assertRaises(Disconnected):
+            async_to_sync(asyncio.wait_for)(service._read_loop(fake_aiomqtt), 5)
+        self.assertEqual(len(clients), 1)
+
+
+class RejectingClient(FakeClient):
+    """The broker refuses the telemetry subscription; the connection itself stays up."""
+
+    async def subscribe(self, topic, qos=0):
+        if not topic.startswith('river/ingest/workers'):
+            raise ConnectionError('not authorized')
+        await super().subscribe(topic, qos)
+
+    async def _messages(self):
+        await asyncio.sleep(10)
+        yield
+
+
+# --- Spool replay ---
+class SpoolReplayTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.spool = IngestSpool(self.path)
+        self.service = make_service(spool=self.spool)
+
+    def tearDown(self):
+        self.spool.close()
+        os.remove(self.path)
+
+    def test_a_spool_can_only_be_opened_by_one_worker(self):
+        with self.assertRaises(sqlite3.OperationalError):
+            IngestSpool(self.path)
+
+    def test_restarted_worker_replays_its_predecessors_spool(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'ingest-spool-{worker_id}.sqlite3')
+        with self.settings(INGEST_SPOOL_PATH=path):
+            crashed = AsyncIngestService.from_settings()
+            crashed.spool.append([{'device_name': 'dev1', 'payload': {'ph': 7.1, 'timestamp': 1718000000}}])
+            crashed.spool.close()
+
+            restarted = AsyncIngestService.from_settings()
+        try:
+            self.assertEqual(restarted.spool.path, crashed.spool.path)
+            position, batch = restarted.spool.read(10)
+            restarted._replay_one_by_one(batch)
+            restarted.spool.ack(position)
+        finally:
+            restarted.spool.close()
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+        self.assertEqual(list(SensorReading.objects.values_list('pH', flat=True)), [7.1])
+
+    def test_bad_message_is_dead_lettered_and_the_rest_stored(self):
+        self.spool.append([
+            {'device_name': 'dev1', 'payload': {'ph': 7.1, 'timestamp': 1718000000, 'seq': 1}},
+            {'device_name': 'dev1', 'payload': {'ph': 'abc', 'timestamp': 1718000001, 'seq': 2}},
+            {'device_name': 'dev1', 'payload': {'ph': 7.3, 'timestamp': 1718000002, 'seq': 3}},
+        ])
+        position, batch = self.spool.read(10)
+
+        self.service._replay_one_by_one(batch)
+        self.spool.ack(position)
+
+        self.assertEqual(sorted(SensorReading.objects.values_list('pH', flat=True)), [7.1, 7.3])
+        self.assertEqual(self.spool.dead_letters(), 1)
+        self.assertEqual(self.spool.depth(), 0)
+        self.assertEqual(self.service.stats.dead_lettered, 1)
+
+
+# --- Series ---
+class SeriesTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.base = 1718000000 - 1718000000 % 3600
+        ingest.write_batch([
+            {'device_name': 'dev1', 'payload': {'ph': 7.0 + (i % 10) / 10, 'timestamp': self.base + i}}
+            for i in range(200)
+        ])
+        self.device = Device.objects.get(name='dev1')
+
+    def window(self):
+        return (datetime.fromtimestamp(self.base, dt_timezone.utc),
+                datetime.fromtimestamp(self.base + 200, dt_timezone.utc))
+
+    def fetch(self, **params):
+        start, end = self.window()
+        params.setdefault('parameter', 'pH')
+        params.setdefault('start', start.isoformat())
+        params.setdefault('end', end.isoformat())
+        return self.client.get(reverse('device-series', args=[self.device.pk]), params)
+
+    def test_lttb_keeps_the_ends_and_the_spikes(self):
+        t = np.arange(100, dtype=np.float64)
+        y = np.zeros(100)
+        y[50] = 9.0
+        picks = series.lttb(t, y, 10)
+        self.assertEqual(len(picks), 10)
+        self.assertEqual((picks[0], picks[-1]), (0, 99))
+        self.assertIn(50, picks)
+        self.assertTrue((np.diff(picks) > 0).all())
+        self.assertEqual(list(series.lttb(t, y, 500)), list(range(100)))
+
+    def test_decimators_bound_the_points(self):
+        columns = series.raw_columns(self.device, ['pH'], *self.window(), max_rows=1000)['pH']
+        t0, t1 = self.base, self.base + 200
+        envelope = series.decimate_minmax(columns, 10, t0, t1)
+        self.assertEqual(len(envelope['t']), 5)
+        self.assertEqual((min(envelope['min']), max(envelope['max'])), (7.0, 7.9))
+        means = series.decimate_mean(columns, 20, t0, t1)
+        self.assertEqual(len(means['v']), 20)
+        self.assertAlmostEqual(means['v'][0], 7.45)
+
+    def test_raw_readings_are_decimated_to_the_requested_points(self):
+        body = self.fetch(points=20).json()
+        self.assertEqual(body['source'], 'raw')
+        pH = body['series']['pH']
+        self.assertEqual((len(pH['t']), len(pH['v']), pH['samples']), (20, 20, 200))
+        self.assertEqual((pH['t'][0], pH['t'][-1]), (self.base * 1000, (self.base + 199) * 1000))
+
+    def test_long_ranges_come_from_rollups(self):
+        body = self.fetch(start=datetime.fromtimestamp(self.base - 7 * 86400, dt_timezone.utc).isoformat(),
+                          method='mean', points=50).json()
+        self.assertTrue(body['source'].startswith('rollup:'))
+        self.assertEqual(body['series']['pH']['samples'], 200)
+
+    def test_too_many_raw_rows_fall_back_to_rollups(self):
+        with self.settings(SERIES_RAW_MAX_ROWS=100):
+            self.assertTrue(self.fetch().json()['source'].startswith('rollup:'))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.fetch(method='spline').status_code, 400)
+        self.assertEqual(self.fetch(parameter='salinity').status_code, 400)
+        self.assertEqual(self.fetch(points=0).status_code, 400)
+        self.assertEqual(self.fetch(start='yesterday').status_code, 400)
+
+# --- Device state ---
+class DeviceStateTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.base = 1718000000
+
+    def ingest(self, offset, **payload):
+        ingest.write_batch([{'device_name': 'dev1', 'payload': {'timestamp': self.base + offset, **payload}}])
+
+    def test_ingest_keeps_the_newest_values(self):
+        self.ingest(10, ph=7.0, temperature=18.0)
+        self.ingest(20, ph=7.5)
+        self.ingest(5, ph=6.0, turbidity=3.0)   # late: only fills what is missing
+
+        state = DeviceState.objects.get(device__name='dev1')
+        self.assertEqual((state.pH, state.temperature, state.turbidity), (7.5, 18.0, 3.0))
+        self.assertEqual(state.timestamp, datetime.fromtimestamp(self.base + 20, dt_timezone.utc))
+
+    def test_fleet_overview_runs_a_constant_number_of_queries(self):
+        for i in range(5):
+            ingest.write_batch([{'device_name': f'dev{i}', 'payload': {'ph': 7.0 + i, 'timestamp': self.base}}])
+        url = reverse('device-list')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'include': 'state'})
+        devices = {device['name']: device for device in response.json()}
+        self.assertEqual(devices['dev3']['state']['pH'], 10.0)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertNotIn('state', response.json()[0])
+
+# --- Presence ---
+class PresenceTrackerTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()   # presence:<name> last-seen times of earlier tests
+        self.device = Device.objects.create(name='dev1', is_online=True)
+        DeviceState.objects.create(device=self.device, last_seen=timezone.now() - timedelta(minutes=10))
+
+    def is_online(self):
+        return Device.objects.get(pk=self.device.pk).is_online
+
+    def test_only_the_sweeping_process_marks_devices_offline(self):
+        web = PresenceTracker(timeout=60)
+        worker = PresenceTracker(timeout=60, sweep=True)
+
+        web.run_once()
+        self.assertTrue(self.is_online())
+
+        worker.run_once()
+        self.assertFalse(self.is_online())
+        self.assertEqual(worker.counters['transitions'], 1)
+
+    def test_sweeper_goes_by_last_seen_flushed_by_other_processes(self):
+        receiving = PresenceTracker(timeout=60)
+        worker = PresenceTracker(timeout=60, sweep=True)
+        worker.run_once()   # remembers the old last_seen in memory
+        Device.objects.filter(pk=self.device.pk).update(is_online=True)
+
+        receiving.seen({'dev1': time.time()})
+        receiving.run_once()
+        worker.run_once()
+
+        self.assertTrue(self.is_online())
+        self.assertEqual(receiving.counters['transitions'], 0)
+
+
+    def test_incremental_reload_picks_up_devices_brought_online_elsewhere(self):
+        receiving = PresenceTracker(timeout=60)
+        worker = PresenceTracker(timeout=60, sweep=True)
+        worker.run_once()
+        self.assertFalse(self.is_online())
+
+        receiving.seen({'dev1': time.time()})
+        receiving.run_once()
+        worker.run_once()
+
+        self.assertTrue(self.is_online())
+        self.assertTrue(worker._online['dev1'])
+
+    def test_failed_flush_keeps_its_transitions(self):
+        tracker = PresenceTracker(timeout=60)
+        tracker.status('dev1', False)
+        with mock.patch('device.presence.set_online', side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError):
+                tracker.flush()
+        self.assertTrue(self.is_online())
+
+        self.assertEqual(tracker.flush(), [('dev1', False)])
+        self.assertFalse(self.is_online())
+
+    def test_unknown_devices_are_not_created(self):
+        tracker = PresenceTracker(timeout=60)
+        tracker.seen({'dev1': time.time(), 'ghost': time.time()})
+        tracker.status('ghost', True)
+
+        tracker.flush()
+
+        self.assertFalse(Device.objects.filter(name='ghost').exists())
+        self.assertGreater(DeviceState.objects.get(device=self.device).last_seen, timezone.now() - timedelta(minutes=1))
+
+
+# --- Streaming device acks ---
+class StreamAckTests(SimpleTestCase):
+    def setUp(self):
+        self.consumer = DeviceConsumer()
+        self.consumer.channel_name = 'test.channel'
+        self.consumer.device_name, self.consumer.codec = 'dev1', 'json'
+        self.consumer.ack_every = 1
+        self.consumer.acked_seq = self.consumer.highest_seq = None
+        self.consumer.queued, self.consumer.failed = set(), set()
+        self.consumer.settled, self.consumer.rejected, self.consumer.newly_failed = 0, [], []
+        self.consumer.ack_task = None
+        self.consumer.submitted = []
+        self.consumer.acks = []
+
+        async def submit(record):
+            self.consumer.submitted.append(record)
+            return True
+
+        async def send_frame(data):
+            self.consumer.acks.append(data)
+
+        self.consumer.submit = submit
+        self.consumer.send_frame = send_frame
+
+    def stream(self, *seqs):
+        for seq in seqs:
+            frame = {'seq': seq, 'timestamp': 1718000000 + seq, 'ph': 7.0}
+            async_to_sync(self.consumer.receive_stream)(json.dumps(frame), None)
+
+    def ack(self):
+        return self.consumer.acks[-1]
+
+    def test_ack_covers_only_stored_frames(self):
+        self.stream(1, 2, 3)
+        self.assertEqual(self.consumer.submitted[0]['reply_channel'], 'test.channel')
+
+        async_to_sync(self.consumer.stream_stored)({'seqs': [1, 3]})
+        self.assertEqual(self.ack()['seq'], 1)
+
+        async_to_sync(self.consumer.stream_stored)({'seqs': [2]})
+        self.assertEqual(self.ack()['seq'], 3)
+
+    def test_failed_frame_holds_the_ack_until_resent(self):
+        self.stream(1, 2, 3)
+        async_to_sync(self.consumer.stream_stored)({'seqs': [1, 3]})
+        async_to_sync(self.consumer.stream_failed)({'seqs': [2]})
+        ack = self.ack()
+        self.assertEqual((ack['seq'], ack['failed']), (1, [2]))
+
+        self.stream(2)
+        async_to_sync(self.consumer.stream_stored)({'seqs': [2]})
+        self.assertEqual(self.ack()['seq'], 3)
+
+    def test_frames_without_timestamp_are_rejected(self):
+        async_to_sync(self.consumer.receive_stream)(json.dumps({'seq': 1, 'ph': 7.0}), None)
+        ack = self.ack()
+        self.assertEqual((ack['seq'], ack['rejected'][0]['seq']), (None, 1))
+        self.assertEqual(self.consumer.submitted, [])
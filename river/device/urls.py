@@ -6,7 +6,9 @@ from device.views import (
     MQTTBrokerViewSet,
     set_active_broker,
     toggle_manual_mode,
-    get_sensor_schema
+    get_sensor_schema,
+    export_sensor_readings,
+    ingest_stats
 )
 
 # REST API Router setup
@@ -16,12 +18,18 @@ router.register(r'sensor-readings', SensorReadingViewSet)
 router.register(r'mqtt-brokers', MQTTBrokerViewSet)
 
 urlpatterns = [
+    # Streaming export (before the router so "export" isn't taken for a reading pk)
+    path('api/sensor-readings/export/', export_sensor_readings, name='sensor-readings-export'),
+
     # Main API routes
     path('api/', include(router.urls)),
 
     # Custom API endpoint for dynamic Sensor schema
     path('api/sensors/schema/', get_sensor_schema, name='sensor-schema'),
 
+    # Ingest queue depth and flush latency counters
+    path('api/ingest/stats/', ingest_stats, name='ingest-stats'),
+
     # Admin endpoints for broker and manual mode toggle
     path('admin/set-active-broker/<int:broker_id>/', set_active_broker, name='set-active-broker'),
     path('admin/toggle-manual-mode/<int:pk>/', toggle_manual_mode, name='toggle-manual-mode'),
@@ -1,11 +1,11 @@
+from device.codecs import telemetry_record
+from device.ingest import ingest_now
 
-from django.utils import timezone
 
-
-def save_sensor_data(data):
-    from device.models import Device, SensorType, Sensor, SensorReading
-    device, _ = Device.objects.get_or_create(name=device_name)
-    for sensor_key, value in payload.items():
-        sensor_type, _ = SensorType.objects.get_or_create(name=sensor_key)
-        sensor, _ = Sensor.objects.get_or_create(device=device, sensor_type=sensor_type)
-        SensorReading.objects.create(sensor=sensor, value=value, timestamp=timezone.now())
+def save_sensor_data(device_name, payload):
+    # Synchronous adapter over the shared ingest core: validated like any
+    # transport's payload, stored, cached and broadcast before returning.
+    # Returns the record, now carrying its device_id and duplicate flag.
+    record = telemetry_record(device_name, payload)
+    ingest_now([record])
+    return record
@@ -1,27 +1,228 @@
-from rest_framework import viewsets
+from datetime import timedelta
+
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from django.conf import settings
 from django.shortcuts import redirect, get_object_or_404
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.apps import apps
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from device.models import Device, SensorReading, MQTTBroker
+from device.models import Device, Sensor, SensorReading, SensorReadingRollup, MQTTBroker
+from device.filters import SensorReadingFilter
+from device.pagination import TimestampKeysetPagination
 from device.serializers import (
     DeviceSerializer,
     SensorReadingSerializer,
+    SensorReadingListSerializer,
     MQTTBrokerSerializer
 )
 
 
+# --- Query Param Helpers ---
+
+def lookup_device(value):
+    """Find a device by primary key or name."""
+    if not value:
+        return None
+    lookup = {'pk': value} if value.isdigit() else {'name': value}
+    return Device.objects.filter(**lookup).first()
+
+
+def parse_moment(value):
+    """Parse an ISO 8601 query param into an aware datetime (None if absent)."""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        raise ValueError(f"Invalid date/time: {value}")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def attach_related_names(rows):
+    """Add device_name/sensor_name to values() rows with one query per related table."""
+    device_ids = {row['device_id'] for row in rows if row.get('device_id')}
+    sensor_ids = {row['sensor_id'] for row in rows if row.get('sensor_id')}
+    devices = dict(Device.objects.filter(pk__in=device_ids).values_list('pk', 'name')) if device_ids else {}
+    sensors = dict(Sensor.objects.filter(pk__in=sensor_ids).values_list('pk', 'name')) if sensor_ids else {}
+    for row in rows:
+        row['device_name'] = devices.get(row.get('device_id'))
+        row['sensor_name'] = sensors.get(row.get('sensor_id'))
+    return rows
+
+
 # --- REST API ViewSets ---
 
 class DeviceViewSet(viewsets.ModelViewSet):
+    """Devices with their sensors; ?include=state adds each device's latest values from DeviceState."""
     queryset = Device.objects.all()
     serializer_class = DeviceSerializer
 
+    def get_include(self):
+        return {part.strip() for part in self.request.query_params.get('include', '').split(',') if part.strip()}
+
+    def get_queryset(self):
+        # Constant query count for the fleet overview: one for devices (+ state), one for all sensors
+        queryset = Device.objects.prefetch_related('sensors')
+        if 'state' in self.get_include():
+            queryset = queryset.select_related('state')
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['include'] = self.get_include()
+        return context
+
+    @action(detail=True, methods=['get'])
+    def series(self, request, pk=None):
+        """
+        Chart-ready series, decimated on the server.
+
+        Query params: parameter (comma separated SensorReading fields),
+        start/end (ISO 8601, default last 24h), points (per parameter,
+        capped at SERIES_MAX_POINTS) and method: ``lttb`` (default),
+        ``minmax`` (min/max envelope) or ``mean`` (bucket mean). Times are
+        epoch milliseconds.
+        """
+        from device.series import SERIES_METHODS, SeriesError, build_series
+
+        device = self.get_object()
+
+        parameters = [p for p in request.query_params.get('parameter', '').split(',') if p]
+        unknown = set(parameters) - set(SensorReading.MEASUREMENT_FIELDS)
+        if not parameters or unknown:
+            return Response(
+                {'error': f"parameter must be a comma separated list of {', '.join(SensorReading.MEASUREMENT_FIELDS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        method = request.query_params.get('method', 'lttb')
+        try:
+            end = parse_moment(request.query_params.get('end')) or timezone.now()
+            start = parse_moment(request.query_params.get('start')) or end - timedelta(hours=24)
+            points = int(request.query_params.get('points', getattr(settings, 'SERIES_DEFAULT_POINTS', 500)))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if start >= end or points < 1:
+            return Response({'error': 'start must be before end and points positive'}, status=status.HTTP_400_BAD_REQUEST)
+        points = min(points, getattr(settings, 'SERIES_MAX_POINTS', 5000))
+
+        try:
+            source, series = build_series(device, list(dict.fromkeys(parameters)), start, end, points, method)
+        except SeriesError as e:
+            return Response({'error': str(e), 'methods': SERIES_METHODS}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'device': device.name,
+            'method': method,
+            'source': source,
+            'points': points,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'series': series,
+        })
+
 
 class SensorReadingViewSet(viewsets.ModelViewSet):
     queryset = SensorReading.objects.all()
     serializer_class = SensorReadingSerializer
+    pagination_class = TimestampKeysetPagination
+    filterset_class = SensorReadingFilter
+
+    def get_queryset(self):
+        if self.action == 'list':
+            return SensorReading.objects.all()
+        return SensorReading.objects.select_related('device', 'sensor')
+
+    def list(self, request, *args, **kwargs):
+        """Keyset-paginated, filterable readings; ?fields=timestamp,pH limits the columns returned."""
+        fields = None
+        if request.query_params.get('fields'):
+            fields = [f.strip() for f in request.query_params['fields'].split(',') if f.strip()]
+            unknown = set(fields) - set(SensorReadingListSerializer.COLUMNS)
+            if unknown:
+                return Response(
+                    {'error': f"Unknown fields: {', '.join(sorted(unknown))}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        columns = {'id', 'timestamp'}
+        columns.update(SensorReadingListSerializer.COLUMNS[f] for f in (fields or SensorReadingListSerializer.COLUMNS))
+
+        queryset = self.filter_queryset(self.get_queryset()).values(*columns)
+        rows = self.paginate_queryset(queryset)
+        attach_related_names(rows)
+
+        serializer = SensorReadingListSerializer(rows, many=True, fields=fields)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def aggregate(self, request):
+        """
+        Min/max/mean/count/last per bucket from the rollup tables.
+
+        Query params: device (id or name), parameter (comma separated
+        SensorReading fields), start/end (ISO 8601, default last 24h) and
+        points (point budget). The finest resolution whose bucket count fits
+        in the budget is used.
+        """
+        from device.rollups import bucket_start, choose_resolution
+
+        device = lookup_device(request.query_params.get('device'))
+        if device is None:
+            return Response({'error': 'Unknown or missing device'}, status=status.HTTP_400_BAD_REQUEST)
+
+        parameters = [p for p in request.query_params.get('parameter', '').split(',') if p]
+        unknown = set(parameters) - set(SensorReading.MEASUREMENT_FIELDS)
+        if not parameters or unknown:
+            return Response(
+                {'error': f"parameter must be a comma separated list of {', '.join(SensorReading.MEASUREMENT_FIELDS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            end = parse_moment(request.query_params.get('end')) or timezone.now()
+            start = parse_moment(request.query_params.get('start')) or end - timedelta(hours=24)
+            points = int(request.query_params.get('points', getattr(settings, 'AGGREGATE_MAX_POINTS', 1000)))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if start >= end or points < 1:
+            return Response({'error': 'start must be before end and points positive'}, status=status.HTTP_400_BAD_REQUEST)
+
+        resolution = choose_resolution(start, end, points)
+        rows = SensorReadingRollup.objects.filter(
+            device=device,
+            parameter__in=parameters,
+            resolution=resolution,
+            bucket__gte=bucket_start(start, resolution),
+            bucket__lt=end,
+        ).order_by('parameter', 'bucket').values_list(
+            'parameter', 'bucket', 'min_value', 'max_value', 'sum_value', 'count', 'last_value'
+        )
+
+        series = {parameter: [] for parameter in parameters}
+        for parameter, bucket, min_value, max_value, sum_value, count, last_value in rows:
+            series[parameter].append({
+                't': bucket.isoformat(),
+                'min': min_value,
+                'max': max_value,
+                'mean': sum_value / count if count else None,
+                'count': count,
+                'last': last_value,
+            })
+
+        return Response({
+            'device': device.name,
+            'resolution': resolution,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'series': series,
+        })
 
 
 class MQTTBrokerViewSet(viewsets.ModelViewSet):
@@ -84,3 +285,50 @@ def get_sensor_schema(request):
         "model": "SensorReading",
         "fields": fields
     }, json_dumps_params={"indent": 2})
+
+
+# --- Streaming Bulk Export ---
+
+def export_sensor_readings(request):
+    """
+    Stream readings as ?format=csv|ndjson|parquet|arrow without building the
+    result in memory, under WSGI and ASGI alike. Accepts the reading list
+    filters (device, sensor_type, start, end) plus ?parameter=pH,temperature
+    to pick columns.
+    """
+    from django.core.handlers.asgi import ASGIRequest
+    from device.export import EXPORT_FORMATS, ExportError, aiter_export, stream_export
+
+    fmt = request.GET.get('format', 'csv')
+    filterset = SensorReadingFilter(data=request.GET, queryset=SensorReading.objects.all())
+    if not filterset.is_valid():
+        return JsonResponse({"error": filterset.errors}, status=400)
+
+    parameters = [p for p in request.GET.get('parameter', '').split(',') if p]
+    try:
+        stream = stream_export(
+            filterset.qs, fmt, parameters,
+            chunk_size=getattr(settings, 'EXPORT_CHUNK_SIZE', 5000)
+        )
+    except ExportError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    if isinstance(request, ASGIRequest):
+        stream = aiter_export(stream)
+
+    content_type, extension = EXPORT_FORMATS[fmt]
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="sensor-readings.{extension}"'
+    return response
+
+
+# --- Ingest Pipeline Metrics ---
+
+def ingest_stats(request):
+    # Published by the ingest worker(s) and any web process that writes
+    # telemetry; reading them here starts nothing in this process.
+    from device.ingest import published_metrics
+
+    return JsonResponse({
+        "workers": published_metrics()
+    }, json_dumps_params={"indent": 2})
@@ -1,9 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 class MapsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'maps'
 
     def ready(self):
+        # Run `manage.py mqtt_listener` instead unless MQTT_AUTOSTART is set
+        if not settings.MQTT_AUTOSTART:
+            return
         from .mqtt_client import start_mqtt
         start_mqtt()
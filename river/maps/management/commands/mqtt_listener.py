@@ -1,3 +1,4 @@
+import threading
 from django.core.management.base import BaseCommand
 from maps.mqtt_client import start_mqtt
 
@@ -6,4 +7,10 @@ class Command(BaseCommand):
 
     def handle(self, *args, **kwargs):
         self.stdout.write(self.style.SUCCESS("Starting MQTT listener..."))
-        start_mqtt()
+        client = start_mqtt()
+        try:
+            # loop_start() runs the network loop in a background thread; keep the command alive
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            client.loop_stop()
+            client.disconnect()
@@ -4,11 +4,13 @@ import paho.mqtt.client as mqtt
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
-MQTT_BROKER = "92b7e65bda9c471984d325f2818f92b2.s1.eu.hivemq.cloud"
-MQTT_PORT = 8883
-MQTT_USERNAME = "donfrass"
-MQTT_PASSWORD = "Monkey1991"
-MQTT_TOPIC = "devices/river-watcher-23/telemetry"
+from django.conf import settings
+
+MQTT_BROKER = settings.MQTT_BROKER_HOST
+MQTT_PORT = settings.MQTT_BROKER_PORT
+MQTT_USERNAME = settings.MQTT_USERNAME
+MQTT_PASSWORD = settings.MQTT_PASSWORD
+MQTT_TOPIC = settings.MQTT_TOPIC
 
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
@@ -36,8 +38,10 @@ def on_message(client, userdata, msg):
 def start_mqtt():
     client = mqtt.Client(protocol=mqtt.MQTTv311)
     client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-    client.tls_set(tls_version=ssl.PROTOCOL_TLS)
+    if settings.MQTT_USE_TLS:
+        client.tls_set(tls_version=ssl.PROTOCOL_TLS)
     client.on_connect = on_connect
     client.on_message = on_message
     client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
     client.loop_start()
+    return client
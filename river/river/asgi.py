@@ -5,6 +5,7 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 
 # Import WebSocket routes
+from alerts.routing import websocket_urlpatterns as alerts_ws
 from device.routing import websocket_urlpatterns as device_ws
 from maps.routing import websocket_urlpatterns as maps_ws
 
@@ -18,7 +19,7 @@ django.setup()
 django_asgi_app = get_asgi_application()
 
 # Combine all WebSocket routes
-websocket_routes = device_ws + maps_ws
+websocket_routes = device_ws + maps_ws + alerts_ws
 
 # Define the ASGI application
 application = ProtocolTypeRouter({
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 
+from decouple import config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -90,23 +92,28 @@ WSGI_APPLICATION = 'river.wsgi.application'
 
 
 # Redis backend for Channels
-
-
-
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {
-            "hosts": [("127.0.0.1", 6379)],
+# The ingest worker (`python manage.py ingest`) is a separate process, so its
+# broadcasts only reach the ASGI server's WebSocket clients through Redis.
+# Without REDIS_URL the in-memory layer is used, which only works with
+# everything in one process (MQTT_AUTOSTART); the ingest command refuses to
+# start on it.
+REDIS_URL = config('REDIS_URL', default='')   # e.g. redis://127.0.0.1:6379/0
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL],
+            },
         },
-    },
-}
-
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-    },
-}
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
 
 
 
@@ -115,7 +122,6 @@ CHANNEL_LAYERS = {
 
 
 
-from decouple import config
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -216,3 +222,138 @@ REST_FRAMEWORK = {
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # for development
 DEFAULT_FROM_EMAIL = 'admin@example.com'
+
+
+# MQTT broker (device/mqtt_client.py, device/aio_ingest.py)
+MQTT_BROKER_HOST = config('MQTT_BROKER_HOST', default='92b7e65bda9c471984d325f2818f92b2.s1.eu.hivemq.cloud')
+MQTT_BROKER_PORT = config('MQTT_BROKER_PORT', default=8883, cast=int)
+MQTT_USERNAME = config('MQTT_USERNAME', default='donfrass')
+MQTT_PASSWORD = config('MQTT_PASSWORD', default='Monkey1991')
+MQTT_USE_TLS = config('MQTT_USE_TLS', default=True, cast=bool)
+MQTT_TOPIC = config('MQTT_TOPIC', default='devices/river-watcher-23/telemetry')
+# <topic>/json|msgpack|cbor|struct (or an MQTT v5 content type) selects the
+# payload codec, see device/codecs.py
+MQTT_PROTOCOL_VERSION = config('MQTT_PROTOCOL_VERSION', default=5, cast=int)   # 5 or 311, ingest worker only
+# Devices publish "online"/"offline" here, with "offline" as their Last Will
+MQTT_STATUS_TOPIC = config('MQTT_STATUS_TOPIC', default='devices/+/status')
+# Ingestion runs in its own process: `python manage.py ingest`. Only set this
+# to start the old threaded listeners inside every Django process instead.
+MQTT_AUTOSTART = config('MQTT_AUTOSTART', default=False, cast=bool)
+MQTT_SHARED_GROUP = config('MQTT_SHARED_GROUP', default='')   # "$share/<group>/" subscription when set
+# For a local broker (e.g. `docker run -p 1883:1883 eclipse-mosquitto`) set
+# MQTT_BROKER_HOST=localhost MQTT_BROKER_PORT=1883 MQTT_USE_TLS=False.
+
+
+# Ingest pipeline (device/ingest.py)
+# Telemetry is queued by the MQTT callback and written in batches by a worker thread.
+INGEST_BATCH_SIZE = 500          # flush once this many messages are waiting
+INGEST_FLUSH_INTERVAL = 1.0      # ... or after this many seconds
+INGEST_QUEUE_SIZE = 10000        # bounded queue between MQTT thread and writer
+INGEST_BACKPRESSURE = 'drop_oldest'  # 'block', 'drop_newest' or 'drop_oldest'
+INGEST_BLOCK_TIMEOUT = 1.0       # seconds to wait for room with the 'block' policy
+INGEST_PARTITION = config('INGEST_PARTITION', default='shared')   # 'shared' or 'hash' (see device/aio_ingest.py)
+INGEST_MEMBERSHIP_TOPIC = 'river/ingest/workers'   # retained worker heartbeats in 'hash' mode
+INGEST_HEARTBEAT_INTERVAL = 10.0     # seconds
+INGEST_MEMBER_TIMEOUT = 30.0         # seconds without a heartbeat before a worker's devices move
+# One spool file per worker: "{worker_id}" is replaced by the worker's
+# --client-id (default: the host name), so a restarted worker finds and
+# drains what it spooled before. Workers sharing a host need a --client-id each.
+INGEST_SPOOL_PATH = config('INGEST_SPOOL_PATH', default=str(BASE_DIR / 'ingest-spool-{worker_id}.sqlite3'))  # '' disables the spool
+INGEST_SPOOL_INTERVAL = 0.1          # seconds between appends to the spool
+INGEST_MAX_CLOCK_SKEW = 300          # seconds; device timestamps further in the future use arrival time
+INGEST_MAX_BATCH_SAMPLES = 10000     # largest batch envelope ({"samples": [...]} / {"columns": {...}}) accepted
+INGEST_METRICS_INTERVAL = 10.0       # seconds between metrics published to the cache for /api/ingest/stats/
+IDENTITY_CACHE_SIZE = 10000      # device/sensor -> pk entries kept by device/identity.py
+IDENTITY_CACHE_TTL = 300.0       # seconds before an entry is looked up again (changes made by other processes)
+READING_STORAGE = 'wide'         # 'wide': one SensorReading row per message, 'per_sensor': legacy row per sensor
+
+
+# Device presence (device/presence.py)
+# Last-seen times are kept in memory and flushed in bulk; online/offline
+# changes are pushed to ws/presence/.
+PRESENCE_TIMEOUT = 300.0         # seconds without a message before a device is marked offline
+PRESENCE_FLUSH_INTERVAL = 10.0   # seconds between last-seen flushes and timeout sweeps
+
+
+# SensorReading partitioning (device/partitions.py, `manage.py partition_readings`)
+# Run the command from cron at least once per period, e.g. daily.
+SENSOR_READING_PARTITION_INTERVAL = 'week'   # 'day' or 'week'
+SENSOR_READING_PARTITIONS_AHEAD = 2          # future periods to pre-create
+SENSOR_READING_RETENTION_DAYS = None         # drop raw partitions older than this; None keeps everything
+SENSOR_READING_ROLLUP_ON_EXPIRE = True       # compact expired partitions into SensorReadingRollup first
+SENSOR_READING_ROLLUP_RESOLUTION = '1h'
+
+
+# Pre-aggregated rollups (device/rollups.py)
+INGEST_ROLLUPS = True            # maintain 1m/1h/1d SensorReadingRollup buckets as readings are written
+INGEST_DEVICE_STATE = True       # upsert each device's latest values into DeviceState (device/state.py)
+AGGREGATE_MAX_POINTS = 1000      # default point budget for /api/sensor-readings/aggregate/
+
+# Decimated chart series (/api/devices/<id>/series/, device/series.py)
+SERIES_DEFAULT_POINTS = 500       # points per parameter when the client does not ask
+SERIES_MAX_POINTS = 5000          # hard cap on points per parameter
+SERIES_RAW_MAX_SPAN_HOURS = 48    # longer ranges are read from rollups
+SERIES_RAW_MAX_ROWS = 200000      # ... and so are shorter ones with more raw readings than this
+
+
+# Rule-based alerting (alerts/engine.py)
+INGEST_ALERTS = True             # evaluate AlertRules on every ingest batch
+ALERT_STATE_CHECKPOINT_INTERVAL = 60   # seconds between AlertRuleState checkpoints of streaming rules
+ALERT_RULES_TTL = 60.0                 # seconds before the engine reloads AlertRules changed without signals
+ALERT_WINDOW_MAX_SAMPLES = 1000        # cap on readings kept per device by windowed rules
+
+
+# Alert delivery (alerts/delivery.py)
+# New alerts are queued and pushed by a worker thread to every sink below.
+ALERT_DELIVERY = True
+ALERT_SINKS = [
+    {'class': 'alerts.delivery.ChannelsSink'},                         # ws/alerts/
+    {'class': 'alerts.delivery.EmailSink', 'recipients': []},          # add addresses to enable
+    # {'class': 'alerts.delivery.WebhookSink', 'url': 'https://example.com/hooks/river'},
+]
+ALERT_DELIVERY_BATCH_SIZE = 100
+ALERT_DELIVERY_FLUSH_INTERVAL = 2.0    # seconds
+ALERT_DELIVERY_QUEUE_SIZE = 10000
+ALERT_DELIVERY_MAX_RETRIES = 5
+ALERT_DELIVERY_BACKOFF = 1.0           # seconds, doubled on every retry
+ALERT_RATE_LIMIT = 5                   # alerts per device per window sent to email/webhook sinks
+ALERT_RATE_WINDOW = 3600               # seconds
+
+
+# Bulk export (device/export.py)
+EXPORT_CHUNK_SIZE = 5000         # rows per server-side cursor fetch / Parquet row group
+
+
+# Dashboard fan-out (device/consumers.py SensorDataConsumer)
+SENSOR_BROADCAST_INTERVAL = 1.0      # seconds; at most one frame per device per client per interval
+SENSOR_BROADCAST_MIN_INTERVAL = 0.1  # lowest interval a client may negotiate
+
+
+# Streaming device WebSocket protocol (device/consumers.py DeviceConsumer,
+# subprotocols river.stream.msgpack / river.stream.cbor / river.stream.json)
+DEVICE_STREAM_ACK_EVERY = 100        # cumulative ack after this many stored/failed/rejected frames
+DEVICE_STREAM_ACK_INTERVAL = 0.2     # ... or this many seconds after the first one
+
+
+# Latest-state snapshot sent to dashboards on connect (device/snapshot.py)
+# The snapshot, presence times and worker metrics are shared between the
+# ingest worker and the ASGI server through this cache, so it is Redis
+# whenever REDIS_URL is set. LocMem is per process: only for running
+# everything in one process (MQTT_AUTOSTART).
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+SENSOR_SNAPSHOT_TTL = 60             # seconds a spliced snapshot is kept (every flush drops it anyway)
+SENSOR_SNAPSHOT_FALLBACK_TTL = 30    # seconds a snapshot rebuilt from the database is trusted
+SENSOR_SNAPSHOT_BUILD_WAIT = 2.0     # seconds to wait for another client's rebuild before doing our own
+SENSOR_DEVICE_INDEX_TTL = 600        # seconds before the snapshot's device list is read from the database again